@@ -0,0 +1,337 @@
+"""
+Benchmark the stages of the analysis pipeline on synthetic datasets (see synthetic.py), so performance can be
+tracked without a live target, GDB or network access. Each stage runs in a fresh process; its wall time is
+measured over several repetitions, then one more traced repetition records the peak of Python/NumPy allocations.
+Peak RSS of the worker process is reported as well. Results are written as JSON and can be compared
+against an earlier results file to flag regressions.
+Example: python benchmark.py --scale small --out bench_small.json
+Example: python benchmark.py --scale medium --stages build_graph refine --engines numpy --baseline bench_old.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import data_structures
+import build_graph
+import graph_util
+import synthetic
+import fingerprint
+import leak_scanner
+
+"""
+Dataset sizes of the --scale presets: (runs, regions, heaps, heap_kb)
+"""
+SCALES = {
+    "tiny" : (3, 32, 1, 256),
+    "small" : (3, 64, 2, 1024),
+    "medium" : (5, 256, 4, 8192),
+    "large" : (10, 1024, 8, 32768),
+}
+
+STAGES = ["build_graph", "rank", "analyze", "scc", "refine", "leak_scan"]
+
+
+"""
+Number of edges in a memory graph
+"""
+def count_edges(mg):
+    return sum([len(elist) for dsts in mg.adj_matrix.values() for elist in dsts.values()])
+
+"""
+Load the maplists and memory graphs of every run in a dataset
+returns (file prefixes, maplists, memgraphs)
+"""
+def load_runs(dataset, sparse=False):
+    prefixes = [dataset + rn + "_" for rn in data_structures.list_runs(dataset)]
+    maplists = [data_structures.MapList(load_file=prefix + "maplist.json") for prefix in prefixes]
+    memgraphs = [data_structures.MemoryGraph(load_file=data_structures.memgraph_path(prefix), sparse=sparse) for prefix in prefixes]
+    return prefixes, maplists, memgraphs
+
+
+# Stage setups take (dataset directory, dataset description, variant, jobs), load whatever the stage
+# needs outside of the timed region, and return a function that runs the stage once and returns a
+# dictionary of statistics about its output (used to check that variants agree).
+
+"""
+Scan every dump of every run into a memory graph. Variants are the scan engines, and "parallel"
+for `build_graphs_parallel` with the numpy engine.
+"""
+def setup_build_graph(dataset, desc, variant, jobs):
+    prefixes = [dataset + rn + "_" for rn in data_structures.list_runs(dataset)]
+    maplists = [data_structures.MapList(load_file=prefix + "maplist.json") for prefix in prefixes]
+
+    def run():
+        if variant == "parallel":
+            mgs = build_graph.build_graphs_parallel(maplists, prefixes, jobs)
+        else:
+            mgs = [build_graph.build_graph_from_dumps(ml, dumpname=prefix, engine=variant) for ml, prefix in zip(maplists, prefixes)]
+        return {"edges" : sum([count_edges(mg) for mg in mgs])}
+    return run
+
+"""
+Rank pointer destinations by frequency across the heaps of every run. Variant "dict" is the
+`RunContainer.rank_most_frequent` tally, "ranking" builds a `PointerRanking`.
+"""
+def setup_rank(dataset, desc, variant, jobs):
+    rundata = [data_structures.RunContainer(rn, heapnames=desc["heapnames"], path=dataset) for rn in data_structures.list_runs(dataset)]
+
+    def run():
+        if variant == "dict":
+            pointer_dict = {}
+            for rd in rundata:
+                rd.rank_most_frequent(pointer_dict)
+            ranked = sorted(pointer_dict.items(), key=lambda kv : kv[1], reverse=True)
+            return {"pointers" : len(ranked), "top" : list(ranked[0][0])}
+        ranking = data_structures.PointerRanking(rundata)
+        return {"pointers" : len(ranking), "top" : list(ranking.get(0)[0])}
+    return run
+
+"""
+Run analyze.py (ranking, window bounds and the leave-one-out cross validation) on the most frequent
+pointer. The script runs in its own process, after one untimed run that fills the ranking cache.
+Its exit status is recorded rather than raised: analyze.py exits early when no run's filter matches
+the held-out run, which small datasets with few runs can hit.
+Variant "read" reads the heaps through file handles, "mmap" passes --mmap.
+"""
+def setup_analyze(dataset, desc, variant, jobs):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "analyze.py"), dataset, "--heapnames"] + desc["heapnames"]
+    if variant == "mmap":
+        cmd.append("--mmap")
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def run():
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        out = proc.stdout.read().decode()
+        _, status, usage = os.wait4(proc.pid, 0)
+        stats = {"exit_status" : os.waitstatus_to_exitcode(status), "child_maxrss_kb" : usage.ru_maxrss}
+        for line in out.splitlines():
+            if line.startswith("TOTAL TPR") or line.startswith("TOTAL FPR"):
+                stats[line.split(":")[0].split()[1].lower()] = float(line.split()[2])
+        return stats
+    return run
+
+"""
+Strongly connected components of every run's memory graph. Variant "scc" is `find_scc`,
+"reach" also builds the `ReachabilityIndex` closure.
+"""
+def setup_scc(dataset, desc, variant, jobs):
+    _, _, memgraphs = load_runs(dataset)
+
+    def run():
+        sccs = 0
+        for mg in memgraphs:
+            if variant == "reach":
+                sccs += len(graph_util.ReachabilityIndex(mg.adj_matrix).scc_sizes)
+            else:
+                sccs += len(graph_util.find_scc(mg.adj_matrix)[0])
+        return {"sccs" : sccs}
+    return run
+
+"""
+Fold every run into a `RefinementState` and extract the refined graph, as refine_memory_map.py does.
+Variant "all" keeps edges seen in every run, "quorum" those seen in a majority.
+"""
+def setup_refine(dataset, desc, variant, jobs):
+    prefixes, maplists, memgraphs = load_runs(dataset, sparse=True)
+    quorum = len(prefixes) if variant == "all" else len(prefixes) // 2 + 1
+
+    def run():
+        state = data_structures.RefinementState()
+        for i, prefix in enumerate(prefixes):
+            state.fold("run{}".format(i), memgraphs[i], maplists[i], data_structures.file_stamp(data_structures.memgraph_path(prefix)))
+        return {"edges" : count_edges(state.graph(quorum))}
+    return run
+
+"""
+Replay the heaps of run 0 through a local unix socket into leak_scanner.py's asyncio matcher, with the
+fingerprints of the two most frequent pointers. leak_replay.py runs in its own process as the stand-in
+leak source. Variant "stream" sends the heaps contiguously, "leaks" sends length-prefixed buffers of up to
+64 KiB from random offsets (as many bytes in total), matched with unaligned fingerprints.
+"""
+def setup_leak_scan(dataset, desc, variant, jobs):
+    rundata = [data_structures.RunContainer(rn, heapnames=desc["heapnames"], path=dataset) for rn in data_structures.list_runs(dataset)]
+    ranking = data_structures.PointerRanking(rundata)
+    candidates = [(r, region, offset) for r, ((region, offset), _) in enumerate(ranking.top(2))]
+    fps = [res["fingerprint"] for res in fingerprint.cross_validate_candidates(rundata, candidates, 32, 32) if "error" not in res]
+    if variant == "leaks":
+        fps = leak_scanner.unaligned(fps)
+
+    dumps = [build_graph.dump_filename(dataset + rundata[0].runname + "_", name) for name in desc["heapnames"]]
+    total = sum([os.path.getsize(d) for d in dumps])
+    sock = os.path.join(tempfile.mkdtemp(), "leaks.sock")
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "leak_replay.py")] + dumps + [
+        "--target", "unix:" + sock, "--mode", variant, "--count", str(2 * total // leak_scanner.LEAK_MAX)]
+
+    async def scan():
+        tally = leak_scanner.BaseTally(fps)
+        ready = asyncio.Event()
+        server = asyncio.ensure_future(leak_scanner.scan_source("unix:" + sock, fps, tally, variant == "leaks", connections=1, ready=ready))
+        await ready.wait()
+        replayer = await asyncio.create_subprocess_exec(*cmd, stderr=subprocess.DEVNULL)
+        stats = (await server)[0]
+        await replayer.wait()
+        return stats, tally
+
+    def run():
+        stats, tally = asyncio.run(scan())
+        return {"bytes" : stats["bytes"], "leaks" : stats["leaks"], "matches" : sum(tally.matches),
+            "mb_per_s" : stats["bytes"] / max(stats["seconds"], 1e-9) / 1e6}
+    return run
+
+SETUPS = {
+    "build_graph" : setup_build_graph,
+    "rank" : setup_rank,
+    "analyze" : setup_analyze,
+    "scc" : setup_scc,
+    "refine" : setup_refine,
+    "leak_scan" : setup_leak_scan,
+}
+
+"""
+Default variants of each stage. The build_graph variants come from --engines
+"""
+VARIANTS = {
+    "rank" : ["dict", "ranking"],
+    "analyze" : ["read", "mmap"],
+    "scc" : ["scc", "reach"],
+    "refine" : ["all", "quorum"],
+    "leak_scan" : ["stream", "leaks"],
+}
+
+
+"""
+Run one (stage, variant) inside a worker process
+repeat = number of timed repetitions
+trace = do one extra repetition under tracemalloc to measure peak allocations
+returns a result dictionary (see README)
+"""
+def run_stage(stage, variant, dataset, desc, repeat, trace, jobs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = SETUPS[stage](dataset, desc, variant, jobs)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            stats = run()
+            times.append(time.perf_counter() - t0)
+
+        peak_alloc = None
+        if trace:
+            tracemalloc.start()
+            run()
+            peak_alloc = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    return {
+        "stage" : stage,
+        "variant" : variant,
+        "seconds" : times,
+        "best_s" : min(times),
+        "median_s" : statistics.median(times),
+        "peak_alloc_bytes" : peak_alloc,
+        "rss_before_kb" : rss_before,
+        "peak_rss_kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "stats" : stats,
+    }
+
+"""
+Compare results against a baseline results file
+returns a list of (stage, variant, baseline median, median) for every pair that got slower
+than `threshold` times the baseline
+"""
+def find_regressions(results, baseline, threshold):
+    old = {(r["stage"], r["variant"]) : r["median_s"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        key = (r["stage"], r["variant"])
+        if key in old and r["median_s"] > threshold * old[key]:
+            regressions.append((r["stage"], r["variant"], old[key], r["median_s"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=list(SCALES.keys()), default="small", help="dataset size preset. Overridden by --runs/--regions/--heaps/--heap_kb")
+    parser.add_argument("--runs", type=int, default=None, help="number of runs in the dataset")
+    parser.add_argument("--regions", type=int, default=None, help="approximate number of regions per maplist")
+    parser.add_argument("--heaps", type=int, default=None, help="number of [heap] regions")
+    parser.add_argument("--heap_kb", type=int, default=None, help="size of each heap region in KiB")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic dataset")
+    parser.add_argument("--dump_all", action='store_true', help="Dump (and scan) every region of the dataset, not just the heaps")
+    parser.add_argument("--datadir", type=str, default="bench_data", help="directory the generated datasets are cached in")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="stages to benchmark")
+    parser.add_argument("--engines", nargs="+", choices=["numpy", "python", "parallel"], default=["numpy", "python"], help="build_graph variants to benchmark")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes of the 'parallel' build_graph variant")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions of each stage")
+    parser.add_argument("--notrace", action='store_true', help="Skip the extra tracemalloc repetition that measures peak allocations")
+    parser.add_argument("--out", type=str, default="bench_results.json", help="file to write the results to")
+    parser.add_argument("--baseline", type=str, default=None, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="report a regression when a median time exceeds the baseline's by this factor")
+    args = parser.parse_args()
+
+    runs, regions, heaps, heap_kb = SCALES[args.scale]
+    runs = runs if args.runs is None else args.runs
+    regions = regions if args.regions is None else args.regions
+    heaps = heaps if args.heaps is None else args.heaps
+    heap_kb = heap_kb if args.heap_kb is None else args.heap_kb
+
+    # generated datasets are reused across invocations with the same parameters
+    dataset = "{}/r{}_g{}_h{}x{}k_s{}{}/".format(args.datadir, runs, regions, heaps, heap_kb, args.seed, "_all" if args.dump_all else "")
+    desc = synthetic.load_description(dataset)
+    if desc is None:
+        print("Generating {}...".format(dataset))
+        t0 = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            desc = synthetic.generate_dataset(dataset, runs, regions, heaps, heap_kb, args.seed, dump_all=args.dump_all)
+        print("Generated in {:.1f}s".format(time.time() - t0))
+
+    results = []
+    ctx = multiprocessing.get_context("spawn") # fresh interpreter per stage, so peak RSS isn't inherited
+    for stage in args.stages:
+        for variant in (args.engines if stage == "build_graph" else VARIANTS[stage]):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result = pool.submit(run_stage, stage, variant, dataset, desc, args.repeat, not args.notrace, args.jobs).result()
+            results.append(result)
+            print("{:12s} {:8s} median {:9.4f}s  best {:9.4f}s  peak alloc {:>8s}  peak rss {:7.1f} MB  {}".format(
+                stage, variant, result["median_s"], result["best_s"],
+                "-" if result["peak_alloc_bytes"] is None else "{:.1f} MB".format(result["peak_alloc_bytes"] / 1e6),
+                result["peak_rss_kb"] / 1e3, result["stats"]))
+
+    report = {
+        "dataset" : desc,
+        "environment" : {
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+            "platform" : platform.platform(),
+            "cpus" : os.cpu_count(),
+        },
+        "repeat" : args.repeat,
+        "results" : results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Wrote results to {}".format(args.out))
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for stage, variant, old, new in regressions:
+            print("REGRESSION: {} {} {:.4f}s -> {:.4f}s ({:.2f}x)".format(stage, variant, old, new, new / old))
+        if len(regressions) == 0:
+            print("No regressions against {}".format(args.baseline))
@@ -1,7 +1,224 @@
 import os
 import argparse
+import hashlib
 import struct
+import time
+import concurrent.futures
+import numpy as np
 import data_structures
+import dumpstore
+import metrics
+
+
+"""
+Number of bytes read from a dump at a time by the NumPy scan engine
+"""
+SCAN_CHUNK_SZ = 1 << 26
+
+
+"""
+Resolve every pointer-sized word of a buffer against the mapped regions
+buf = bytes-like object holding the words to scan. A trailing partial word is zero-extended
+      in the same way int.from_bytes treats a short read.
+base_offset = offset of the start of buf within the source region
+frozen = data_structures.FrozenMapList of the target process
+returns (dst_ids, src_offsets, dst_offsets) arrays for every word that lands inside a region,
+ordered by source offset. dst_ids index into frozen.names.
+"""
+def scan_words(buf, base_offset, frozen, pointer_sz=8):
+    nwords = len(buf) // pointer_sz
+    words = np.frombuffer(buf, dtype="<u{}".format(pointer_sz), count=nwords).astype(np.uint64)
+    if len(buf) % pointer_sz:
+        tail = int.from_bytes(bytes(buf[nwords * pointer_sz:]), "little")
+        words = np.append(words, np.uint64(tail))
+
+    region_ids, offsets = frozen.check_pointers(words)
+    word_pos = np.flatnonzero(region_ids >= 0)
+    src_offsets = word_pos.astype(np.uint64) * np.uint64(pointer_sz) + np.uint64(base_offset)
+    return region_ids[word_pos], src_offsets, offsets[word_pos]
+
+
+"""
+Scan a stream of buffers with the NumPy engine. The buffers are treated as consecutive pieces of
+one region; words that straddle two buffers are carried over, so only one buffer is held at a time.
+chunks = iterable of bytes-like objects
+frozen = data_structures.FrozenMapList of the target process
+returns a list of (dst_name, src_offsets, dst_offsets) edge groups. Appending the groups
+to a graph in list order keeps every (src, dst) edge list sorted by source offset.
+"""
+def scan_chunks(chunks, frozen, pointer_sz=8):
+    groups = []
+    offset = 0
+    carry = b""
+
+    for buf in chunks:
+        metrics.count(bytes_read=len(buf))
+        if len(carry) > 0:
+            buf = carry + bytes(buf)
+        whole = len(buf) - len(buf) % pointer_sz
+        carry = bytes(buf[whole:])
+        if whole > 0:
+            groups += group_edges(*scan_words(memoryview(buf)[:whole], offset, frozen, pointer_sz), frozen)
+            offset += whole
+
+    if len(carry) > 0:
+        # trailing partial word, zero-extended like a short file read
+        groups += group_edges(*scan_words(carry, offset, frozen, pointer_sz), frozen)
+
+    metrics.count(words=(offset + len(carry) + pointer_sz - 1) // pointer_sz)
+    return groups
+
+
+"""
+Split resolved pointers into per-destination edge groups
+dst_ids, src_offsets, dst_offsets = output of `scan_words`, ordered by source offset
+frozen = data_structures.FrozenMapList the dst_ids refer to
+returns a list of (dst_name, src_offsets, dst_offsets) edge groups
+"""
+def group_edges(dst_ids, src_offsets, dst_offsets, frozen):
+    # stable sort keeps the edges of each (src, dst) pair in source offset order
+    order = np.argsort(dst_ids, kind="stable")
+    dst_ids, src_offsets, dst_offsets = dst_ids[order], src_offsets[order], dst_offsets[order]
+    uniq, first = np.unique(dst_ids, return_index=True)
+    bounds = list(first) + [len(dst_ids)]
+    return [(frozen.names[d], src_offsets[bounds[j]:bounds[j+1]].tolist(), dst_offsets[bounds[j]:bounds[j+1]].tolist())
+        for j, d in enumerate(uniq)]
+
+
+"""
+Value ranges a word must fall in to be kept as a possible pointer in the page scan cache:
+user space above the default vm.mmap_min_addr, and the [vsyscall] page. The cache is
+only used for runs whose mapped regions all lie within these ranges.
+"""
+CANDIDATE_RANGES = [(1 << 16, 1 << 47), (0xffffffffff600000, 0xffffffffff601000)]
+
+"""
+Words of a page that could be pointers in some run, see CANDIDATE_RANGES
+page = bytes of the page
+returns (offsets within the page as uint32, word values as uint64)
+"""
+def candidate_words(page, pointer_sz=8):
+    nwords = len(page) // pointer_sz
+    words = np.frombuffer(page, dtype="<u{}".format(pointer_sz), count=nwords).astype(np.uint64)
+    if len(page) % pointer_sz:
+        words = np.append(words, np.uint64(int.from_bytes(page[nwords * pointer_sz:], "little")))
+
+    keep = np.zeros(len(words), dtype=bool)
+    for lo, hi in CANDIDATE_RANGES:
+        keep |= (words >= np.uint64(lo)) & (words < np.uint64(hi))
+    pos = np.flatnonzero(keep)
+    return (pos * pointer_sz).astype(np.uint32), words[pos]
+
+"""
+Whether every region of a map lies within CANDIDATE_RANGES, so that a scan restricted to candidate words finds every pointer
+"""
+def candidates_cover(frozen):
+    covered = np.zeros(len(frozen.starts), dtype=bool)
+    for lo, hi in CANDIDATE_RANGES:
+        covered |= (frozen.starts >= np.uint64(lo)) & (frozen.ends <= np.uint64(hi))
+    return bool(covered.all())
+
+"""
+Scan a region stored as a .pages list in a dumpstore.PageStore. The candidate words of every page are
+cached in the store, so pages already seen in other runs (or other regions) are not scanned again;
+only their candidates are resolved against this run's map, relocated to the page's offset in the region.
+filename = .pages file of the region
+frozen = data_structures.FrozenMapList of the target process
+store = dumpstore.PageStore holding the pages
+added = optional dictionary that receives the cache entries of the pages this call had to scan
+returns edge groups in the same format as `scan_chunks`
+"""
+def scan_paged_dump(filename, frozen, pointer_sz, store, added=None):
+    with dumpstore.PagedDump(filename, store) as paged:
+        if not candidates_cover(frozen) or paged.block_size % pointer_sz:
+            return scan_chunks(iter(lambda : paged.read(SCAN_CHUNK_SZ), b""), frozen, pointer_sz)
+
+        cache = store.scan_cache(pointer_sz)
+        positions, values = [], []
+        misses = 0
+        for k, page_id in enumerate(paged.page_ids.tolist()):
+            if page_id < 0:
+                continue # zero page
+            if page_id not in cache:
+                cache[page_id] = candidate_words(store.get(page_id), pointer_sz)
+                misses += 1
+                if added is not None:
+                    added[page_id] = cache[page_id]
+            pos, vals = cache[page_id]
+            positions.append(pos.astype(np.uint64) + np.uint64(k * paged.block_size))
+            values.append(vals)
+        metrics.count(bytes_read=misses * paged.block_size, words=len(paged.page_ids) * paged.block_size // pointer_sz, cached_pages=len(positions) - misses)
+
+    if len(values) == 0:
+        return []
+    positions = np.concatenate(positions)
+    region_ids, offsets = frozen.check_pointers(np.concatenate(values))
+    hit = np.flatnonzero(region_ids >= 0)
+    return group_edges(region_ids[hit], positions[hit], offsets[hit], frozen)
+
+
+"""
+Iterate over a dump in SCAN_CHUNK_SZ pieces. Compressed dumps are read through dumpstore.
+"""
+def iter_file_chunks(filename, chunk_sz=None):
+    chunk_sz = chunk_sz or SCAN_CHUNK_SZ
+    with dumpstore.open_dump(filename) as f:
+        buf = f.read(chunk_sz)
+        while buf:
+            yield buf
+            buf = f.read(chunk_sz)
+
+
+"""
+Scan a dump file with the NumPy engine
+filename = path of the dump file
+frozen = data_structures.FrozenMapList of the target process
+returns edge groups in the same format as `scan_chunks`
+"""
+def scan_dump_numpy(filename, frozen, pointer_sz=8):
+    return scan_chunks(iter_file_chunks(filename), frozen, pointer_sz)
+
+
+"""
+Scan a dump file one word at a time with MapList.check_pointer.
+This is the original scalar engine, kept as a reference for the NumPy engine.
+returns edge groups in the same format as `scan_dump_numpy`
+"""
+def scan_dump_python(filename, maplist, pointer_sz=8):
+    groups = []
+    with dumpstore.open_dump(filename) as f:
+
+        offset = 0
+        raw_mem = f.read(pointer_sz)
+        while raw_mem:
+            val = int.from_bytes(raw_mem, "little")
+            dst = maplist.check_pointer(val)
+
+            if dst:
+                groups.append((dst.name, [offset], [val - dst.start]))
+
+            raw_mem = f.read(pointer_sz)
+            offset += pointer_sz
+    metrics.count(bytes_read=offset, words=offset // pointer_sz)
+    return groups
+
+
+"""
+Names of the regions of a MapList that should be scanned for pointers
+sources, length_lb, length_ub = same as `build_graph_from_dumps`
+"""
+def select_sources(maplist, sources=None, length_lb = -1, length_ub = 2**30):
+    sourcelist = [reg.name for reg in maplist.regions_list if reg.end - reg.start >= length_lb and reg.end - reg.start <= length_ub]
+    if sources:
+        sourcelist = [s for s in sourcelist if "_".join(s.split("_")[:-1]) in sources]
+    return sourcelist
+
+
+"""
+Path of the dump file holding a region. The dump may also be stored compressed, see dumpstore.find_dump.
+"""
+def dump_filename(dumpname, region_name):
+    return "{}.dump".format(dumpname + region_name.split("/")[-1])
 
 
 """
@@ -11,50 +228,310 @@ pointer_sz = number of bytes per pointer in the memory dumpes
 sources = list of names of regions to be scanned for pointers
 length_lb = lower bound on the length of regions to be scanned for pointers
 length_ub = upper bound on the length of regions to be scanned for pointers
+engine = "numpy" to resolve whole chunks of words at once, or "python" for the scalar reference scanner
+sparse = build a sparse MemoryGraph that only stores connected region pairs
 """
-def build_graph_from_dumps(maplist, pointer_sz=8, sources=None, dumpname="", length_lb = -1, length_ub = 2**30):
-    
-    nodelist = [reg.name for reg in maplist.regions_list]
-    sourcelist = [reg.name for reg in maplist.regions_list if reg.end - reg.start >= length_lb and reg.end - reg.start <= length_ub]
-    if sources:
-        sourcelist = [s for s in sourcelist if "_".join(s.split("_")[:-1]) in sources]
+def build_graph_from_dumps(maplist, pointer_sz=8, sources=None, dumpname="", length_lb = -1, length_ub = 2**30, engine="numpy", sparse=False):
+    with metrics.stage("build_graph", dumpname or None):
+        nodelist = [reg.name for reg in maplist.regions_list]
+        sourcelist = select_sources(maplist, sources, length_lb, length_ub)
+
+        memgraph = data_structures.MemoryGraph(nodelist, sourcelist, sparse=sparse)
 
-    memgraph = data_structures.MemoryGraph(nodelist, sourcelist)
+        if engine == "numpy":
+            frozen = maplist.freeze()
+        elif engine != "python":
+            raise ValueError("Unknown scan engine: {}".format(engine))
+
+        store = None # page store of the dataset, opened for the first .pages dump
+        for i,src in enumerate(sourcelist):
+            print("Scanning " + str(src) + " ({}/{})".format(i,len(sourcelist)))
+
+            filename = dump_filename(dumpname, src)
+            found = dumpstore.find_dump(filename)
+            if found is not None:
+                if engine == "numpy" and found.endswith(dumpstore.PAGES_SUFFIX):
+                    if store is None:
+                        store = dumpstore.shared_store(os.path.dirname(found))
+                    groups = scan_paged_dump(found, frozen, pointer_sz, store)
+                elif engine == "numpy":
+                    groups = scan_dump_numpy(filename, frozen, pointer_sz)
+                else:
+                    groups = scan_dump_python(filename, maplist, pointer_sz)
+                for dst, src_offsets, dst_offsets in groups:
+                    memgraph.add_edges(src, dst, src_offsets, dst_offsets)
+                metrics.count(edges=sum([len(g[1]) for g in groups]))
+
+        if store is not None:
+            save_scan_cache(store)
+        return memgraph
+
+
+"""
+Save the scan results cached in a page store, so later runs don't rescan the same pages
+"""
+def save_scan_cache(store):
+    try:
+        store.save()
+    except OSError:
+        pass # e.g. a read-only dataset; the pages are just scanned again next time
 
-    for i,src in enumerate(sourcelist):
-        print("Scanning " + str(src) + " ({}/{})".format(i,len(sourcelist)))
 
-        if os.path.exists("{}.dump".format(dumpname + src.split("/")[-1])):
-            with open("{}.dump".format(dumpname + src.split("/")[-1]), "rb") as f:
+"""
+Scan a region read from a live process, rescanning only the pages whose contents changed since the previous snapshot.
+Every page is hashed as it is read; the edges of unchanged pages are taken from the previous snapshot.
+chunks = iterable of bytes-like objects, consecutive pieces of the region. All but the last must be a whole number of pages.
+frozen = data_structures.FrozenMapList of the target process
+previous = (page hashes, dst ids, src offsets, dst offsets) of the region in the previous snapshot (see
+           data_structures.SnapshotState), or None to scan every page. Only valid if the map is unchanged.
+page_sz = page size the hashes are computed over
+returns (edge groups in the same format as `scan_chunks`, the region's new (page hashes, dst ids, src offsets, dst offsets))
+"""
+def scan_changed_pages(chunks, frozen, pointer_sz, previous, page_sz=dumpstore.PAGE_SZ):
+    hashes, changed = [], []
+    pieces = [] # (dst ids, src offsets, dst offsets) of every rescanned run of pages
+    offset = 0
+    scanned = 0
+    for buf in chunks:
+        if offset % page_sz:
+            raise ValueError("Region chunks must be whole pages")
+        mv = memoryview(buf).cast("B")
+        npages = (len(mv) + page_sz - 1) // page_sz
+        h = np.array([int.from_bytes(hashlib.blake2b(mv[k * page_sz:(k + 1) * page_sz], digest_size=8).digest(), "little")
+            for k in range(npages)], dtype=np.uint64)
+
+        dirty = np.ones(npages, dtype=bool)
+        if previous is not None:
+            old = previous[0][offset // page_sz : offset // page_sz + npages]
+            dirty[:len(old)] = old != h[:len(old)]
+
+        # scan each run of consecutive changed pages in one go
+        bounds = np.flatnonzero(np.diff(np.concatenate([[0], dirty.astype(np.int8), [0]])))
+        for a, b in zip(bounds[0::2].tolist(), bounds[1::2].tolist()):
+            pieces.append(scan_words(mv[a * page_sz : b * page_sz], offset + a * page_sz, frozen, pointer_sz))
+            scanned += len(mv[a * page_sz : b * page_sz])
+
+        hashes.append(h)
+        changed.append(dirty)
+        offset += len(mv)
+
+    hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+    changed = np.concatenate(changed) if changed else np.zeros(0, dtype=bool)
+    if previous is not None:
+        _, dst_ids, src_offsets, dst_offsets = previous
+        pages = (src_offsets // np.uint64(page_sz)).astype(np.int64)
+        keep = np.flatnonzero(pages < len(changed))
+        keep = keep[~changed[pages[keep]]]
+        pieces.append((dst_ids[keep], src_offsets[keep], dst_offsets[keep]))
+
+    metrics.count(bytes_read=offset, words=scanned // pointer_sz, pages=len(changed), changed_pages=int(changed.sum()))
+    if len(pieces) == 0:
+        empty = np.zeros(0, dtype=np.uint64)
+        return [], (hashes, np.zeros(0, dtype=np.int64), empty, empty)
+
+    dst_ids = np.concatenate([p[0] for p in pieces]).astype(np.int64)
+    src_offsets = np.concatenate([p[1] for p in pieces]).astype(np.uint64)
+    dst_offsets = np.concatenate([p[2] for p in pieces]).astype(np.uint64)
+    order = np.argsort(src_offsets, kind="stable")
+    dst_ids, src_offsets, dst_offsets = dst_ids[order], src_offsets[order], dst_offsets[order]
+    return group_edges(dst_ids, src_offsets, dst_offsets, frozen), (hashes, dst_ids, src_offsets, dst_offsets)
+
+
+"""
+Build a memory graph by scanning regions straight out of a live process, without writing dumps.
+Each region is read and scanned one chunk at a time, so memory use is bounded by the chunk size
+(plus the edges found).
+maplist = data_structures.MapList object containing the VMAs of the target process
+read_chunks = function taking a data_structures.Region and yielding its contents as consecutive
+              bytes-like chunks. Regions whose reads raise an exception are skipped.
+pointer_sz, sources, length_lb, length_ub, sparse = same as `build_graph_from_dumps`
+state = data_structures.SnapshotState of an earlier snapshot of the same process. If given, only pages that
+        changed since then are scanned (as long as the map is unchanged), and the state is updated in place.
+"""
+def build_graph_from_reader(maplist, read_chunks, pointer_sz=8, sources=None, length_lb = -1, length_ub = 2**30, sparse=False, state=None):
+    with metrics.stage("build_graph"):
+        nodelist = [reg.name for reg in maplist.regions_list]
+        sourcelist = select_sources(maplist, sources, length_lb, length_ub)
+
+        memgraph = data_structures.MemoryGraph(nodelist, sourcelist, sparse=sparse)
+        frozen = maplist.freeze()
+        patch = state is not None and state.matches(maplist, pointer_sz)
+        regions = {} # new per-region state
 
-                offset = 0
-                raw_mem = f.read(pointer_sz)
-                while raw_mem:
-                    val = int.from_bytes(raw_mem, "little")
-                    dst = maplist.check_pointer(val)
+        for i,src in enumerate(sourcelist):
+            print("Scanning " + str(src) + " ({}/{})".format(i,len(sourcelist)))
+            try:
+                if state is None:
+                    groups = scan_chunks(read_chunks(maplist.find_region(src)), frozen, pointer_sz)
+                else:
+                    previous = state.regions.get(src) if patch else None
+                    groups, regions[src] = scan_changed_pages(read_chunks(maplist.find_region(src)), frozen, pointer_sz, previous, state.page_sz)
+            except Exception:
+                continue # unreadable region, same as a failed dump
+            for dst, src_offsets, dst_offsets in groups:
+                memgraph.add_edges(src, dst, src_offsets, dst_offsets)
+            metrics.count(edges=sum([len(g[1]) for g in groups]))
 
-                    if dst:
-                        memgraph.add_edge(src, dst.name, offset, val - dst.start)
+        if state is not None:
+            state.update(maplist, pointer_sz, regions)
+        return memgraph
 
-                    raw_mem = f.read(pointer_sz)
-                    offset += pointer_sz
 
-    return memgraph
-    
-"""    
+"""
+Copy the regions that would be scanned out of a live process into memory, so that the process
+can be released before `build_graph_from_reader` scans the copies.
+maplist, read_chunks, sources, length_lb, length_ub = same as `build_graph_from_reader`
+returns a dictionary mapping region name to its list of chunks. Regions that can't be read are left out.
+"""
+def copy_regions(maplist, read_chunks, sources=None, length_lb = -1, length_ub = 2**30):
+    with metrics.stage("copy_regions"):
+        copies = {}
+        for src in select_sources(maplist, sources, length_lb, length_ub):
+            try:
+                copies[src] = [bytes(buf) for buf in read_chunks(maplist.find_region(src))]
+            except Exception:
+                continue
+            metrics.count(bytes_read=sum([len(buf) for buf in copies[src]]))
+        return copies
+
+
+"""
+Per-process state for `build_graphs_parallel` workers, filled in by `_init_worker`
+"""
+_worker_maplists = None
+_worker_frozen = {}
+
+def _init_worker(maplists):
+    global _worker_maplists
+    _worker_maplists = maplists
+    _worker_frozen.clear()
+
+"""
+Scan a single (run, source region) dump inside a worker process. Regions in a page store are scanned through
+the worker's shared read-only store (see dumpstore.shared_store), so cached pages aren't scanned again.
+returns (edge groups, wall time in seconds, scan cache entries of the pages the task had to scan)
+"""
+def _scan_task(task):
+    run, filename, pointer_sz, engine = task
+    t0 = time.time()
+    added = {}
+    if engine == "numpy":
+        if run not in _worker_frozen:
+            _worker_frozen[run] = _worker_maplists[run].freeze()
+        found = dumpstore.find_dump(filename)
+        if found.endswith(dumpstore.PAGES_SUFFIX):
+            groups = scan_paged_dump(found, _worker_frozen[run], pointer_sz, dumpstore.shared_store(os.path.dirname(found)), added)
+        else:
+            groups = scan_dump_numpy(filename, _worker_frozen[run], pointer_sz)
+    else:
+        groups = scan_dump_python(filename, _worker_maplists[run], pointer_sz)
+    return groups, time.time() - t0, added
+
+
+"""
+Build the memory graphs of several runs at once, spreading the (run, source region) scans over a process pool.
+The partial edge lists are merged into each run's graph in source order, so the result is identical
+to calling `build_graph_from_dumps` on every run.
+maplists = list of data_structures.MapList objects, one per run
+dumpnames = list of dump file prefixes, one per run
+jobs = number of worker processes
+pointer_sz, sources, length_lb, length_ub, engine, sparse = same as `build_graph_from_dumps`
+"""
+def build_graphs_parallel(maplists, dumpnames, jobs, pointer_sz=8, sources=None, length_lb = -1, length_ub = 2**30, engine="numpy", sparse=False):
+    if engine not in ["numpy", "python"]:
+        raise ValueError("Unknown scan engine: {}".format(engine))
+
+    memgraphs = []
+    tasks = [] # (run, src, filename)
+    for run, maplist in enumerate(maplists):
+        sourcelist = select_sources(maplist, sources, length_lb, length_ub)
+        memgraphs.append(data_structures.MemoryGraph([reg.name for reg in maplist.regions_list], sourcelist, sparse=sparse))
+        for src in sourcelist:
+            filename = dump_filename(dumpnames[run], src)
+            if dumpstore.find_dump(filename) is not None:
+                tasks.append((run, src, filename))
+
+    # hand out the largest dumps first so that one big region doesn't finish last
+    schedule = sorted(range(len(tasks)), key = lambda k : os.path.getsize(dumpstore.find_dump(tasks[k][2])), reverse=True)
+
+    results = [None] * len(tasks)
+    stores = {} # directory -> page store that collects the workers' new scan results
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(maplists,)) as pool:
+        futures = {pool.submit(_scan_task, (tasks[k][0], tasks[k][2], pointer_sz, engine)) : k for k in schedule}
+        for fut in concurrent.futures.as_completed(futures):
+            k = futures[fut]
+            results[k] = fut.result()
+            run, src, _ = tasks[k]
+            if results[k][2]:
+                directory = os.path.dirname(dumpstore.find_dump(tasks[k][2]))
+                stores.setdefault(directory, dumpstore.shared_store(directory)).scan_cache(pointer_sz).update(results[k][2])
+            print("Scanned run{} {} in {:.3f}s ({} edges)".format(run, src, results[k][1], sum([len(g[1]) for g in results[k][0]])))
+
+    for store in stores.values():
+        save_scan_cache(store)
+
+    # merge in a fixed order regardless of completion order
+    for (run, src, _), (groups, _, _) in zip(tasks, results):
+        for dst, src_offsets, dst_offsets in groups:
+            memgraphs[run].add_edges(src, dst, src_offsets, dst_offsets)
+        metrics.count(edges=sum([len(g[1]) for g in groups]))
+
+    return memgraphs
+
+
+"""
+Check that two memory graphs contain exactly the same edges, in the same order
+returns a list of (src, dst) pairs whose edge lists differ
+"""
+def compare_graphs(mg_a, mg_b):
+    mismatches = []
+    for src in set(mg_a.adj_matrix.keys()) | set(mg_b.adj_matrix.keys()):
+        row_a = mg_a.adj_matrix.get(src, {})
+        row_b = mg_b.adj_matrix.get(src, {})
+        for dst in set(row_a.keys()) | set(row_b.keys()):
+            if list(row_a.get(dst, [])) != list(row_b.get(dst, [])):
+                mismatches.append((src, dst))
+    return mismatches
+
+"""
 Build a memory graph from a series of dumps files that were produced by a previous run of harvest_heap_data.py
 """
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("dir", help="directory to be analyzed")
-    parser.add_argument("--n", type=int, default=10, help="number of runs")
+    parser.add_argument("--n", type=int, default=None, help="number of runs. If not provided, every run in the directory is used (including per-process runs like run0_p1234)")
     parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a pointer in memory being analyzed")
     parser.add_argument("--sources", nargs="+", default=[], help="Heap regions to exclude from analysis")
+    parser.add_argument("--engine", choices=["numpy", "python"], default="numpy", help="Pointer scan engine to use")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to spread the (run, source region) scans over")
+    parser.add_argument("--format", choices=["json", "npz"], default="json", help="File format of the saved memory graphs")
+    parser.add_argument("--sparse", action='store_true', help="Only store connected region pairs in the memory graphs (useful when scanning every region)")
+    parser.add_argument("--compare", action='store_true', help="Also run the scalar python engine and check that both engines produce identical edges")
     args = parser.parse_args()
 
 
-    ml = [data_structures.MapList(load_file = "{}/run{}_maplist.json".format(args.dir, i)) for i in range(args.n)]
-    mg = [build_graph_from_dumps(ml[i], pointer_sz=args.pointer_sz, sources= args.sources if len(args.sources) > 0 else None, dumpname="{}/run{}_".format(args.dir, i)) for i in range(args.n)]
+    if args.n is None:
+        runnames = data_structures.list_runs(args.dir)
+    else:
+        runnames = ["run{}".format(i) for i in range(args.n)]
+    prefixes = ["{}/{}_".format(args.dir, rn) for rn in runnames]
+
+    ml = [data_structures.MapList(load_file = prefix + "maplist.json") for prefix in prefixes]
+    if args.jobs > 1:
+        with metrics.stage("build_graphs_parallel", os.path.join(args.dir, "")):
+            mg = build_graphs_parallel(ml, prefixes, args.jobs, pointer_sz=args.pointer_sz, sources= args.sources if len(args.sources) > 0 else None, engine=args.engine, sparse=args.sparse)
+    else:
+        mg = [build_graph_from_dumps(ml[i], pointer_sz=args.pointer_sz, sources= args.sources if len(args.sources) > 0 else None, dumpname=prefixes[i], engine=args.engine, sparse=args.sparse) for i in range(len(prefixes))]
+
+    if args.compare:
+        other = "python" if args.engine == "numpy" else "numpy"
+        for i in range(len(prefixes)):
+            ref = build_graph_from_dumps(ml[i], pointer_sz=args.pointer_sz, sources= args.sources if len(args.sources) > 0 else None, dumpname=prefixes[i], engine=other, sparse=args.sparse)
+            mismatches = compare_graphs(mg[i], ref)
+            if mismatches:
+                exit("{}: {} and {} engines disagree on {} region pairs, e.g. {}".format(runnames[i], args.engine, other, len(mismatches), mismatches[0]))
+            print("{}: {} and {} engines produced identical edges".format(runnames[i], args.engine, other))
 
-    for i in range(args.n):
-        mg[i].serialize("{}/run{}_memgraph.json".format(args.dir, i))
\ No newline at end of file
+    for i in range(len(prefixes)):
+        with metrics.stage("serialize_memgraph", prefixes[i]):
+            mg[i].serialize("{}memgraph.{}".format(prefixes[i], args.format))
@@ -9,12 +9,14 @@ import re
 import os
 import struct
 import sys
+import time
 
 # GDB's python interpreter needs this to locate the other files
 sys.path.append(os.path.dirname(__file__))
 
 import data_structures
 import build_graph
+import metrics
 
 """
 Construct list of contiguous mapped region names, their starting virtual addresses, their end  virtual adresses
@@ -71,9 +73,24 @@ def dump_mem(maplist, sources=None, dumpname="", length_lb = -1, length_ub = 2**
             gdb.execute("dump memory {}.dump {} {}".format(dumpname + src.name.split("/")[-1], src.start, src.end))
         except:
             continue
+        metrics.count(bytes_written=src.end - src.start)
         print("finished dump")
 
 
+"""
+Read a region of the inferior in fixed-size chunks, for streaming it into the pointer scanner
+region = data_structures.Region to read
+chunk_sz = number of bytes per read
+"""
+def read_chunks(region, chunk_sz=build_graph.SCAN_CHUNK_SZ):
+    inferior = gdb.selected_inferior()
+    addr = region.start
+    while addr < region.end:
+        n = min(chunk_sz, region.end - addr)
+        yield inferior.read_memory(addr, n)
+        addr += n
+
+
 """
 Run the full script and save the memory graph
 pid = pid of the process to attach to
@@ -81,15 +98,53 @@ sources = names of regions to scan for pointers. If None, all regions will be sc
 name = prefix for all saved files, including serialized data structures and memory dumps
 llb, lub = upper and lower bounds on lengths of source regions to scan
 coalesce = whether to aggregate adjascent regions with the same name
+sparse = store only connected region pairs in the memory graph
+dump = whether to write the regions to .dump files. If False, each region is read from the inferior
+       in chunks and fed straight into the pointer scanner, and only the maplist and memgraph are saved.
+lowpause = detach as soon as the regions have been copied out (to the dump files, or into memory if
+           dump is False) and only scan them afterwards, so the target is stopped for just the copy
+incremental = path of a data_structures.SnapshotState file shared by repeated snapshots of the same process
+              (created if missing). When dump is False, only pages that changed since the previous snapshot
+              are scanned, and the file is updated for the next one.
+The time the target was stopped is saved as "pause_s" in the run's metrics file.
 """
-def gdb_main(pid, sources=None, name="", llb = -1, lub=2**30, graph=True, psize=8, coalesce=False):
-    maplist = build_maplist(pid, coalesce)
-    dump_mem(maplist, sources, name, llb, lub)
-
-    maplist.serialize(name + "maplist.json")
-    if graph:
-        memgraph = build_graph.build_graph_from_dumps(maplist, psize, sources, name, llb, lub)
-        memgraph.serialize(name + "memgraph.json")
-
-    gdb.execute("detach")
-    gdb.execute("quit")
\ No newline at end of file
+def gdb_main(pid, sources=None, name="", llb = -1, lub=2**30, graph=True, psize=8, coalesce=False, sparse=False, dump=True, lowpause=False, incremental=None):
+    with metrics.stage("snapshot", name):
+        state = data_structures.load_snapshot_state(incremental if not dump else None)
+        t0 = time.time()
+        with metrics.stage("attach"):
+            maplist = build_maplist(pid, coalesce)
+
+        maplist.serialize(name + "maplist.json")
+        memgraph = None
+        copies = None
+        if dump:
+            with metrics.stage("dump_mem"):
+                dump_mem(maplist, sources, name, llb, lub)
+        elif graph and lowpause:
+            copies = build_graph.copy_regions(maplist, read_chunks, sources, llb, lub)
+        elif graph:
+            memgraph = build_graph.build_graph_from_reader(maplist, read_chunks, psize, sources, llb, lub, sparse=sparse, state=state)
+
+        if lowpause:
+            gdb.execute("detach")
+            pause = time.time() - t0
+
+        if graph and memgraph is None:
+            if copies is not None:
+                memgraph = build_graph.build_graph_from_reader(maplist, lambda reg : copies[reg.name], psize, sources, llb, lub, sparse=sparse, state=state)
+            else:
+                memgraph = build_graph.build_graph_from_dumps(maplist, psize, sources, name, llb, lub, sparse=sparse)
+
+        if not lowpause:
+            gdb.execute("detach")
+            pause = time.time() - t0
+
+        print("Target paused for {:.3f}s".format(pause))
+        metrics.record_metrics(name, backend="gdb", lowpause=lowpause, pause_s=pause)
+        if memgraph is not None:
+            with metrics.stage("serialize_memgraph"):
+                memgraph.serialize(name + "memgraph.json")
+        if state is not None and memgraph is not None:
+            state.serialize(incremental)
+    gdb.execute("quit")
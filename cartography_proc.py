@@ -0,0 +1,198 @@
+"""
+Map out allocated memory regions in a process without GDB, by reading /proc/<pid>/maps and
+copying regions out of /proc/<pid>/mem in large chunks. Produces the same files as cartography_gdb.py.
+Needs permission to ptrace the target (run as root, or as the parent of the target process).
+Called by harvest_heap_data.py and refine_memory_map.py when run with --backend proc
+Example: sudo python3 cartography_proc.py 1234 --name vim_heap/run0_ --sources [heap]
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import data_structures
+import build_graph
+import metrics
+
+"""
+Number of bytes copied out of the target per read
+"""
+READ_CHUNK_SZ = 1 << 24
+
+
+"""
+Construct the list of mapped regions of a process from /proc/<pid>/maps.
+Regions are named the same way as cartography_gdb.build_maplist names them from GDB's
+`info proc mappings`: the last whitespace-separated field of the line (empty for anonymous
+mappings), with "_(deleted)" appended to deleted files, and an index appended by MapList.
+pid = process to map
+coalesce = whether or not to merge adjascent VMAs that have the same name
+"""
+def build_maplist(pid, coalesce=False):
+    maplist = data_structures.MapList()
+
+    with open("/proc/{}/maps".format(pid), "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+
+            segname = fields[-1] if len(fields) > 5 else ""
+            if segname == "(deleted)":
+                segname = fields[-2] + "_(deleted)"
+
+            start, end = fields[0].split("-")
+            maplist.add_region(data_structures.Region(int(start, 16), int(end, 16), segname))
+
+    if coalesce:
+        maplist.coalesce()
+
+    return maplist
+
+
+"""
+Iterate over the contents of a region of the target's address space
+mem_fd = file descriptor of /proc/<pid>/mem
+start, end = virtual address range to read
+chunk_sz = number of bytes returned per iteration (the last chunk may be shorter)
+Raises OSError if part of the range can't be read
+"""
+def read_region(mem_fd, start, end, chunk_sz=READ_CHUNK_SZ):
+    addr = start
+    while addr < end:
+        n = min(chunk_sz, end - addr)
+        buf = os.pread(mem_fd, n, addr)
+        if len(buf) == 0:
+            raise OSError("short read at {:#x}".format(addr))
+        yield buf
+        addr += len(buf)
+
+
+"""
+Regions of a MapList that pass the source-name and length filters used across the scripts
+"""
+def select_regions(maplist, sources=None, length_lb = -1, length_ub = 2**30):
+    names = set(build_graph.select_sources(maplist, sources, length_lb, length_ub))
+    return [reg for reg in maplist.regions_list if reg.name in names]
+
+
+"""
+Copy regions of interest from the target into dump files named like those written by cartography_gdb.dump_mem.
+Regions that can't be read (e.g. [vvar], [vsyscall]) are skipped.
+pid = process to read from
+maplist, sources, dumpname, length_lb, length_ub = same as cartography_gdb.dump_mem
+returns total number of bytes copied
+"""
+def dump_mem(pid, maplist, sources=None, dumpname="", length_lb = -1, length_ub = 2**30):
+    sourcelist = select_regions(maplist, sources, length_lb, length_ub)
+    total = 0
+
+    mem_fd = os.open("/proc/{}/mem".format(pid), os.O_RDONLY)
+    try:
+        for i,src in enumerate(sourcelist):
+            print("Dumping " + str(src.name) + " ({}/{})".format(i,len(sourcelist)) + "len = {} bytes".format(src.end - src.start))
+            filename = build_graph.dump_filename(dumpname, src.name)
+            try:
+                with open(filename, "wb") as f:
+                    for buf in read_region(mem_fd, src.start, src.end):
+                        f.write(buf)
+            except (OSError, OverflowError): # OverflowError: addresses above 2^63, e.g. [vsyscall]
+                if os.path.exists(filename):
+                    os.remove(filename)
+                continue
+            total += src.end - src.start
+            print("finished dump")
+    finally:
+        os.close(mem_fd)
+
+    return total
+
+
+"""
+Run the full acquisition and save the memory graph. Mirrors cartography_gdb.gdb_main.
+The target is stopped with SIGSTOP while its maps and memory are copied, like a GDB attach would.
+pid = pid of the process to read
+sources = names of regions to scan for pointers. If None, all regions will be scanned
+name = prefix for all saved files, including serialized data structures and memory dumps
+llb, lub = upper and lower bounds on lengths of source regions to scan
+coalesce = whether to aggregate adjascent regions with the same name
+sparse = store only connected region pairs in the memory graph
+stop = whether to stop the target while copying its memory
+dump = whether to write the regions to .dump files. If False, regions are streamed from
+       /proc/<pid>/mem into the pointer scanner in chunks, and only the maplist and memgraph are saved.
+lowpause = when dump is False, copy the regions into memory and resume the target before scanning them,
+           instead of scanning while it is stopped. (With dump files the target is always resumed before scanning.)
+incremental = same as cartography_gdb.gdb_main
+The time the target was stopped is saved as "pause_s" in the run's metrics file.
+"""
+def proc_main(pid, sources=None, name="", llb = -1, lub=2**30, graph=True, psize=8, coalesce=False, sparse=False, stop=True, dump=True, lowpause=False, incremental=None):
+    memgraph = None
+    copies = None
+    state = data_structures.load_snapshot_state(incremental if not dump else None)
+    if stop:
+        os.kill(pid, signal.SIGSTOP)
+    t0 = time.time()
+    try:
+        maplist = build_maplist(pid, coalesce)
+        if dump:
+            with metrics.stage("dump_mem"):
+                nbytes = dump_mem(pid, maplist, sources, name, llb, lub)
+                metrics.count(bytes_written=nbytes)
+            print("Copied {} bytes in {:.2f}s".format(nbytes, time.time() - t0))
+        elif graph:
+            mem_fd = os.open("/proc/{}/mem".format(pid), os.O_RDONLY)
+            try:
+                reader = lambda reg : read_region(mem_fd, reg.start, reg.end)
+                if lowpause:
+                    copies = build_graph.copy_regions(maplist, reader, sources, llb, lub)
+                    print("Copied {} bytes in {:.2f}s".format(sum([len(b) for c in copies.values() for b in c]), time.time() - t0))
+                else:
+                    memgraph = build_graph.build_graph_from_reader(maplist, reader, psize, sources, llb, lub, sparse=sparse, state=state)
+                    print("Scanned target memory in {:.2f}s".format(time.time() - t0))
+            finally:
+                os.close(mem_fd)
+    finally:
+        if stop:
+            os.kill(pid, signal.SIGCONT)
+    pause = time.time() - t0
+
+    if stop:
+        print("Target paused for {:.3f}s".format(pause))
+        metrics.record_metrics(name, backend="proc", lowpause=lowpause, pause_s=pause)
+
+    maplist.serialize(name + "maplist.json")
+    if copies is not None:
+        memgraph = build_graph.build_graph_from_reader(maplist, lambda reg : copies[reg.name], psize, sources, llb, lub, sparse=sparse, state=state)
+    elif dump and graph:
+        memgraph = build_graph.build_graph_from_dumps(maplist, psize, sources, name, llb, lub, sparse=sparse)
+    if memgraph is not None:
+        with metrics.stage("serialize_memgraph"):
+            memgraph.serialize(name + "memgraph.json")
+    if state is not None and memgraph is not None:
+        state.serialize(incremental)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pid", type=int, help="process to snapshot")
+    parser.add_argument("--name", type=str, default="", help="prefix for all saved files")
+    parser.add_argument("--sources", nargs="+", default=None, help="names of regions to dump and scan. If not provided, all regions are used")
+    parser.add_argument("--length_lb",type=int, default=-1, help="lower bound on the length of scanned regions")
+    parser.add_argument("--length_ub",type=int, default=2**30, help="upper bound on the length of scanned regions")
+    parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a pointer in memory being analyzed")
+    parser.add_argument("--nograph", dest='nograph', action='store_true', help="Don't build out the graph. Just save the maplist and dumps")
+    parser.add_argument("--coalesce", dest='coalesce', action='store_true', help="combine adjacent same-named memory regions")
+    parser.add_argument("--sparse", action='store_true', help="Only store connected region pairs in the memory graph")
+    parser.add_argument("--nostop", action='store_true', help="Don't stop the target while copying its memory")
+    parser.add_argument("--nodump", action='store_true', help="Stream regions into the pointer scanner instead of writing .dump files")
+    parser.add_argument("--lowpause", action='store_true', help="With --nodump, copy the regions into memory and resume the target before scanning them")
+    parser.add_argument("--incremental", type=str, default=None, help="With --nodump, state file shared by repeated snapshots of the same process: only pages that changed since the previous snapshot are rescanned")
+    args = parser.parse_args()
+
+    with metrics.stage("snapshot", args.name):
+        proc_main(args.pid, args.sources, args.name, args.length_lb, args.length_ub, not args.nograph,
+            args.pointer_sz, args.coalesce, args.sparse, not args.nostop, not args.nodump, args.lowpause, args.incremental)
@@ -0,0 +1,58 @@
+"""
+Check the alignment inference of fingerprint.py on the pointer layouts that bound it by something other than
+the distance between pointers: a pointer that occurs once per heap, at the same offset in every run (which used
+to double the alignment without limit), at offset 0, and far into a large heap. Each layout is also run through
+cross_validate_candidates (the analyze.py --top path), on small in-memory runs, together with an ordinary
+candidate that must still be cross-validated.
+Example: python check_fingerprint.py
+"""
+
+import io
+import numpy as np
+import data_structures
+from fingerprint import pointer_alignment, cross_validate_candidates, MAX_ALIGNMENT
+
+HEAP_START = 0x5555_0000_0000
+LIB_START = 0x7f00_0000_0000
+LIB = "/usr/lib/libc.so.6_0"
+
+
+"""
+A run whose heap holds a pointer to LIB+0x40 at each of `single` and pointers to LIB+0x80 at `common`
+returns a RunContainer built in memory
+"""
+def make_run(rng, heap_sz, single, common):
+    heap = rng.integers(0, 256, heap_sz, dtype=np.uint8)
+    maplist = data_structures.MapList()
+    maplist.add_region(data_structures.Region(HEAP_START, HEAP_START + heap_sz, "[heap]"))
+    maplist.add_region(data_structures.Region(LIB_START, LIB_START + 0x1000, "/usr/lib/libc.so.6"))
+    memgraph = data_structures.MemoryGraph(["[heap]_0", LIB], ["[heap]_0"])
+    for offsets, dst_off in [(single, 0x40), (common, 0x80)]:
+        for off in offsets:
+            heap[off:off + 8] = np.frombuffer((LIB_START + dst_off).to_bytes(8, "little"), dtype=np.uint8)
+            heap[off - 16:off] = 0xAA # fixed bytes around every pointer, for the fingerprint to learn
+            heap[off + 8:off + 16] = 0x55
+        memgraph.add_edges("[heap]_0", LIB, offsets, [dst_off] * len(offsets))
+    return data_structures.RunContainer("run", ["[heap]_0"], maplist=maplist, memgraph=memgraph, heap_handles=[io.BytesIO(heap.tobytes())])
+
+
+failures = []
+for name, offset, heap_sz in [("same offset in every run", 0x1000, 1 << 16), ("at offset 0", 0, 1 << 16), ("far into the heap", 0x40000, 1 << 20)]:
+    aln, aln_offset = pointer_alignment([[[offset]] for _ in range(3)], 8)
+    if aln > MAX_ALIGNMENT or offset % aln != aln_offset:
+        failures.append("{}: alignment {} / offset {}".format(name, aln, aln_offset))
+
+    if offset < 16 + 8: # no window fits before the pointer
+        continue
+    rng = np.random.default_rng(0)
+    rundata = [make_run(rng, heap_sz, [offset], [0x2000 + 0x100 * k + 8 * r for k in range(8)]) for r in range(3)]
+    results = cross_validate_candidates(rundata, [(0, LIB, 0x40), (1, LIB, 0x80)], 16, 16)
+    for res in results:
+        if "error" in res or not 0 <= res["precision"] <= 1:
+            failures.append("{}: candidate {} not cross-validated: {}".format(name, res["rank"], res.get("error")))
+    if results[0].get("tpr") != 1.0:
+        failures.append("{}: the single pointers weren't all matched (TPR {})".format(name, results[0].get("tpr")))
+
+if failures:
+    exit("\n".join(failures))
+print("OK: alignment bounded and both candidates cross-validated for every layout")
@@ -0,0 +1,86 @@
+"""
+Check the /proc backend (cartography_proc.py) against a child process spawned here, without GDB or a real target.
+The child is a small Python program that builds a linked structure on its heap and then blocks, so its memory
+doesn't change between snapshots. It is snapshotted twice, once writing dumps and building the graph from
+them, and once streaming its regions into the scanner (--nodump). Both snapshots must produce the same
+maplist and the same memory graph.
+Needs permission to read the child's memory, which its parent has unless ptrace is restricted further (Yama scope 2+).
+Example: python check_proc.py
+Example: python check_proc.py --sources [heap] --keep proc_check
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import cartography_proc
+import build_graph
+import data_structures
+
+CHILD = """
+import sys
+nodes = [None]
+for i in range(20000):
+    nodes.append([nodes[-1], i, str(i) * 3])
+print("ready", flush=True)
+sys.stdin.read()
+"""
+
+"""
+Wait until a process is asleep (blocked in a system call)
+returns whether it fell asleep within the timeout
+"""
+def wait_asleep(pid, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with open("/proc/{}/stat".format(pid)) as f:
+            if f.read().rsplit(")", 1)[1].split()[0] == "S":
+                return True
+        time.sleep(0.01)
+    return False
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sources", nargs="+", default=["[heap]"], help="names of the regions to dump and scan")
+parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a pointer in memory being analyzed")
+parser.add_argument("--keep", type=str, default=None, help="directory to keep the snapshots in. If not provided, they are written to a temporary directory and removed")
+args = parser.parse_args()
+
+outdir = args.keep or tempfile.mkdtemp(prefix="check_proc.")
+os.makedirs(outdir, exist_ok=True)
+child = subprocess.Popen([sys.executable, "-c", CHILD], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+try:
+    if child.stdout.readline().strip() != b"ready":
+        exit("child process exited before it was ready")
+    if not wait_asleep(child.pid): # still setting up the read that it blocks in
+        exit("child process didn't block")
+
+    prefixes = {}
+    for mode, dump in [("dump", True), ("nodump", False)]:
+        prefixes[mode] = os.path.join(outdir, mode + "_")
+        cartography_proc.proc_main(child.pid, args.sources, prefixes[mode], psize=args.pointer_sz, dump=dump)
+finally:
+    child.stdin.close()
+    child.wait()
+
+with open(prefixes["dump"] + "maplist.json") as a, open(prefixes["nodump"] + "maplist.json") as b:
+    if a.read() != b.read():
+        exit("the maplists of the two snapshots differ")
+maplist = data_structures.MapList(load_file=prefixes["dump"] + "maplist.json")
+if len(build_graph.select_sources(maplist, args.sources)) == 0:
+    exit("the child has no region matching {}".format(args.sources))
+
+graphs = {mode : data_structures.MemoryGraph(load_file=prefix + "memgraph.json") for mode, prefix in prefixes.items()}
+edges = sum([len(e) for row in graphs["dump"].adj_matrix.values() for e in row.values()])
+if edges == 0:
+    exit("no pointers found in {}".format(args.sources))
+mismatches = build_graph.compare_graphs(graphs["dump"], graphs["nodump"])
+if mismatches:
+    exit("the memory graphs differ on {} region pairs, e.g. {}".format(len(mismatches), mismatches[0]))
+print("OK: {} regions, {} edges, identical with and without --nodump".format(len(maplist.regions_list), edges))
+
+if args.keep is None:
+    shutil.rmtree(outdir)
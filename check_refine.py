@@ -0,0 +1,165 @@
+"""
+Randomized check of data_structures.RefinementState against the original refinement of refine_memory_map.py,
+which intersected the runs' edge lists pair by pair and compared every pair of same-named regions to link
+adjacent ones. Each trial generates random runs (region layouts that vary from run to run, and overlapping
+edge sets) and checks that
+  - the refined graph at the default quorum (all runs) holds the same edges and placeholder links as the original,
+  - the graph at every quorum k holds exactly the edges present in at least k runs,
+  - folding the runs in two steps, with the state saved and reloaded in between, gives the same graph.
+Example: python check_refine.py
+Example: python check_refine.py --trials 1000 --runs 6 --seed 7
+"""
+
+import argparse
+import collections
+import copy
+import os
+import shutil
+import tempfile
+import numpy as np
+import data_structures
+
+PREFIXES = ["/usr/lib/libc.so.6", "/usr/lib/libm.so.6", "", "[heap]", "/usr/bin/vim"]
+PAGE_SZ = 4096
+
+
+"""
+Generate the runs of one trial: variations of a common layout and edge set, as repeated launches of the same program would give
+rng = numpy random Generator
+returns a list of (MapList, dense MemoryGraph with every region as a source)
+"""
+def random_runs(rng, nruns):
+    layout = [p for p in PREFIXES for _ in range(int(rng.integers(1, 4)))]
+    rng.shuffle(layout)
+    gaps = rng.choice([0, 0, 1, 2], len(layout)) # in pages, mostly directly adjacent
+    edges = [(s, d, so, do) for s in range(len(layout)) for d in range(len(layout)) if rng.random() < 0.3
+        for so in range(0, 64, 8) for do in range(0, 64, 8) if rng.random() < 0.15]
+
+    runs = []
+    for _ in range(nruns):
+        regions = list(layout)
+        if rng.random() < 0.3: # an extra region, which renames the later regions of its name
+            regions.insert(int(rng.integers(0, len(regions) + 1)), PREFIXES[int(rng.integers(0, len(PREFIXES)))])
+        run_gaps = [g if rng.random() < 0.8 else int(rng.integers(0, 3)) for g in gaps] + [0]
+        maplist = data_structures.MapList()
+        addr = PAGE_SZ * int(rng.integers(1, 1 << 20))
+        for prefix, gap in zip(regions, run_gaps):
+            size = PAGE_SZ * int(rng.integers(1, 4))
+            maplist.add_region(data_structures.Region(addr, addr + size, prefix))
+            addr += size + PAGE_SZ * int(gap)
+
+        names = [reg.name for reg in maplist.regions_list]
+        memgraph = data_structures.MemoryGraph(names, names)
+        for s, d, so, do in edges:
+            if s < len(names) and d < len(names) and rng.random() < 0.9:
+                memgraph.add_edge(names[s], names[d], so, do)
+        for _ in range(int(rng.integers(0, 20))):
+            memgraph.add_edge(names[int(rng.integers(0, len(names)))], names[int(rng.integers(0, len(names)))], 8 * int(rng.integers(0, 8)), 8 * int(rng.integers(8, 16)))
+        runs.append((maplist, memgraph))
+    return runs
+
+
+"""
+The original refinement: intersect the edge lists of every run with those of the first one, then link
+same-named regions that are directly adjacent in every run (in the same order) and otherwise unconnected
+returns the refined MemoryGraph (the first run's graph, modified)
+"""
+def reference_refine(memgraphs, mlists, coalesce=False):
+    mg = None
+    for newmg in memgraphs:
+        if mg:
+            for src in mg.adj_matrix.keys():
+                for dst in mg.adj_matrix[src].keys():
+                    if (src not in newmg.adj_matrix) or (dst not in newmg.adj_matrix[src]):
+                        mg.adj_matrix[src][dst] = [] # remove inconcsistent edges
+                        continue
+
+                    edgelist = mg.adj_matrix[src][dst]
+                    newmg_eset = set(newmg.adj_matrix[src][dst])
+                    newlist = []
+                    for e in edgelist:
+                        if e in newmg_eset:
+                            newlist.append(e)
+                    mg.adj_matrix[src][dst] = newlist
+        else:
+            mg = newmg
+
+    if not coalesce:
+        for src in mg.adj_matrix.keys():
+            if any([src not in ml.regions_dict for ml in mlists]):
+                continue
+
+            for dst in mg.adj_matrix[src].keys():
+                if ("_".join(src.split("_")[:-1]) != "_".join(dst.split("_")[:-1])
+                    or len(mg.adj_matrix[src][dst]) > 0 or any([dst not in ml.regions_dict for ml in mlists])):
+                    continue
+
+                src_bounds = [x.regions_dict[src] for x in mlists]
+                dst_bounds = [x.regions_dict[dst] for x in mlists]
+                if (all([s.end == d.start for (s,d) in zip(src_bounds, dst_bounds)]) or
+                    all([s.start == d.end for (s,d) in zip(src_bounds, dst_bounds)])):
+
+                    mg.adj_matrix[src][dst].append((-1,-1)) #placeholder edge
+    return mg
+
+
+"""
+Edges of a MemoryGraph as a set of (src, dst, src offset, dst offset)
+"""
+def edge_set(memgraph):
+    return {(src, dst) + tuple(e) for src in memgraph.adj_matrix.keys() for dst, elist in memgraph.adj_matrix[src].items() for e in elist}
+
+
+"""
+Run one trial
+returns a description of the first disagreement, or None
+"""
+def trial(rng, nruns, tmpdir):
+    runs = random_runs(rng, nruns)
+    state = data_structures.RefinementState()
+    for i, (maplist, memgraph) in enumerate(runs):
+        state.fold("run{}".format(i), memgraph, maplist, (0, i))
+
+    link = bool(rng.random() < 0.5)
+    expected = edge_set(reference_refine([copy.deepcopy(mg) for _, mg in runs], [ml for ml, _ in runs], coalesce=not link))
+    got = edge_set(state.graph(link=link))
+    if got != expected:
+        return "quorum {} (link={}): {} edges missing, {} extra".format(nruns, link, len(expected - got), len(got - expected))
+
+    counts = collections.Counter([e for _, mg in runs for e in edge_set(mg)])
+    for quorum in range(1, nruns + 1):
+        got = edge_set(state.graph(quorum, link=False))
+        if got != {e for e, c in counts.items() if c >= quorum}:
+            return "quorum {}: edges differ from a direct count".format(quorum)
+
+    split = int(rng.integers(1, nruns))
+    first = data_structures.RefinementState()
+    for i in range(split):
+        first.fold("run{}".format(i), runs[i][1], runs[i][0], (0, i))
+    state_file = os.path.join(tmpdir, "refine_state.npz")
+    first.serialize(state_file)
+    resumed = data_structures.RefinementState(load_file=state_file)
+    for i in range(split, nruns):
+        resumed.fold("run{}".format(i), runs[i][1], runs[i][0], (0, i))
+    for quorum in range(1, nruns + 1):
+        if edge_set(resumed.graph(quorum)) != edge_set(state.graph(quorum)):
+            return "quorum {}: folding in two steps (split after {} runs) differs".format(quorum, split)
+    return None
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--trials", type=int, default=200, help="number of random trials")
+parser.add_argument("--runs", type=int, default=4, help="largest number of runs per trial")
+parser.add_argument("--seed", type=int, default=0, help="seed of the random runs")
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+tmpdir = tempfile.mkdtemp(prefix="check_refine.")
+try:
+    for t in range(args.trials):
+        error = trial(rng, int(rng.integers(2, max(args.runs, 2) + 1)), tmpdir)
+        if error is not None:
+            exit("trial {}: {}".format(t, error))
+finally:
+    shutil.rmtree(tmpdir)
+print("OK: {} trials, RefinementState matches the original refinement".format(args.trials))
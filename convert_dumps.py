@@ -0,0 +1,90 @@
+"""
+Convert the memory dumps of a dataset between raw .dump files, block-compressed .cdump files and page lists
+in the dataset's page store (see dumpstore.py), and optionally benchmark reading the converted dumps against the raw ones
+Example: python convert_dumps.py ff_heap/ --to cdump --codec zlib --bench --delete
+Example: python convert_dumps.py ff_map/ --to pages --delete
+"""
+
+import argparse
+import os
+import random
+import time
+import dumpstore
+
+parser = argparse.ArgumentParser()
+parser.add_argument("dir", help="dataset directory containing *.dump / *.cdump / *.pages files")
+parser.add_argument("--to", choices=["cdump", "pages", "dump"], default="cdump", help="format to convert the dumps to. 'pages' moves the dumps into the dataset's content-addressed page store")
+parser.add_argument("--codec", choices=list(dumpstore.CODECS.keys()), default="zlib", help="compression codec for .cdump files")
+parser.add_argument("--level", type=int, default=6, help="compression level (zlib level or lzma preset)")
+parser.add_argument("--block_size", type=int, default=dumpstore.DEFAULT_BLOCK_SZ, help="raw bytes per compressed block")
+parser.add_argument("--bench", action='store_true', help="Compare read throughput of every converted dump against its raw counterpart")
+parser.add_argument("--reads", type=int, default=10000, help="number of random 64-byte reads per dump in the benchmark")
+parser.add_argument("--delete", action='store_true', help="Remove the original files after converting them")
+args = parser.parse_args()
+
+
+"""
+Time a full sequential read and `args.reads` random 64-byte reads of a dump
+returns (sequential MB/s, random reads/s)
+"""
+def bench(open_file, size):
+    t0 = time.time()
+    with open_file() as f:
+        while f.read(1 << 24):
+            pass
+    seq = size / max(time.time() - t0, 1e-9) / 1e6
+
+    rnd = random.Random(0)
+    offsets = [rnd.randrange(max(size - 64, 1)) for _ in range(args.reads)]
+    t0 = time.time()
+    with open_file() as f:
+        for off in offsets:
+            f.seek(off)
+            f.read(64)
+    return seq, args.reads / max(time.time() - t0, 1e-9)
+
+
+src_exts = (".dump",) if args.to != "dump" else (dumpstore.COMPRESSED_SUFFIX, dumpstore.PAGES_SUFFIX)
+store = dumpstore.PageStore(args.dir) if args.to == "pages" else None
+totals = [0, 0]
+
+for f in sorted(os.listdir(args.dir)):
+    if not f.endswith(src_exts):
+        continue
+
+    src = os.path.join(args.dir, f)
+    t0 = time.time()
+    if args.to == "cdump":
+        dst = dumpstore.compressed_name(src)
+        dumpstore.compress_dump(src, dst, args.codec, args.level, args.block_size)
+        stored = os.path.getsize(dst)
+    elif args.to == "pages":
+        dst = dumpstore.pages_name(src)
+        _, added = store.add_dump(src, dst)
+        stored = os.path.getsize(dst) + added # page list plus the pages that weren't in the store yet
+    else:
+        dst = os.path.splitext(src)[0] + ".dump"
+        dumpstore.decompress_dump(src, dst)
+        stored = os.path.getsize(dst)
+    print("{} -> {} ({} -> {} bytes, {:.2f}s)".format(src, dst, os.path.getsize(src), stored, time.time() - t0))
+    totals[0] += os.path.getsize(src)
+    totals[1] += stored
+
+    if args.bench:
+        raw, converted = (src, dst) if args.to != "dump" else (dst, src)
+        size = os.path.getsize(raw)
+        raw_seq, raw_rnd = bench(lambda : open(raw, "rb"), size)
+        if store is not None:
+            c_seq, c_rnd = bench(lambda : dumpstore.PagedDump(converted, store), size)
+        else:
+            c_seq, c_rnd = bench(lambda : dumpstore.open_stored(converted), size)
+        print("    raw:   {:.1f} MB/s sequential, {:.0f} random reads/s".format(raw_seq, raw_rnd))
+        print("    {}: {:.1f} MB/s sequential, {:.0f} random reads/s".format(os.path.splitext(converted)[1][1:], c_seq, c_rnd))
+
+    if args.delete:
+        os.remove(src)
+
+if store is not None:
+    store.close()
+    print("Page store: {} distinct pages".format(len(store)))
+print("Total: {} -> {} bytes".format(totals[0], totals[1]))
@@ -0,0 +1,32 @@
+"""
+Convert the serialized memory graphs of a dataset between the JSON and binary .npz formats
+Example: python convert_memgraph.py ff_map/ --to npz
+"""
+
+import argparse
+import os
+import time
+import data_structures
+
+parser = argparse.ArgumentParser()
+parser.add_argument("dir", help="dataset directory containing *memgraph.json / *memgraph.npz files")
+parser.add_argument("--to", choices=["npz", "json"], default="npz", help="format to convert the graphs to")
+parser.add_argument("--delete", action='store_true', help="Remove the original files after converting them")
+args = parser.parse_args()
+
+src_ext = ".json" if args.to == "npz" else ".npz"
+dst_ext = "." + args.to
+
+for f in sorted(os.listdir(args.dir)):
+    if not f.endswith("memgraph" + src_ext):
+        continue
+
+    src = os.path.join(args.dir, f)
+    dst = src[:-len(src_ext)] + dst_ext
+
+    t0 = time.time()
+    data_structures.MemoryGraph(load_file=src).serialize(dst)
+    print("{} -> {} ({} -> {} bytes, {:.2f}s)".format(src, dst, os.path.getsize(src), os.path.getsize(dst), time.time() - t0))
+
+    if args.delete:
+        os.remove(src)
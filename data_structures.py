@@ -6,6 +6,12 @@ import collections
 import os
 import re
 import json
+import mmap
+import tempfile
+import zipfile
+import numpy as np
+import dumpstore
+import metrics
 
 """
 Named tuple representing a VMA
@@ -69,6 +75,13 @@ class MapList:
             elif addr < test.start:
                 ub = med
     """
+    Return a read-only, array-backed snapshot of this MapList for resolving many addresses at once.
+    Regions added after freezing are not reflected in the snapshot.
+    """
+    def freeze(self):
+        return FrozenMapList(self)
+
+    """
     search for region start/end by region name
     region_name = string name of desired region. Ex: 'lib.so_4'
     """
@@ -129,6 +142,103 @@ class MapList:
                     self.name_counter[prefix] += 1
                 else:
                     self.name_counter[prefix] = 1
+
+"""
+Immutable form of a MapList that holds the regions as parallel NumPy arrays sorted by start
+address, so that whole arrays of addresses can be resolved with one vectorized search
+"""
+class FrozenMapList:
+
+    """
+    maplist = data_structures.MapList object to snapshot
+    """
+    def __init__(self, maplist):
+        self.regions = tuple(maplist.regions_list) # region objects, indexed by region id
+        self.regions_dict = dict(maplist.regions_dict)
+
+        order = sorted(range(len(self.regions)), key = lambda i : self.regions[i].start)
+        self.starts = np.array([self.regions[i].start for i in order], dtype=np.uint64)
+        self.ends = np.array([self.regions[i].end for i in order], dtype=np.uint64)
+        self.region_ids = np.array(order, dtype=np.int64) # region id of each (start, end) slot
+        self.names = [r.name for r in self.regions]
+
+        # global address range covered by the map, used to reject non-pointers before searching
+        self.min_start = self.starts.min() if len(order) > 0 else np.uint64(0)
+        self.max_end = self.ends.max() if len(order) > 0 else np.uint64(0)
+
+    """
+    Resolve an array of virtual addresses to the regions that contain them.
+    addrs = NumPy array (or sequence) of virtual addresses
+    returns (region_ids, offsets). region_ids is an int64 array holding the id of the containing
+    region (an index into `regions`/`names`) or -1 if the address is unmapped. offsets is a uint64
+    array of offsets within the containing region (0 for unmapped addresses).
+    """
+    def check_pointers(self, addrs):
+        addrs = np.asarray(addrs).astype(np.uint64, copy=False)
+        region_ids = np.full(addrs.shape, -1, dtype=np.int64)
+        offsets = np.zeros(addrs.shape, dtype=np.uint64)
+
+        cand = np.flatnonzero((addrs >= self.min_start) & (addrs < self.max_end))
+        if len(cand) == 0:
+            return region_ids, offsets
+
+        vals = addrs.ravel()[cand]
+        slot = np.searchsorted(self.starts, vals, side="right").astype(np.int64) - 1
+        hit = slot >= 0
+        hit[hit] = vals[hit] < self.ends[slot[hit]]
+        cand, slot = cand[hit], slot[hit]
+
+        region_ids.ravel()[cand] = self.region_ids[slot]
+        offsets.ravel()[cand] = vals[hit] - self.starts[slot]
+        return region_ids, offsets
+
+    """
+    Scalar counterpart of `check_pointers` with the same interface as MapList.check_pointer
+    addr = virtual address to check
+    returns the data_structures.Region containing addr, or None
+    """
+    def check_pointer(self, addr):
+        region_ids, _ = self.check_pointers(np.array([addr], dtype=np.uint64))
+        if region_ids[0] < 0:
+            return None
+        return self.regions[region_ids[0]]
+
+    """
+    search for region start/end by region name
+    """
+    def find_region(self, region_name):
+        return self.regions_dict[region_name]
+
+"""
+Version tag stored in binary MemoryGraph files, and the leading bytes
+of an .npz (zip) archive, used to tell binary graphs apart from JSON ones
+"""
+MEMGRAPH_FORMAT_VERSION = 1
+NPZ_MAGIC = b"PK\x03\x04"
+
+"""
+Path of the serialized memory graph for a run, preferring the binary format when both exist
+prefix = path prefix of the run's files. Ex: "vim_map/run0_"
+"""
+def memgraph_path(prefix):
+    if os.path.exists(prefix + "memgraph.npz"):
+        return prefix + "memgraph.npz"
+    return prefix + "memgraph.json"
+
+"""
+Names of the runs saved in a directory, i.e. the prefixes of all "*_maplist.json" files, in sorted order.
+A run is either one launch ("run0") or, when every matching process of a launch was snapshotted,
+one process of that launch ("run0_p1234").
+path = directory to search
+indices = only return runs with these run indices, if provided
+"""
+def list_runs(path, indices=None):
+    runnames = sorted([f[:-len("_maplist.json")] for f in os.listdir(path) if f.endswith("_maplist.json")])
+    if indices is not None:
+        p = re.compile("run([0-9]+)")
+        runnames = [rn for rn in runnames if p.match(rn) and int(p.match(rn).group(1)) in indices]
+    return runnames
+
 """
 Class that represents a directed graph of pointers between memory regions
 """
@@ -138,19 +248,28 @@ class MemoryGraph:
     nodelist = list of string names of VMAs in the graph
     sourcelist = subset of nodelist where edges can originate.  The remainder of nodes
                  in the graphs can be sinks, but not sources 
-    load_file = json file to deserialize the object data from
+    load_file = JSON or binary .npz file to deserialize the object data from
+    sparse = only store (src, dst) pairs that have at least one edge. Every source still gets a
+             row in adj_matrix, but the rows don't hold empty lists for unconnected destinations.
+             Use the accessor methods rather than indexing adj_matrix directly to work with both layouts.
     """
-    def __init__(self, nodelist=[], srclist=None, load_file=None):
+    def __init__(self, nodelist=[], srclist=None, load_file=None, sparse=False):
         self.adj_matrix = {} # keys are strings, not region objects
+        self.sparse = sparse
+        self.nodelist = [] # names of all regions that edges can point to
+        self._edge_arrays = {} # (src, dst) -> cached NumPy edge arrays
+        self._incoming = None # reverse index: dst -> {src : edges}, built on demand
         if load_file:
             self.deserialize(load_file)
         else:
             if srclist is None:
                 srclist = nodelist
+            self.nodelist = list(nodelist)
             for s in srclist:
                 self.adj_matrix[s] = {}
-                for d in nodelist:
-                    self.adj_matrix[s][d] = []
+                if not sparse:
+                    for d in nodelist:
+                        self.adj_matrix[s][d] = []
 
     """
     Add an edge to the graph
@@ -160,7 +279,28 @@ class MemoryGraph:
     dst_offset = integer offset of pointer destination within destination region
     """
     def add_edge(self, src_region, dst_region, src_offset, dst_offset):
-        return self.adj_matrix[src_region][dst_region].append((src_offset, dst_offset))
+        return self._edge_list(src_region, dst_region).append((src_offset, dst_offset))
+
+    """
+    Add a batch of edges between two regions in one call
+    src_region = string name of source for the edges
+    dst_region = string name of destination for the edges
+    src_offsets = iterable of integer pointer offsets within the source region
+    dst_offsets = iterable of integer pointer destination offsets within the destination region
+    """
+    def add_edges(self, src_region, dst_region, src_offsets, dst_offsets):
+        self._edge_list(src_region, dst_region).extend(zip(src_offsets, dst_offsets))
+
+    """
+    Mutable edge list for a (src, dst) pair, creating it in sparse mode.
+    Drops any cached arrays/indices that the caller is about to invalidate.
+    """
+    def _edge_list(self, src_region, dst_region):
+        self._edge_arrays.pop((src_region, dst_region), None)
+        self._incoming = None
+        if self.sparse:
+            return self.adj_matrix[src_region].setdefault(dst_region, [])
+        return self.adj_matrix[src_region][dst_region]
 
     """
     Get dictionary of edges leaving a particular region
@@ -169,6 +309,20 @@ class MemoryGraph:
     def get_outward_edges(self, src):
         return self.adj_matrix[src]
 
+    """
+    Get dictionary of edges entering a particular region, keyed by source region.
+    Built from a reverse index over the whole graph on first use.
+    dst = string name of destination region
+    """
+    def get_inward_edges(self, dst):
+        if self._incoming is None:
+            self._incoming = {}
+            for src in self.adj_matrix.keys():
+                for d, elist in self.adj_matrix[src].items():
+                    if len(elist) > 0:
+                        self._incoming.setdefault(d, {})[src] = elist
+        return self._incoming.get(dst, {})
+
     """
     Get a list of edges between two regions
     src = string name of source region
@@ -176,26 +330,129 @@ class MemoryGraph:
     returns list of (src_offset, dst_offset) pairs
     """
     def get_edges(self, src, dst):
+        if self.sparse:
+            return self.adj_matrix[src].get(dst, [])
         return self.adj_matrix[src][dst]
 
     """
-    serialize the MemoryGraph into a JSON file 
+    Get the edges between two regions as NumPy arrays
+    src = string name of source region
+    dst = string name of destination region
+    returns (src_offsets, dst_offsets) int64 arrays, cached until the pair gets new edges
+    """
+    def get_edge_arrays(self, src, dst):
+        if (src, dst) not in self._edge_arrays:
+            elist = self.get_edges(src, dst)
+            arr = np.array(elist, dtype=np.int64).reshape(len(elist), 2)
+            self._edge_arrays[(src, dst)] = (arr[:, 0], arr[:, 1])
+        return self._edge_arrays[(src, dst)]
+
+    """
+    serialize the MemoryGraph into a file. Filenames ending in ".npz" are written
+    in the binary format (see `serialize_binary`), everything else as JSON.
     """
     def serialize(self, filename):
-        with open(filename, "w") as f:
-            f.write(json.dumps(self.adj_matrix))
+        if filename.endswith(".npz"):
+            self.serialize_binary(filename)
+        else:
+            with open(filename, "w") as f:
+                f.write(json.dumps(self.adj_matrix))
+        metrics.count(bytes_written=os.path.getsize(filename))
 
-    
     """
-    Load serialized MemoryGraph from filename
+    serialize the MemoryGraph into a compact NumPy .npz file with a region name table and
+    CSR-style edge arrays instead of nested JSON lists:
+    names = region name table
+    sources, nodes = indices into names of the graph's source regions and destination regions
+    pair_src, pair_dst = indices into names of every (src, dst) pair with at least one edge
+    pair_ptr = edges of pair k are src_off[pair_ptr[k]:pair_ptr[k+1]], dst_off[pair_ptr[k]:pair_ptr[k+1]]
+    src_off, dst_off = int64 edge offsets. Signed, because refined graphs hold (-1, -1) placeholder edges.
+    """
+    def serialize_binary(self, filename):
+        names = {}
+        for src in self.adj_matrix.keys():
+            names.setdefault(src, len(names))
+        for dst in self.nodelist:
+            names.setdefault(dst, len(names))
+        for src in self.adj_matrix.keys():
+            for dst in self.adj_matrix[src].keys():
+                names.setdefault(dst, len(names))
+
+        pair_src, pair_dst, pair_ptr = [], [], [0]
+        src_off, dst_off = [], []
+        for src in self.adj_matrix.keys():
+            for dst, elist in self.adj_matrix[src].items():
+                if len(elist) == 0:
+                    continue
+                pair_src.append(names[src])
+                pair_dst.append(names[dst])
+                pair_ptr.append(pair_ptr[-1] + len(elist))
+                src_off += [e[0] for e in elist]
+                dst_off += [e[1] for e in elist]
+
+        with open(filename, "wb") as f:
+            np.savez(f,
+                format_version=np.array([MEMGRAPH_FORMAT_VERSION]),
+                names=np.array(list(names.keys()), dtype=str),
+                sources=np.array([names[s] for s in self.adj_matrix.keys()], dtype=np.int32),
+                nodes=np.array([names[d] for d in self.nodelist], dtype=np.int32),
+                pair_src=np.array(pair_src, dtype=np.int32),
+                pair_dst=np.array(pair_dst, dtype=np.int32),
+                pair_ptr=np.array(pair_ptr, dtype=np.int64),
+                src_off=np.array(src_off, dtype=np.int64),
+                dst_off=np.array(dst_off, dtype=np.int64))
+
+    """
+    Load serialized MemoryGraph from filename. Both the JSON and the binary
+    .npz format are accepted; the format is detected from the file contents.
     """
     def deserialize(self, filename):
+        metrics.count(bytes_read=os.path.getsize(filename))
+        with open(filename, "rb") as f:
+            magic = f.read(4)
+        if magic == NPZ_MAGIC:
+            self.deserialize_binary(filename)
+            return
+
         with open(filename, "r") as f:
             self.adj_matrix = json.loads(f.read())
+
+        # sparse graphs only list connected pairs, so the node list is the union of all row keys and sources
+        nodes = {}
         for src in self.adj_matrix.keys():
             for dst in self.adj_matrix[src].keys():
-                elist = self.adj_matrix[src][dst]
-                self.adj_matrix[src][dst] = [tuple(e) for e in elist]
+                nodes[dst] = None
+        for src in self.adj_matrix.keys():
+            nodes[src] = None
+        self.nodelist = list(nodes.keys())
+
+        for src in self.adj_matrix.keys():
+            row = self.adj_matrix[src]
+            if self.sparse:
+                self.adj_matrix[src] = {dst : [tuple(e) for e in elist] for dst, elist in row.items() if len(elist) > 0}
+            else:
+                self.adj_matrix[src] = {dst : [tuple(e) for e in row.get(dst, [])] for dst in self.nodelist}
+
+    """
+    Load a MemoryGraph written by `serialize_binary`
+    """
+    def deserialize_binary(self, filename):
+        with np.load(filename) as data:
+            if "format_version" not in data:
+                raise ValueError("{} is not a binary memory graph".format(filename))
+            version = int(data["format_version"][0])
+            if version != MEMGRAPH_FORMAT_VERSION:
+                raise ValueError("{} has unsupported format version {}".format(filename, version))
+            names = data["names"].tolist()
+            self.nodelist = [names[i] for i in data["nodes"].tolist()]
+            self.adj_matrix = {}
+            for s in data["sources"].tolist():
+                self.adj_matrix[names[s]] = {} if self.sparse else {d : [] for d in self.nodelist}
+
+            pair_ptr = data["pair_ptr"].tolist()
+            edges = list(zip(data["src_off"].tolist(), data["dst_off"].tolist()))
+            for k, (s, d) in enumerate(zip(data["pair_src"].tolist(), data["pair_dst"].tolist())):
+                self.adj_matrix[names[s]][names[d]] = edges[pair_ptr[k]:pair_ptr[k+1]]
 
 """
 Contains all of the data structures resulting from one run of a target program
@@ -205,34 +462,47 @@ class RunContainer:
 
     """
     runname = prefix for all of the files corresponding to the run. Ex: "run0"
-    heapnames = names of the heap regions. Should correspond do files of the form "run0_[region].dump" in the target directory
+    heapnames = names of the heap regions. Should correspond do files of the form "run0_[region].dump" (or the
+                compressed "run0_[region].cdump" or page list "run0_[region].pages") in the target directory
                 If not specified, all files of the form runname + * + '.dump' will be treated as heaps
     path = directory containing the relevant files
     maplist = data_structures.MapList object for the target run. If not provided, will be searched for in the target path
     memgraph = data_structures.MemGraph object for the target run. If not provided, will be searched for in the target path
     heap_handles = list of file handles for the heap dumps. If not provided, will be loaded from files in the target path
+    use_mmap = memory-map the heap dumps and expose them as zero-copy NumPy uint8 arrays. Reads and
+               iterator windows then become views into the mapping instead of seek/read copies.
     """
-    def __init__(self, runname, heapnames=None, path="./", maplist=None, memgraph=None, heap_handles=None):
+    def __init__(self, runname, heapnames=None, path="./", maplist=None, memgraph=None, heap_handles=None, use_mmap=False):
         self.runname = runname
         self.path = path
 
-        if maplist is None:
-            maplist = MapList(load_file=path + runname + "_maplist.json")
+        with metrics.stage("load_run"): # only recorded inside a stage opened by a CLI entry point
+            if maplist is None:
+                maplist = MapList(load_file=path + runname + "_maplist.json")
 
-        if memgraph is None:
-            memgraph = MemoryGraph(load_file=path + runname + "_memgraph.json")
+            if memgraph is None:
+                memgraph = MemoryGraph(load_file=memgraph_path(path + runname + "_"))
 
         if heapnames is None:
-            p = re.compile('{}_(.*_[0-9]*).dump'.format(runname))
+            # only keep dumps of regions in this run's maplist, so that "run0_p1234_*" dumps
+            # of a per-process run aren't picked up as heaps of "run0"
+            p = re.compile('{}_(.*_[0-9]*)\\.(c?dump|pages)$'.format(re.escape(runname)))
             heapnames = [p.search(f).group(1) for f in os.listdir(path) if p.match(f)]
+            heapnames = list(dict.fromkeys([h for h in heapnames if h in maplist.regions_dict]))
 
         if heap_handles is None:
-            heap_handles = [open(path + runname + "_" + h + ".dump","rb") for h in heapnames]
+            heap_handles = [dumpstore.open_dump(path + runname + "_" + h + ".dump") for h in heapnames]
     
         self.maplist = maplist
         self.memgraph = memgraph
         self.heap_handles = heap_handles
 
+        self.pointer_index = None # per-heap (dst ids, dst offsets, heap offsets), see `build_pointer_index`
+        self.pointer_index_names = {} # destination region name -> dst id used in pointer_index
+        self.heap_arrays = None # uint8 views of the mapped heaps, when use_mmap is set
+        if use_mmap:
+            self.heap_arrays = [self._map_heap(h) for h in heap_handles]
+
         self.heap_regions = [maplist.find_region(h) for h in heapnames]
 
     """
@@ -242,6 +512,11 @@ class RunContainer:
     nbytes = number of bytes to read
     """
     def read_heap_bytes(self, heapnum, offset, nbytes):
+        if self.heap_arrays is not None:
+            if offset < 0:
+                raise ValueError("negative heap offset {}".format(offset))
+            return self.heap_arrays[heapnum][offset:offset + nbytes]
+
         self.heap_handles[heapnum].seek(offset)
         return self.heap_handles[heapnum].read(nbytes)
 
@@ -249,20 +524,55 @@ class RunContainer:
     Scan all heap dumps in this run for pointers to a particular region
     dst_region_name = name of pointer's destination region
     offset = offset within the destination region that the pointer reference
-    returns a nested list. Each inner list represents a heap, as contains
-    a list of offsets within the heap that contain the target pointer.
+    returns a list with one entry per heap. Each entry is an int64 NumPy array of the
+    offsets within that heap that contain the target pointer, in ascending order.
     """
     def scan_for_pointer(self, dst_region_name, offset):
+        if self.pointer_index is None:
+            self.build_pointer_index()
+
         addrs = []
-        for h in self.heap_regions:
-            heaplist = []
-            for edge in self.memgraph.get_edges(h.name, dst_region_name):
-                if edge[1] == offset:
-                    heaplist.append(edge[0])
-            addrs.append(heaplist)
+        dst_id = self.pointer_index_names.get(dst_region_name)
+        for dsts, offs, srcs in self.pointer_index:
+            if dst_id is None:
+                addrs.append(srcs[:0])
+                continue
+            lo = np.searchsorted(dsts, dst_id, side="left")
+            hi = np.searchsorted(dsts, dst_id, side="right")
+            a = lo + np.searchsorted(offs[lo:hi], offset, side="left")
+            b = lo + np.searchsorted(offs[lo:hi], offset, side="right")
+            addrs.append(srcs[a:b])
 
         return addrs
 
+    """
+    Build the inverted index used by `scan_for_pointer`. For each heap, all outgoing edges
+    are sorted by (destination region id, destination offset), with the matching heap
+    offsets kept in a contiguous array so a lookup is two binary searches and a slice.
+    """
+    def build_pointer_index(self):
+        self.pointer_index_names = {}
+        self.pointer_index = []
+        for h in self.heap_regions:
+            dsts, offs, srcs = [], [], []
+            for dst in self.memgraph.get_outward_edges(h.name).keys():
+                src_off, dst_off = self.memgraph.get_edge_arrays(h.name, dst)
+                if len(src_off) == 0:
+                    continue
+                dst_id = self.pointer_index_names.setdefault(dst, len(self.pointer_index_names))
+                dsts.append(np.full(len(src_off), dst_id, dtype=np.int64))
+                offs.append(dst_off)
+                srcs.append(src_off)
+
+            if len(dsts) == 0:
+                empty = np.zeros(0, dtype=np.int64)
+                self.pointer_index.append((empty, empty, empty))
+                continue
+
+            dsts, offs, srcs = np.concatenate(dsts), np.concatenate(offs), np.concatenate(srcs)
+            order = np.lexsort((offs, dsts)) # stable, so heap offsets stay ascending within a key
+            self.pointer_index.append((dsts[order], offs[order], srcs[order]))
+
     """
     Return a dictionary of the most frequent pointer destinations in this 
     run. Optionally, add the tally to an existing dictionary.
@@ -277,13 +587,15 @@ class RunContainer:
         if pointer_dict is None:
             pointer_dict = {}
 
-        for h in self.heap_regions:
-            for dst in self.memgraph.adj_matrix[h.name].keys():
-                for ptr in self.memgraph.adj_matrix[h.name][dst]:
-                    pointer_id = (dst, ptr[1])
-                    if pointer_id not in pointer_dict:
-                        pointer_dict[pointer_id] = 0
-                    pointer_dict[pointer_id] += 1
+        with metrics.stage("rank_most_frequent"):
+            for h in self.heap_regions:
+                for dst in self.memgraph.adj_matrix[h.name].keys():
+                    for ptr in self.memgraph.adj_matrix[h.name][dst]:
+                        pointer_id = (dst, ptr[1])
+                        if pointer_id not in pointer_dict:
+                            pointer_dict[pointer_id] = 0
+                        pointer_dict[pointer_id] += 1
+                    metrics.count(edges=len(self.memgraph.adj_matrix[h.name][dst]))
 
         return pointer_dict
 
@@ -295,6 +607,14 @@ class RunContainer:
     postread = number of bytes ot read after the read offset
     """
     def heap_iterator(self, heapnum, offset, stride, preread, postread):
+        if self.heap_arrays is not None:
+            heap = self.heap_arrays[heapnum]
+            pos = offset
+            while pos - preread >= 0 and pos + postread <= len(heap):
+                yield pos, heap[pos - preread:pos + postread] # view, not a copy
+                pos += stride
+            return
+
         h = self.heap_handles[heapnum]
         pos = offset
 
@@ -306,9 +626,622 @@ class RunContainer:
             pos += stride
             h.seek(pos - preread)
             mem = h.read(preread + postread)
+
+    """
+    Get the full contents of a heap as a uint8 NumPy array. In mmap mode this is a
+    zero-copy view of the dump; otherwise the dump is read into memory.
+    heapnum = index of the heap in question
+    """
+    def get_heap_array(self, heapnum):
+        if self.heap_arrays is not None:
+            return self.heap_arrays[heapnum]
+
+        h = self.heap_handles[heapnum]
+        h.seek(0)
+        return np.frombuffer(h.read(), dtype=np.uint8)
+
+    """
+    Strided-view counterpart of `heap_iterator`. Covers the same windows, but returns them all
+    at once as a read-only 2D array whose rows alias the heap data.
+    heapnum = index of the heap to be read from
+    offset, stride, preread, postread = same as `heap_iterator`
+    returns (positions, windows). positions is an int64 array of window centers and
+    windows[k] holds the bytes in [positions[k] - preread, positions[k] + postread)
+    """
+    def heap_windows(self, heapnum, offset, stride, preread, postread):
+        heap = self.get_heap_array(heapnum)
+        width = preread + postread
+        if offset - preread < 0 or offset + postread > len(heap):
+            return np.zeros(0, dtype=np.int64), np.zeros([0, width], dtype=np.uint8)
+
+        n = (len(heap) - offset - postread) // stride + 1
+        positions = offset + stride * np.arange(n, dtype=np.int64)
+        base = heap[offset - preread:]
+        windows = np.lib.stride_tricks.as_strided(base, shape=(n, width), strides=(stride * base.strides[0], base.strides[0]), writeable=False)
+        return positions, windows
+
+    """
+    Memory-map an open heap dump and wrap the mapping in a uint8 array
+    handle = file handle of the heap dump
+    """
+    def _map_heap(self, handle):
+        if isinstance(handle, dumpstore.BlockReader):
+            return np.frombuffer(handle.readall(), dtype=np.uint8) # .cdump/.pages can't be mapped, read it instead
+        if os.fstat(handle.fileno()).st_size == 0:
+            return np.zeros(0, dtype=np.uint8) # empty files can't be mapped
+        return np.frombuffer(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+
     """
     Convieniance function for getting the length of a heap
     heapnum = index of the heap in question
     """
     def get_heap_size(self, heapnum):
-        return self.heap_regions[heapnum].end - self.heap_regions[heapnum].start
\ No newline at end of file
+        return self.heap_regions[heapnum].end - self.heap_regions[heapnum].start
+
+"""
+Frequency ranking of pointer destinations across all heaps of a dataset, saved on disk so
+that repeated analyses don't re-tally every edge. Pointers are ordered exactly like sorting the
+output of RunContainer.rank_most_frequent by count, with ties kept in first-seen order.
+"""
+class PointerRanking:
+
+    """
+    rundata = list of RunContainer objects to build the ranking from
+    load_file = .npz file written by `serialize` to load the ranking from instead
+    """
+    def __init__(self, rundata=None, load_file=None):
+        self.dst_names = [] # destination region name table
+        self.dst_ids = np.zeros(0, dtype=np.int32) # per pointer, in rank order: index into dst_names
+        self.offsets = np.zeros(0, dtype=np.int64) # per pointer: offset within the destination region
+        self.totals = np.zeros(0, dtype=np.int64) # per pointer: occurences across all runs and heaps
+        self.run_counts = np.zeros([0, 0], dtype=np.int32) # pointer x run occurence counts
+        self.heap_ptr = np.zeros(1, dtype=np.int64) # CSR row pointers of the per-heap counts
+        self.heap_cols = np.zeros(0, dtype=np.int32) # CSR column (index into `heaps`) of each nonzero count
+        self.heap_vals = np.zeros(0, dtype=np.int32) # CSR value of each nonzero count
+        self.runnames = []
+        self.heaps = [] # (run index, heap name) of each per-heap count column
+        self.stamps = [] # (size, mtime_ns) of each run's memgraph file when the ranking was built
+
+        if load_file:
+            self.deserialize(load_file)
+        elif rundata is not None:
+            self.build(rundata)
+
+    """
+    Tally the pointers of every heap in every run
+    """
+    def build(self, rundata):
+        self.runnames = [rd.runname for rd in rundata]
+        self.heaps = [(r, h.name) for r, rd in enumerate(rundata) for h in rd.heap_regions]
+        self.stamps = [memgraph_stamp(rd) for rd in rundata]
+
+        names = {}
+        dst_ids, offsets, cols = [], [], []
+        for col, (r, heapname) in enumerate(self.heaps):
+            mg = rundata[r].memgraph
+            for dst in mg.adj_matrix[heapname].keys():
+                _, dst_off = mg.get_edge_arrays(heapname, dst)
+                if len(dst_off) == 0:
+                    continue
+                dst_ids.append(np.full(len(dst_off), names.setdefault(dst, len(names)), dtype=np.int64))
+                offsets.append(dst_off)
+                cols.append(np.full(len(dst_off), col, dtype=np.int64))
+        self.dst_names = list(names.keys())
+
+        if len(dst_ids) == 0:
+            self.run_counts = np.zeros([0, len(rundata)], dtype=np.int32)
+            return
+
+        dst_ids = np.concatenate(dst_ids)
+        offsets = np.concatenate(offsets)
+        cols = np.concatenate(cols)
+
+        # one key per distinct (dst, offset), remembering where each key was first seen
+        keys = np.stack([dst_ids, offsets], axis=1)
+        uniq, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        totals = np.bincount(inverse, minlength=len(uniq))
+
+        # descending count, ties broken by first appearance (matches a stable sort of the dict tally)
+        order = np.lexsort((first, -totals))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        self.dst_ids = uniq[order, 0].astype(np.int32)
+        self.offsets = uniq[order, 1]
+        self.totals = totals[order]
+
+        # per-heap counts as CSR, rows in rank order
+        cell = rank[inverse] * len(self.heaps) + cols
+        cells, cell_counts = np.unique(cell, return_counts=True)
+        rows = cells // len(self.heaps)
+        self.heap_cols = (cells % len(self.heaps)).astype(np.int32)
+        self.heap_vals = cell_counts.astype(np.int32)
+        self.heap_ptr = np.searchsorted(rows, np.arange(len(order) + 1)).astype(np.int64)
+
+        heap_runs = np.array([r for r, _ in self.heaps], dtype=np.int64)
+        self.run_counts = np.zeros([len(order), len(rundata)], dtype=np.int32)
+        np.add.at(self.run_counts, (rows, heap_runs[self.heap_cols]), self.heap_vals)
+
+    """
+    Number of distinct pointers in the ranking
+    """
+    def __len__(self):
+        return len(self.totals)
+
+    """
+    Get the pointer of a given rank
+    rank = index of the pointer, with 0 representing the most frequent
+    returns ((destination_name, offset), count)
+    """
+    def get(self, rank):
+        return (self.dst_names[self.dst_ids[rank]], int(self.offsets[rank])), int(self.totals[rank])
+
+    """
+    Get the k most frequent pointers, in the format returned by `get`
+    """
+    def top(self, k):
+        return [self.get(i) for i in range(min(k, len(self)))]
+
+    """
+    Occurences of a ranked pointer in each heap
+    returns a dictionary mapping (run index, heap name) to count, for heaps where the pointer appears
+    """
+    def heap_counts(self, rank):
+        lo, hi = self.heap_ptr[rank], self.heap_ptr[rank + 1]
+        return {self.heaps[c] : int(v) for c, v in zip(self.heap_cols[lo:hi], self.heap_vals[lo:hi])}
+
+    """
+    Whether the ranking was built from exactly these runs and heaps, with unchanged memgraph files
+    """
+    def matches(self, rundata):
+        return (self.runnames == [rd.runname for rd in rundata]
+            and self.heaps == [(r, h.name) for r, rd in enumerate(rundata) for h in rd.heap_regions]
+            and self.stamps == [memgraph_stamp(rd) for rd in rundata])
+
+    """
+    Save the ranking into a .npz file
+    """
+    def serialize(self, filename):
+        with open(filename, "wb") as f:
+            np.savez(f,
+                dst_names=np.array(self.dst_names, dtype=str),
+                dst_ids=self.dst_ids,
+                offsets=self.offsets,
+                totals=self.totals,
+                run_counts=self.run_counts,
+                heap_ptr=self.heap_ptr,
+                heap_cols=self.heap_cols,
+                heap_vals=self.heap_vals,
+                runnames=np.array(self.runnames, dtype=str),
+                heap_runs=np.array([r for r, _ in self.heaps], dtype=np.int32),
+                heap_names=np.array([h for _, h in self.heaps], dtype=str),
+                stamps=np.array(self.stamps, dtype=np.int64).reshape(len(self.stamps), 2))
+
+    """
+    Load a ranking saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.dst_names = data["dst_names"].tolist()
+            self.dst_ids = data["dst_ids"]
+            self.offsets = data["offsets"]
+            self.totals = data["totals"]
+            self.run_counts = data["run_counts"]
+            self.heap_ptr = data["heap_ptr"]
+            self.heap_cols = data["heap_cols"]
+            self.heap_vals = data["heap_vals"]
+            self.runnames = data["runnames"].tolist()
+            self.heaps = list(zip(data["heap_runs"].tolist(), data["heap_names"].tolist()))
+            self.stamps = [tuple(s) for s in data["stamps"].tolist()]
+
+"""
+(size, mtime_ns) of a file, used to tell whether a cached result built from it is out of date
+"""
+def file_stamp(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime_ns)
+
+"""
+(size, mtime_ns) of the memgraph file a RunContainer was loaded from
+"""
+def memgraph_stamp(rd):
+    return file_stamp(memgraph_path(rd.path + rd.runname + "_"))
+
+"""
+Load the pointer ranking cached in a dataset directory, or build and save it if it is
+missing or out of date (different runs/heaps, or a memgraph file changed size or mtime).
+A cache that can't be read counts as missing, and the dataset is left as it is if it can't be written.
+path = dataset directory
+rundata = list of RunContainer objects for the runs in the directory
+"""
+def load_pointer_ranking(path, rundata, filename="pointer_rank.npz"):
+    cache = os.path.join(path, filename)
+    if os.path.exists(cache):
+        try:
+            ranking = PointerRanking(load_file=cache)
+            if ranking.matches(rundata):
+                return ranking
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            pass
+
+    ranking = PointerRanking(rundata)
+    try:
+        # write next to the cache and rename, so concurrent readers never see a half-written file
+        fd, tmp = tempfile.mkstemp(dir=path, prefix="." + filename + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            ranking.serialize(tmp)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, cache)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError:
+        pass # e.g. a read-only or shared dataset
+    return ranking
+
+"""
+Merge rows of keys, summing the counts of identical rows
+keys = list of equal-length integer arrays, one per key column
+counts = count of each row
+returns (key columns, counts) with one row per distinct key, sorted by the columns in order
+"""
+def _merge_counts(keys, counts):
+    if len(counts) == 0:
+        return keys, counts
+    order = np.lexsort(keys[::-1])
+    keys = [k[order] for k in keys]
+    first = np.zeros(len(counts), dtype=bool)
+    first[0] = True
+    for k in keys:
+        first[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(first)
+    return [k[starts] for k in keys], np.add.reduceat(counts[order], starts)
+
+"""
+Running tally of a graph refinement: the number of runs in which every edge, region, and pair of
+directly adjacent same-named regions was seen. Edges are kept as arrays sorted by
+(src, dst, src_offset, dst_offset), so folding in a new run is a single vectorized merge, and the
+refined graph can be produced for any quorum (edges present in at least k of the runs).
+"""
+class RefinementState:
+
+    """
+    load_file = .npz file written by `serialize` to load the state from
+    """
+    def __init__(self, load_file=None):
+        self.names = [] # region name table
+        self.name_ids = {} # region name -> index into names
+        self.edge_src = np.zeros(0, dtype=np.int64) # per distinct edge: index into names of the source region
+        self.edge_dst = np.zeros(0, dtype=np.int64) # per distinct edge: index into names of the destination region
+        self.edge_src_off = np.zeros(0, dtype=np.int64)
+        self.edge_dst_off = np.zeros(0, dtype=np.int64)
+        self.edge_counts = np.zeros(0, dtype=np.int64) # per distinct edge: number of runs containing it
+        self.source_counts = np.zeros(0, dtype=np.int64) # per name: number of runs where the region was scanned for pointers
+        self.node_counts = np.zeros(0, dtype=np.int64) # per name: number of runs where the region was a graph node
+        self.link_a = np.zeros(0, dtype=np.int64) # per adjacent pair: index into names of the lower region
+        self.link_b = np.zeros(0, dtype=np.int64) # per adjacent pair: index into names of the region starting where link_a ends
+        self.link_counts = np.zeros(0, dtype=np.int64) # per adjacent pair: number of runs where the pair was adjacent
+        self.runnames = []
+        self.stamps = [] # (size, mtime_ns) of each run's memgraph file when it was folded in
+
+        if load_file:
+            self.deserialize(load_file)
+
+    """
+    Indices into the name table of a list of region names, adding the names that are new
+    """
+    def _ids(self, names):
+        for n in names:
+            if n not in self.name_ids:
+                self.name_ids[n] = len(self.names)
+                self.names.append(n)
+        grow = len(self.names) - len(self.source_counts)
+        if grow > 0:
+            self.source_counts = np.concatenate([self.source_counts, np.zeros(grow, dtype=np.int64)])
+            self.node_counts = np.concatenate([self.node_counts, np.zeros(grow, dtype=np.int64)])
+        return np.array([self.name_ids[n] for n in names], dtype=np.int64)
+
+    """
+    Add one run to the tally
+    runname = name of the run. Ex: "run0"
+    memgraph = MemoryGraph of the run
+    maplist = MapList of the run
+    stamp = (size, mtime_ns) of the run's memgraph file, see `file_stamp`
+    """
+    def fold(self, runname, memgraph, maplist, stamp):
+        self.runnames.append(runname)
+        self.stamps.append(tuple(stamp))
+
+        src_ids = np.unique(self._ids(list(memgraph.adj_matrix.keys())))
+        node_ids = np.unique(self._ids(memgraph.nodelist))
+        self.source_counts[src_ids] += 1
+        self.node_counts[node_ids] += 1
+
+        cols = [[], [], [], []]
+        for src in memgraph.adj_matrix.keys():
+            for dst in memgraph.adj_matrix[src].keys():
+                src_off, dst_off = memgraph.get_edge_arrays(src, dst)
+                if len(src_off) == 0:
+                    continue
+                cols[0].append(np.full(len(src_off), self.name_ids[src], dtype=np.int64))
+                cols[1].append(np.full(len(src_off), self._ids([dst])[0], dtype=np.int64))
+                cols[2].append(src_off)
+                cols[3].append(dst_off)
+        if len(cols[0]) > 0:
+            # every distinct edge of the run counts once
+            keys, _ = _merge_counts([np.concatenate(c) for c in cols], np.ones(sum([len(c) for c in cols[0]]), dtype=np.int64))
+            old = [self.edge_src, self.edge_dst, self.edge_src_off, self.edge_dst_off]
+            keys, self.edge_counts = _merge_counts([np.concatenate([o, k]) for o, k in zip(old, keys)],
+                np.concatenate([self.edge_counts, np.ones(len(keys[0]), dtype=np.int64)]))
+            self.edge_src, self.edge_dst, self.edge_src_off, self.edge_dst_off = keys
+
+        # same-named regions only need to be compared with each other, and a region can only be
+        # directly followed by the next one of its name in address order
+        by_prefix = {}
+        for reg in maplist.regions_list:
+            by_prefix.setdefault("_".join(reg.name.split("_")[:-1]), []).append(reg)
+        pairs = []
+        for regs in by_prefix.values():
+            regs = sorted(regs, key = lambda r : r.start)
+            pairs += [(a.name, b.name) for a, b in zip(regs, regs[1:]) if a.end == b.start]
+        if len(pairs) > 0:
+            keys = [np.concatenate([self.link_a, self._ids([a for a, _ in pairs])]),
+                np.concatenate([self.link_b, self._ids([b for _, b in pairs])])]
+            (self.link_a, self.link_b), self.link_counts = _merge_counts(keys,
+                np.concatenate([self.link_counts, np.ones(len(pairs), dtype=np.int64)]))
+
+    """
+    Whether every folded-in run is among these runs, with an unchanged memgraph file
+    runnames, stamps = names and memgraph stamps of the runs that are available
+    """
+    def consistent_with(self, runnames, stamps):
+        available = dict(zip(runnames, [tuple(s) for s in stamps]))
+        return all([available.get(rn) == st for rn, st in zip(self.runnames, self.stamps)])
+
+    """
+    Build the refined memory graph
+    quorum = minimum number of runs an edge (and its regions) must appear in. Defaults to all runs.
+    link = add (-1, -1) placeholder edges between same-named regions that are directly adjacent in at
+           least `quorum` runs and aren't otherwise connected
+    returns a sparse MemoryGraph
+    """
+    def graph(self, quorum=None, link=True):
+        if quorum is None:
+            quorum = len(self.runnames)
+
+        sources = [self.names[i] for i in np.flatnonzero(self.source_counts >= quorum)]
+        nodes = [self.names[i] for i in np.flatnonzero(self.node_counts >= quorum)]
+        memgraph = MemoryGraph(nodes, sources, sparse=True)
+
+        keep = np.flatnonzero(self.edge_counts >= quorum)
+        src, dst = self.edge_src[keep], self.edge_dst[keep]
+        src_off, dst_off = self.edge_src_off[keep], self.edge_dst_off[keep]
+        if len(keep) > 0:
+            # edges are sorted, so each (src, dst) pair is one contiguous block
+            first = np.ones(len(keep), dtype=bool)
+            first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+            bounds = np.append(np.flatnonzero(first), len(keep))
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                memgraph.add_edges(self.names[src[lo]], self.names[dst[lo]], src_off[lo:hi].tolist(), dst_off[lo:hi].tolist())
+
+        if link:
+            nodeset = set(nodes)
+            for k in np.flatnonzero(self.link_counts >= quorum):
+                a, b = self.names[self.link_a[k]], self.names[self.link_b[k]]
+                for s, d in [(a, b), (b, a)]:
+                    if s in memgraph.adj_matrix and d in nodeset and len(memgraph.get_edges(s, d)) == 0:
+                        memgraph.add_edge(s, d, -1, -1) #placeholder edge
+
+        return memgraph
+
+    """
+    Save the state into a .npz file
+    """
+    def serialize(self, filename):
+        with open(filename, "wb") as f:
+            np.savez(f,
+                names=np.array(self.names, dtype=str),
+                edge_src=self.edge_src,
+                edge_dst=self.edge_dst,
+                edge_src_off=self.edge_src_off,
+                edge_dst_off=self.edge_dst_off,
+                edge_counts=self.edge_counts,
+                source_counts=self.source_counts,
+                node_counts=self.node_counts,
+                link_a=self.link_a,
+                link_b=self.link_b,
+                link_counts=self.link_counts,
+                runnames=np.array(self.runnames, dtype=str),
+                stamps=np.array(self.stamps, dtype=np.int64).reshape(len(self.stamps), 2))
+
+    """
+    Load a state saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.names = data["names"].tolist()
+            self.name_ids = {n : i for i, n in enumerate(self.names)}
+            self.edge_src = data["edge_src"]
+            self.edge_dst = data["edge_dst"]
+            self.edge_src_off = data["edge_src_off"]
+            self.edge_dst_off = data["edge_dst_off"]
+            self.edge_counts = data["edge_counts"]
+            self.source_counts = data["source_counts"]
+            self.node_counts = data["node_counts"]
+            self.link_a = data["link_a"]
+            self.link_b = data["link_b"]
+            self.link_counts = data["link_counts"]
+            self.runnames = data["runnames"].tolist()
+            self.stamps = [tuple(s) for s in data["stamps"].tolist()]
+
+
+"""
+What the previous snapshot of a process saw: its memory map, and for every scanned region the
+content hash of each page and the edges found in it. Lets build_graph.build_graph_from_reader
+rescan only the pages that changed and patch the other pages' edges in from the last snapshot.
+"""
+class SnapshotState:
+
+    """
+    load_file = .npz file written by `serialize` to load the state from
+    """
+    def __init__(self, load_file=None):
+        self.pointer_sz = 0 # pointer size the edges were found with
+        self.page_sz = dumpstore.PAGE_SZ
+        self.map = [] # (start, end, name) of every region, in MapList.regions_list order
+        self.regions = {} # source region name -> (page hashes, dst ids, src offsets, dst offsets), edges sorted by
+                          # src offset. dst ids index into `map`, like FrozenMapList region ids.
+
+        if load_file:
+            self.deserialize(load_file)
+
+    """
+    Whether the edges of the last snapshot still hold for a new one: the map is unchanged,
+    so every word resolves to the same region and offset, and pointers have the same size
+    """
+    def matches(self, maplist, pointer_sz):
+        return pointer_sz == self.pointer_sz and self.map == [tuple(r) for r in maplist.regions_list]
+
+    """
+    Replace the state with the results of a new snapshot
+    regions = source region name -> (page hashes, dst ids, src offsets, dst offsets)
+    """
+    def update(self, maplist, pointer_sz, regions):
+        self.map = [tuple(r) for r in maplist.regions_list]
+        self.pointer_sz = pointer_sz
+        self.regions = regions
+
+    """
+    Save the state into a .npz file. The per-region arrays are concatenated, with
+    row pointers (page_ptr, edge_ptr) marking where each region's slice starts.
+    """
+    def serialize(self, filename):
+        names = list(self.regions.keys())
+        cols = [[self.regions[n][k] for n in names] for k in range(4)]
+        with open(filename, "wb") as f:
+            np.savez(f,
+                pointer_sz=np.array([self.pointer_sz]),
+                page_sz=np.array([self.page_sz]),
+                map_starts=np.array([r[0] for r in self.map], dtype=np.uint64),
+                map_ends=np.array([r[1] for r in self.map], dtype=np.uint64),
+                map_names=np.array([r[2] for r in self.map], dtype=str),
+                names=np.array(names, dtype=str),
+                page_ptr=np.cumsum([0] + [len(h) for h in cols[0]]).astype(np.int64),
+                edge_ptr=np.cumsum([0] + [len(d) for d in cols[1]]).astype(np.int64),
+                hashes=np.concatenate(cols[0]) if names else np.zeros(0, dtype=np.uint64),
+                dst_ids=np.concatenate(cols[1]) if names else np.zeros(0, dtype=np.int64),
+                src_off=np.concatenate(cols[2]) if names else np.zeros(0, dtype=np.uint64),
+                dst_off=np.concatenate(cols[3]) if names else np.zeros(0, dtype=np.uint64))
+
+    """
+    Load a state saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.pointer_sz = int(data["pointer_sz"][0])
+            self.page_sz = int(data["page_sz"][0])
+            self.map = list(zip(data["map_starts"].tolist(), data["map_ends"].tolist(), data["map_names"].tolist()))
+            page_ptr, edge_ptr = data["page_ptr"], data["edge_ptr"]
+            self.regions = {}
+            for k, name in enumerate(data["names"].tolist()):
+                p, e = slice(page_ptr[k], page_ptr[k+1]), slice(edge_ptr[k], edge_ptr[k+1])
+                self.regions[name] = (data["hashes"][p], data["dst_ids"][e], data["src_off"][e], data["dst_off"][e])
+
+
+"""
+Load the SnapshotState saved by the previous snapshot of a process
+filename = .npz state file, or None
+returns the loaded state, an empty state if the file doesn't exist yet, or None if filename is None
+"""
+def load_snapshot_state(filename):
+    if filename is None:
+        return None
+    if not os.path.exists(filename):
+        return SnapshotState()
+    return SnapshotState(load_file=filename)
+
+
+"""
+Time series of how many pointers to each (destination region, offset) a process holds,
+one column per snapshot. Written by monitor.py to watch pointer stability over time.
+"""
+class PointerSeries:
+
+    """
+    load_file = .npz file written by `serialize` to load the series from
+    """
+    def __init__(self, load_file=None):
+        self.names = [] # destination region name table
+        self.dst_ids = np.zeros(0, dtype=np.int32) # per tracked pointer: index into names
+        self.offsets = np.zeros(0, dtype=np.int64) # per tracked pointer: offset within the destination region
+        self.times = np.zeros(0, dtype=np.float64) # unix time of each snapshot
+        self.runnames = []
+        self.counts = np.zeros([0, 0], dtype=np.int32) # pointer x snapshot counts
+        self._index = {} # (name, offset) -> row
+
+        if load_file:
+            self.deserialize(load_file)
+
+    """
+    Add the pointer counts of a snapshot
+    runname = name of the snapshot's files. Ex: "run3"
+    t = time of the snapshot
+    memgraph = data_structures.MemoryGraph of the snapshot
+    min_count = only start tracking pointers that occur at least this many times in a snapshot.
+                Pointers that are already tracked are always counted.
+    """
+    def append(self, runname, t, memgraph, min_count=1):
+        tally = {}
+        for src in memgraph.adj_matrix.keys():
+            for dst in memgraph.adj_matrix[src].keys():
+                _, dst_off = memgraph.get_edge_arrays(src, dst)
+                offs, n = np.unique(dst_off, return_counts=True)
+                for off, c in zip(offs.tolist(), n.tolist()):
+                    tally[(dst, off)] = tally.get((dst, off), 0) + c
+
+        new = [key for key, c in tally.items() if c >= min_count and key not in self._index]
+        names = {n : i for i, n in enumerate(self.names)}
+        for name, off in new:
+            self._index[(name, off)] = len(self._index)
+            names.setdefault(name, len(names))
+        self.names = list(names.keys())
+        self.dst_ids = np.concatenate([self.dst_ids, np.array([names[n] for n, _ in new], dtype=np.int32)])
+        self.offsets = np.concatenate([self.offsets, np.array([o for _, o in new], dtype=np.int64)])
+
+        column = np.zeros(len(self._index), dtype=np.int32)
+        for key, row in self._index.items():
+            column[row] = tally.get(key, 0)
+        counts = np.zeros([len(self._index), self.counts.shape[1] + 1], dtype=np.int32)
+        counts[:self.counts.shape[0], :self.counts.shape[1]] = self.counts
+        counts[:, -1] = column
+        self.counts = counts
+        self.times = np.append(self.times, t)
+        self.runnames.append(runname)
+
+    """
+    Save the series into a .npz file
+    """
+    def serialize(self, filename):
+        with open(filename, "wb") as f:
+            np.savez(f,
+                names=np.array(self.names, dtype=str),
+                dst_ids=self.dst_ids,
+                offsets=self.offsets,
+                times=self.times,
+                runnames=np.array(self.runnames, dtype=str),
+                counts=self.counts)
+
+    """
+    Load a series saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.names = data["names"].tolist()
+            self.dst_ids = data["dst_ids"]
+            self.offsets = data["offsets"]
+            self.times = data["times"]
+            self.runnames = data["runnames"].tolist()
+            self.counts = data["counts"]
+        self._index = {(self.names[d], o) : row for row, (d, o) in enumerate(zip(self.dst_ids.tolist(), self.offsets.tolist()))}
@@ -0,0 +1,520 @@
+"""
+Block-compressed memory dumps. A ".cdump" file holds the same bytes as a ".dump" file, split into
+fixed-size blocks that are compressed independently (zlib or lzma), so any range can be read by
+decompressing only the blocks it touches. All-zero blocks are stored as holes, and blocks that
+repeat (e.g. identical library pages) are stored once.
+
+Layout (little-endian):
+    header: magic "CDMP", format version (u16), codec (u16), block size (u32), raw size (u64),
+            number of blocks (u64), offset of the block index (u64)
+    block data
+    block index: per block, file offset (u64), stored length (u32) and kind (u8, see BLOCK_*)
+
+Dumps can also be kept in a dataset-wide content-addressed page store (see PageStore), which holds
+every distinct page once across all runs. A region is then a ".pages" file listing its page ids:
+    header: magic "PGLS", format version (u16), page size (u32), raw size (u64), number of pages (u64)
+    page ids (i64), -1 for all-zero pages
+"""
+
+import hashlib
+import lzma
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+
+
+CDUMP_MAGIC = b"CDMP"
+CDUMP_FORMAT_VERSION = 1
+COMPRESSED_SUFFIX = ".cdump"
+
+"""
+Number of raw bytes per block. Small enough that random reads stay cheap, large enough to compress well.
+"""
+DEFAULT_BLOCK_SZ = 1 << 16
+
+HEADER = struct.Struct("<4sHHIQQQ")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("kind", "u1")])
+
+"""
+How a block is stored
+"""
+BLOCK_HOLE = 0 # all zeros, nothing stored
+BLOCK_COMPRESSED = 1
+BLOCK_RAW = 2 # stored uncompressed because compressing didn't make it smaller
+
+CODECS = {"zlib" : 1, "lzma" : 2}
+
+PAGES_MAGIC = b"PGLS"
+PAGES_FORMAT_VERSION = 1
+PAGES_SUFFIX = ".pages"
+PAGES_HEADER = struct.Struct("<4sHIQQ")
+PAGE_STORE_DIR = "pages"
+PAGE_SZ = 4096
+
+
+def _compress(codec, data, level):
+    if codec == CODECS["zlib"]:
+        return zlib.compress(data, level)
+    return lzma.compress(data, preset=level)
+
+def _decompress(codec, data):
+    if codec == CODECS["zlib"]:
+        return zlib.decompress(data)
+    return lzma.decompress(data)
+
+
+"""
+Name of the compressed counterpart of a dump file. Ex: "run0_[heap]_0.dump" -> "run0_[heap]_0.cdump"
+"""
+def compressed_name(filename):
+    if filename.endswith(".dump"):
+        filename = filename[:-len(".dump")]
+    return filename + COMPRESSED_SUFFIX
+
+"""
+Name of the page list that stands in for a dump file. Ex: "run0_[heap]_0.dump" -> "run0_[heap]_0.pages"
+"""
+def pages_name(filename):
+    if filename.endswith(".dump"):
+        filename = filename[:-len(".dump")]
+    return filename + PAGES_SUFFIX
+
+"""
+Locate a dump on disk
+filename = path of the raw dump. Ex: "ff_heap/run0_[heap]_0.dump"
+returns the raw dump if it exists, otherwise its compressed counterpart or page list if one
+of those exists, otherwise None
+"""
+def find_dump(filename):
+    for f in [filename, compressed_name(filename), pages_name(filename)]:
+        if os.path.exists(f):
+            return f
+    return None
+
+"""
+Open a stored dump file of any format, chosen by its extension (.dump, .cdump or .pages)
+returns a binary file object, or a CompressedDump/PagedDump which supports the same read/seek/tell calls
+"""
+def open_stored(filename):
+    if filename.endswith(COMPRESSED_SUFFIX):
+        return CompressedDump(filename)
+    if filename.endswith(PAGES_SUFFIX):
+        return PagedDump(filename)
+    return open(filename, "rb")
+
+"""
+Open a dump for reading, however it is stored
+filename = path of the raw dump (see `find_dump`)
+"""
+def open_dump(filename):
+    found = find_dump(filename)
+    if found is None:
+        raise FileNotFoundError("no dump at {} (or its .cdump/.pages counterparts)".format(filename))
+    return open_stored(found)
+
+
+"""
+Read-only, seekable file-like view of data made up of fixed-size blocks. Subclasses set
+`size` and `block_size` and load blocks in `_load_block`; the most recently used block
+is kept to serve runs of small reads.
+"""
+class BlockReader:
+
+    def __init__(self):
+        self.pos = 0
+        self._cached = (-1, b"")
+
+    """
+    Raw contents of one block
+    """
+    def _block(self, i):
+        if self._cached[0] != i:
+            self._cached = (i, self._load_block(i))
+        return self._cached[1]
+
+    """
+    Read up to n bytes from the current position (everything that is left if n is negative)
+    """
+    def read(self, n=-1):
+        end = self.size if n is None or n < 0 else min(self.size, self.pos + n)
+        pieces = []
+        while self.pos < end:
+            i, start = divmod(self.pos, self.block_size)
+            piece = self._block(i)[start:start + end - self.pos]
+            pieces.append(piece)
+            self.pos += len(piece)
+        return b"".join(pieces)
+
+    """
+    Read the whole dump
+    """
+    def readall(self):
+        self.pos = 0
+        return self.read()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError("negative seek position {}".format(offset))
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+"""
+Read-only, seekable file-like view of a .cdump file. Blocks are decompressed on demand.
+"""
+class CompressedDump(BlockReader):
+
+    """
+    filename = .cdump file to open
+    """
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        self.f = open(filename, "rb")
+        magic, version, self.codec, self.block_size, self.size, nblocks, index_offset = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != CDUMP_MAGIC:
+            raise ValueError("{} is not a compressed dump".format(filename))
+        if version != CDUMP_FORMAT_VERSION:
+            raise ValueError("{} has unsupported format version {}".format(filename, version))
+
+        self.f.seek(index_offset)
+        self.index = np.frombuffer(self.f.read(nblocks * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+        self._zeros = bytes(self.block_size)
+
+    def _load_block(self, i):
+        raw_len = min(self.block_size, self.size - i * self.block_size)
+        offset, length, kind = self.index[i]
+        if kind == BLOCK_HOLE:
+            return self._zeros[:raw_len]
+        self.f.seek(int(offset))
+        data = self.f.read(int(length))
+        if kind == BLOCK_COMPRESSED:
+            data = _decompress(self.codec, data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+"""
+Write a raw dump out as a .cdump file
+src = raw dump to read
+dst = .cdump file to write
+codec = "zlib" or "lzma"
+level = compression level (zlib level or lzma preset)
+block_size = raw bytes per block
+returns (raw size, compressed file size)
+"""
+def compress_dump(src, dst, codec="zlib", level=6, block_size=DEFAULT_BLOCK_SZ):
+    codec_id = CODECS[codec]
+    zeros = bytes(block_size)
+    index = []
+    stored = {} # digest of block contents -> index entry of the first copy
+
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        fout.write(HEADER.pack(CDUMP_MAGIC, CDUMP_FORMAT_VERSION, codec_id, block_size, 0, 0, 0))
+        raw_size = 0
+        block = fin.read(block_size)
+        while block:
+            raw_size += len(block)
+            if block == zeros[:len(block)]:
+                index.append((0, 0, BLOCK_HOLE))
+            else:
+                digest = hashlib.sha256(block).digest()
+                if digest not in stored:
+                    data = _compress(codec_id, block, level)
+                    kind = BLOCK_COMPRESSED
+                    if len(data) >= len(block):
+                        data, kind = block, BLOCK_RAW
+                    stored[digest] = (fout.tell(), len(data), kind)
+                    fout.write(data)
+                index.append(stored[digest])
+            block = fin.read(block_size)
+
+        index_offset = fout.tell()
+        fout.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+        fout.seek(0)
+        fout.write(HEADER.pack(CDUMP_MAGIC, CDUMP_FORMAT_VERSION, codec_id, block_size, raw_size, len(index), index_offset))
+
+    return raw_size, os.path.getsize(dst)
+
+"""
+Write a .cdump or .pages file back out as a raw dump
+src = stored dump to read
+dst = raw dump to write
+returns the raw size
+"""
+def decompress_dump(src, dst):
+    size = 0
+    with open_stored(src) as fin, open(dst, "wb") as fout:
+        buf = fin.read(1 << 24)
+        while buf:
+            fout.write(buf)
+            size += len(buf)
+            buf = fin.read(1 << 24)
+    return size
+
+
+"""
+Modification time and size of a file, to tell whether it changed since it was read
+returns None if the file doesn't exist
+"""
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+"""
+Atomically replace an .npz file, so that concurrent readers and writers never see a partial file
+"""
+def _replace_npz(filename, **arrays):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix="." + os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp, 0o644) # mkstemp creates the file private to its owner
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+"""
+Dataset-wide, content-addressed store of memory pages, kept in <dataset>/pages/. Every distinct
+page is stored once in an append-only pack file, keyed by its SHA-256 digest, and regions refer to
+their pages by id (see `add_dump` and PagedDump). Also keeps per-page scan results so that pages seen
+in earlier runs don't have to be re-scanned (see build_graph.scan_paged_dump).
+Safe to share between threads.
+"""
+class PageStore:
+
+    """
+    path = dataset directory
+    page_size = bytes per page. Only used when the store is created; an existing store keeps its page size.
+    readonly = only read pages: the pack is opened read-only and the digest index isn't loaded, so nothing
+               is created and pages can't be added. Scan caches can still be saved.
+    """
+    def __init__(self, path, page_size=PAGE_SZ, readonly=False):
+        self.dir = os.path.join(path, PAGE_STORE_DIR)
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(self.dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.page_size = page_size
+        self.offsets = [] # per page id: offset in the pack file
+        self.lengths = [] # per page id: length in bytes (only the last page of a region can be short)
+        self.ids = {} # digest -> page id
+        self.scan_caches = {} # pointer size -> {page id : cached scan result}
+        self.dirty = False # pages were added since the pack was last flushed
+
+        index_file = os.path.join(self.dir, "index.npz")
+        self.index_stamp = _file_stamp(index_file)
+        if self.index_stamp is not None:
+            with np.load(index_file) as data:
+                self.page_size = int(data["page_size"][0])
+                self.offsets = data["offsets"].tolist()
+                self.lengths = data["lengths"].tolist()
+                if not readonly:
+                    self.ids = {d : i for i, d in enumerate(data["digests"].tolist())}
+        self.pack = open(os.path.join(self.dir, "pages.pack"), "rb" if readonly else "a+b")
+
+    """
+    Number of distinct pages in the store
+    """
+    def __len__(self):
+        return len(self.offsets)
+
+    """
+    Add a page to the store, unless an identical page is already there
+    returns the page id
+    """
+    def add(self, page):
+        if self.readonly:
+            raise ValueError("can't add pages to a read-only page store")
+        digest = hashlib.sha256(page).digest()
+        with self.lock:
+            if digest not in self.ids:
+                self.pack.seek(0, os.SEEK_END)
+                self.offsets.append(self.pack.tell())
+                self.lengths.append(len(page))
+                self.pack.write(page)
+                self.ids[digest] = len(self.offsets) - 1
+                self.dirty = True
+            return self.ids[digest]
+
+    """
+    Contents of a page
+    """
+    def get(self, page_id):
+        if self.dirty:
+            with self.lock:
+                self.pack.flush()
+                self.dirty = False
+        return os.pread(self.pack.fileno(), self.lengths[page_id], self.offsets[page_id])
+
+    """
+    Split a raw dump into pages, add them to the store and write the region's page list
+    src = raw dump to read
+    dst = .pages file to write
+    returns (raw size, bytes added to the store)
+    """
+    def add_dump(self, src, dst):
+        zeros = bytes(self.page_size)
+        ids = []
+        raw_size = 0
+        before = self.stored_bytes()
+        with open(src, "rb") as fin:
+            page = fin.read(self.page_size)
+            while page:
+                raw_size += len(page)
+                ids.append(-1 if page == zeros[:len(page)] else self.add(page))
+                page = fin.read(self.page_size)
+
+        with open(dst, "wb") as fout:
+            fout.write(PAGES_HEADER.pack(PAGES_MAGIC, PAGES_FORMAT_VERSION, self.page_size, raw_size, len(ids)))
+            fout.write(np.array(ids, dtype="<i8").tobytes())
+        return raw_size, self.stored_bytes() - before
+
+    """
+    Total size of the distinct pages held in the store
+    """
+    def stored_bytes(self):
+        with self.lock:
+            return sum(self.lengths)
+
+    """
+    Scan results cached per page, for scanning with a given pointer size
+    returns a dictionary mapping page id to (word offsets, word values) arrays, which callers may extend
+    """
+    def scan_cache(self, pointer_sz):
+        with self.lock:
+            if pointer_sz not in self.scan_caches:
+                cache = {}
+                cache_file = os.path.join(self.dir, "scan{}.npz".format(pointer_sz))
+                if os.path.exists(cache_file):
+                    with np.load(cache_file) as data:
+                        ptr = data["ptr"]
+                        pos, vals = data["pos"], data["vals"]
+                        for k, page_id in enumerate(data["page_ids"].tolist()):
+                            cache[page_id] = (pos[ptr[k]:ptr[k+1]], vals[ptr[k]:ptr[k+1]])
+                self.scan_caches[pointer_sz] = cache
+            return self.scan_caches[pointer_sz]
+
+    """
+    Write the page index (unless the store is read-only) and any loaded scan caches to disk
+    """
+    def save(self):
+        with self.lock:
+            if not self.readonly:
+                self.pack.flush()
+                self.dirty = False
+                digests = sorted(self.ids.keys(), key = lambda d : self.ids[d])
+                _replace_npz(os.path.join(self.dir, "index.npz"),
+                    page_size=np.array([self.page_size]),
+                    offsets=np.array(self.offsets, dtype=np.int64),
+                    lengths=np.array(self.lengths, dtype=np.int64),
+                    digests=np.array(digests, dtype="S32"))
+                self.index_stamp = _file_stamp(os.path.join(self.dir, "index.npz"))
+
+            for pointer_sz, cache in self.scan_caches.items():
+                page_ids = sorted(cache.keys())
+                ptr = np.zeros(len(page_ids) + 1, dtype=np.int64)
+                ptr[1:] = np.cumsum([len(cache[i][0]) for i in page_ids])
+                _replace_npz(os.path.join(self.dir, "scan{}.npz".format(pointer_sz)),
+                    page_ids=np.array(page_ids, dtype=np.int64),
+                    ptr=ptr,
+                    pos=np.concatenate([cache[i][0] for i in page_ids] + [np.zeros(0, dtype=np.uint32)]).astype(np.uint32),
+                    vals=np.concatenate([cache[i][1] for i in page_ids] + [np.zeros(0, dtype=np.uint64)]).astype(np.uint64))
+
+    def close(self):
+        self.save()
+        self.pack.close()
+
+
+
+_shared_stores = {} # (pid, store directory) -> read-only PageStore
+
+"""
+Read-only PageStore of a dataset, opened once per directory in each process and reopened only when
+the store's index changes on disk. Used to read .pages files that weren't given a store explicitly.
+path = dataset directory
+"""
+def shared_store(path):
+    key = (os.getpid(), os.path.realpath(path)) # a forked worker opens its own
+    store = _shared_stores.get(key)
+    if store is None or store.index_stamp != _file_stamp(os.path.join(store.dir, "index.npz")):
+        store = _shared_stores[key] = PageStore(path, readonly=True)
+    return store
+
+
+"""
+Read-only, seekable file-like view of a region stored as a .pages list
+"""
+class PagedDump(BlockReader):
+
+    """
+    filename = .pages file to open
+    store = PageStore holding the pages. If not provided, the shared read-only store of the file's directory is used (see `shared_store`).
+    """
+    def __init__(self, filename, store=None):
+        super().__init__()
+        self.name = filename
+        with open(filename, "rb") as f:
+            magic, version, self.block_size, self.size, npages = PAGES_HEADER.unpack(f.read(PAGES_HEADER.size))
+            if magic != PAGES_MAGIC:
+                raise ValueError("{} is not a page list".format(filename))
+            if version != PAGES_FORMAT_VERSION:
+                raise ValueError("{} has unsupported format version {}".format(filename, version))
+            self.page_ids = np.frombuffer(f.read(npages * 8), dtype="<i8")
+
+        self.store = store if store is not None else shared_store(os.path.dirname(filename))
+        if self.store.page_size != self.block_size:
+            raise ValueError("{} uses {} byte pages, but its page store uses {}".format(filename, self.block_size, self.store.page_size))
+        self._zeros = bytes(self.block_size)
+
+    def _load_block(self, i):
+        if self.page_ids[i] < 0:
+            return self._zeros[:min(self.block_size, self.size - i * self.block_size)]
+        return self.store.get(int(self.page_ids[i]))
+
+
+"""
+Move every raw dump of a run into the dataset's page store, replacing it with a .pages list
+prefix = path prefix of the run's files. Ex: "vim_map/run0_"
+store = PageStore of the run's directory
+returns (raw bytes moved, bytes added to the store)
+"""
+def store_run_dumps(prefix, store):
+    directory, name = os.path.split(prefix)
+    totals = [0, 0]
+    for f in sorted(os.listdir(directory or ".")):
+        if f.startswith(name) and f.endswith(".dump"):
+            src = os.path.join(directory, f)
+            raw, added = store.add_dump(src, pages_name(src))
+            os.remove(src)
+            totals[0] += raw
+            totals[1] += added
+    store.save()
+    return tuple(totals)
@@ -2,27 +2,21 @@
 Generate raw data from figure 2 in the paper
 """
 
-from data_structures import RunContainer
+from data_structures import RunContainer, load_pointer_ranking, list_runs
 import os
 
 heap_dir = "ff_heap/"
-runnames = sorted([f.split("_")[0] for f in os.listdir(heap_dir) if f.endswith("maplist.json")])
+runnames = list_runs(heap_dir)
 rundata = []
 
 for rn in runnames:
     rundata.append(RunContainer(rn, path=heap_dir))
 
-# Tally the most frequent pointers
-pointer_dict = {}
-for rd in rundata:
-    pointer_dict = rd.rank_most_frequent(pointer_dict)
-
-# Sort by frequency and extract the appropriate rank
-pointerlist = [(ptr, pointer_dict[ptr]) for ptr in pointer_dict.keys()]
-pointerlist.sort(key=lambda x: x[1], reverse=True)
+# Rank the pointers by frequency (cached in the dataset directory across invocations)
+ranking = load_pointer_ranking(heap_dir, rundata)
 
 # get the region and offset of the destination the user is interested in
-ptr_region, ptr_offset = pointerlist[0][0]
+ptr_region, ptr_offset = ranking.get(0)[0]
 print(ptr_region)
 print(ptr_offset)
 
@@ -0,0 +1,479 @@
+"""
+Pointer fingerprints: per-byte lower/upper bounds on the memory window surrounding a pointer,
+and vectorized matchers that apply them to whole heaps at once
+"""
+
+import json
+import os
+import numpy as np
+
+
+"""
+Number of windows compared against the bounds at a time. Keeps the temporary
+boolean arrays small when matching multi-GB heaps.
+"""
+MATCH_CHUNK = 1 << 16
+
+"""
+Number of surviving windows below which Fingerprint.match tests all of their remaining positions at once
+rather than one position at a time
+"""
+FEW_WINDOWS = 256
+
+"""
+Largest alignment `pointer_alignment` infers (a page). Pointers that never share a heap leave only this to bound it
+"""
+MAX_ALIGNMENT = 1 << 12
+
+
+"""
+Rough frequency of each byte value in heap memory, used to order the window positions from most to least
+selective: about half of all heap bytes are zero (high bytes of small integers and pointers, padding),
+0xff is the next most common, and the rest are close to uniform
+"""
+BYTE_PRIOR = np.full(256, 0.45 / 254)
+BYTE_PRIOR[0] = 0.5
+BYTE_PRIOR[0xff] = 0.05
+
+
+"""
+Test a batch of memory windows against a pair of byte bounds
+windows = 2D uint8 array (e.g. from RunContainer.heap_windows), one window per row
+lb, ub = per-byte lower and upper bounds, with one entry per window column
+returns a boolean array that is True for windows where lb <= window <= ub at every position
+"""
+def match_windows(windows, lb, ub):
+    lb = np.asarray(lb)
+    ub = np.asarray(ub)
+    mask = np.zeros(len(windows), dtype=bool)
+    for start in range(0, len(windows), MATCH_CHUNK):
+        chunk = windows[start:start + MATCH_CHUNK]
+        mask[start:start + MATCH_CHUNK] = ((lb <= chunk) & (chunk <= ub)).all(axis=1)
+    return mask
+
+
+"""
+Count true and false positives of a fingerprint over one heap
+positions = offsets of the windows that were tested
+mask = output of `match_windows` for those windows
+true_addrs = offsets within the heap that really contain the target pointer
+returns (true_positives, false_positives)
+"""
+def count_matches(positions, mask, true_addrs):
+    matched = positions[mask]
+    true_addrs = np.unique(np.asarray(true_addrs, dtype=np.int64))
+    idx = np.searchsorted(true_addrs, matched)
+    idx[idx == len(true_addrs)] = 0
+    tps = int(np.count_nonzero(true_addrs[idx] == matched)) if len(true_addrs) > 0 else 0
+    return tps, len(matched) - tps
+
+
+"""
+Test a batch of memory windows against several fingerprints at once
+windows = 2D uint8 array, one window per row
+lbs, ubs = 2D arrays of per-byte lower and upper bounds, one fingerprint per row
+returns a boolean array with one row per window and one column per fingerprint
+"""
+def match_windows_batch(windows, lbs, ubs):
+    lbs = np.asarray(lbs)
+    ubs = np.asarray(ubs)
+    mask = np.zeros([len(windows), len(lbs)], dtype=bool)
+    rows = max(1, MATCH_CHUNK // max(len(lbs), 1)) # keep the temporaries the size of a single-fingerprint chunk
+    for start in range(0, len(windows), rows):
+        chunk = windows[start:start + rows][:, None, :]
+        mask[start:start + rows] = ((lbs <= chunk) & (chunk <= ubs)).all(axis=2)
+    return mask
+
+
+"""
+Alignment of the pointers to one destination: starting from the pointer size, the alignment is doubled
+for as long as every pointer keeps the same offset modulo it and it stays below the smallest
+distance between two pointers in the same heap, the largest pointer offset and MAX_ALIGNMENT
+addrs = run x heap list of pointer offsets, as returned by RunContainer.scan_for_pointer for every run
+returns (alignment, offset of the pointers modulo the alignment)
+"""
+def pointer_alignment(addrs, pointer_sz):
+    flat = np.concatenate([np.asarray(hp, dtype=np.int64) for run in addrs for hp in run])
+    gaps = [np.diff(np.asarray(hp, dtype=np.int64)) for run in addrs for hp in run if len(hp) > 1]
+    mindist = min([g.min() for g in gaps]) if len(gaps) > 0 else np.inf
+
+    ref_ptr = min([a for hp in addrs[0] for a in hp]) # just take the smallest address from run 0 as a reference pointer
+    limit = min(MAX_ALIGNMENT, max(int(flat.max()), pointer_sz))
+    aln = pointer_sz
+    while 2*aln <= limit and 2*aln < mindist and np.all(flat % (2*aln) == ref_ptr % (2*aln)):
+        aln = 2*aln
+    return aln, ref_ptr % aln
+
+
+"""
+Bounds to test a held-out run against: the bounds of the other runs, widened at the positions where
+they vary across runs
+lbs, ubs = run x window position lower and upper bounds
+held_out = index of the held-out run. If None, every run is used (the bounds to save and deploy)
+nohold = use the unwidened bounds of every run instead (training set accuracy)
+returns (lower bounds, upper bounds)
+"""
+def holdout_bounds(lbs, ubs, held_out=None, nohold=False):
+    if nohold:
+        return lbs.min(axis=0), ubs.max(axis=0)
+    lb_val = lbs if held_out is None else np.delete(lbs, held_out, axis=0)
+    ub_val = ubs if held_out is None else np.delete(ubs, held_out, axis=0)
+    lb = np.clip(lb_val.min(axis=0) - (lb_val.max(axis=0) - lb_val.min(axis=0)), 0, 255)
+    ub = np.clip(ub_val.max(axis=0) + (ub_val.max(axis=0) - ub_val.min(axis=0)), 0, 255)
+    return lb, ub
+
+
+"""
+Bytes surrounding a set of heap offsets
+rd = data_structures.RunContainer
+heapnum = index of the heap
+offsets = offsets of the windows' centers, at least preread bytes from the start of the heap
+          and postread bytes from its end
+returns a 2D uint8 array with one window per row
+"""
+def gather_windows(rd, heapnum, offsets, preread, postread):
+    if rd.heap_arrays is not None:
+        return rd.heap_arrays[heapnum][np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(-preread, postread)]
+    windows = np.zeros([len(offsets), preread + postread], dtype=np.uint8)
+    for k, offset in enumerate(offsets):
+        windows[k] = np.frombuffer(rd.read_heap_bytes(heapnum, offset - preread, preread + postread), dtype=np.uint8)
+    return windows
+
+
+"""
+Fingerprint several candidate pointers and cross-validate them together: every heap is swept once
+and each window is tested against all the candidates' bounds in one batched comparison.
+Per candidate, this gives the same numbers as fingerprinting it on its own with analyze.py --rank.
+rundata = list of data_structures.RunContainer objects
+candidates = list of (rank, destination region, offset)
+preread, postread = window bytes before and after the pointer
+pointer_sz = size of a pointer
+nohold = don't hold out, test every run against the bounds of all runs
+returns one dictionary per candidate, in input order, with the keys rank, region, offset and either
+error (why the candidate couldn't be evaluated) or aln, aln_offset, true, tps, fps, total,
+tpr, fpr, precision, worst_precision (average over runs of the lowest per-heap precision) and
+fingerprint (a Fingerprint with the bounds of every run)
+"""
+def cross_validate_candidates(rundata, candidates, preread, postread, pointer_sz=8, nohold=False):
+    results = []
+    usable = []
+    for rank, region, offset in candidates:
+        res = {"rank" : rank, "region" : region, "offset" : offset}
+        results.append(res)
+
+        addrs = [rd.scan_for_pointer(region, offset) for rd in rundata]
+        if min([sum([len(hp) for hp in run]) for run in addrs]) == 0:
+            res["error"] = "not found in all runs"
+            continue
+        aln, aln_offset = pointer_alignment(addrs, pointer_sz)
+
+        lbs = np.zeros([len(rundata), preread + postread])
+        ubs = np.zeros([len(rundata), preread + postread])
+        for i, rd in enumerate(rundata):
+            windows = [gather_windows(rd, j, [a for a in hp if a >= preread and a < rd.get_heap_size(j) - postread], preread, postread)
+                for j, hp in enumerate(addrs[i])]
+            windows = np.concatenate(windows) if len(windows) > 0 else np.zeros([0, preread + postread], dtype=np.uint8)
+            if len(windows) == 0:
+                break
+            lbs[i] = windows.min(axis=0)
+            ubs[i] = windows.max(axis=0)
+        else:
+            res.update({"aln" : aln, "aln_offset" : aln_offset, "addrs" : addrs, "lbs" : lbs, "ubs" : ubs,
+                "start" : int(np.ceil(preread / aln)) * aln + aln_offset,
+                "counts" : [[[len(hp), 0, 0, 0] for hp in run] for run in addrs]}) # true, tps, fps, tested per heap
+            usable.append(res)
+            continue
+        res["error"] = "no pointer far enough from the heap edges in every run"
+
+    # candidates whose positions fall on the same residue of the finest alignment share a sweep
+    sweeps = {}
+    if len(usable) > 0:
+        step = min([c["aln"] for c in usable])
+        for c in usable:
+            sweeps.setdefault(c["aln_offset"] % step, []).append(c)
+
+    for i, rd in enumerate(rundata):
+        for members in sweeps.values():
+            bounds = [holdout_bounds(c["lbs"], c["ubs"], i, nohold) for c in members]
+            lb = np.stack([b[0] for b in bounds])
+            ub = np.stack([b[1] for b in bounds])
+            rows = max(1, MATCH_CHUNK // len(members)) # windows matched at a time, so the temporaries stay small
+            for heapnum in range(len(rd.heap_regions)):
+                positions, windows = rd.heap_windows(heapnum, min([c["start"] for c in members]), step, preread, postread)
+                true_addrs = [np.unique(np.asarray(c["addrs"][i][heapnum], dtype=np.int64)) for c in members]
+                for begin in range(0, len(windows), rows):
+                    pos = positions[begin:begin + rows]
+                    mask = match_windows_batch(windows[begin:begin + rows], lb, ub)
+                    for col, c in enumerate(members):
+                        sel = np.flatnonzero(((pos - c["aln_offset"]) % c["aln"] == 0) & (pos >= c["start"]))
+                        tps, fps = count_matches(pos[sel], mask[sel, col], true_addrs[col])
+                        counts = c["counts"][i][heapnum]
+                        counts[1:] = [counts[1] + tps, counts[2] + fps, counts[3] + len(sel)]
+
+    for c in usable:
+        counts = c.pop("counts")
+        lb, ub = holdout_bounds(c.pop("lbs"), c.pop("ubs"), None, nohold)
+        for k in ["addrs", "start"]:
+            c.pop(k)
+        tru, tps, fps, total = [sum([hp[k] for run in counts for hp in run]) for k in range(4)]
+        prec = [[t / (t + f) if t + f > 0 else 0 for _, t, f, _ in run] for run in counts]
+        c.update({"true" : tru, "tps" : tps, "fps" : fps, "total" : total,
+            "tpr" : tps / tru, "fpr" : fps / (total - tru) if total > tru else 0,
+            "precision" : tps / (tps + fps) if tps + fps > 0 else 0,
+            "worst_precision" : sum([min(run) for run in prec]) / len(prec)})
+        c["fingerprint"] = Fingerprint(c["region"], c["offset"], lb, ub, preread, c["aln"], c["aln_offset"], pointer_sz,
+            stats={k : c[k] for k in ["rank", "tpr", "fpr", "precision", "worst_precision"]})
+    return results
+
+
+"""
+Path of the saved fingerprint of a ranked pointer
+path = dataset directory
+rank = rank of the pointer, as passed to analyze.py --rank
+"""
+def fingerprint_path(path, rank):
+    return os.path.join(path, "fingerprint_rank{}.npz".format(rank))
+
+
+"""
+A saved pointer fingerprint: the per-byte bounds of the window around a pointer to one destination, and where
+in memory such pointers sit. Matching first compares the bytes with exactly known values (or bits) a whole word
+at a time, then tests the other window positions in order of selectivity (most selective first) through
+per-position 256-entry lookup tables, dropping a window as soon as one position rejects it.
+"""
+class Fingerprint:
+
+    """
+    region, offset = destination of the pointer
+    lb, ub = per-byte lower and upper bounds of the window, which starts preread bytes before the pointer
+    aln, aln_offset = the pointer is at addresses where address % aln == aln_offset
+    pointer_sz = size of the pointer
+    stats = dictionary of cross-validation results (tpr, fpr, precision, ...) kept with the fingerprint
+    load_file = .npz file written by `serialize` to load the fingerprint from
+    """
+    def __init__(self, region="", offset=0, lb=[], ub=[], preread=0, aln=8, aln_offset=0, pointer_sz=8, stats={}, load_file=None):
+        self.region = region
+        self.offset = int(offset)
+        self.lb = np.clip(np.asarray(lb), 0, 255).astype(np.uint8)
+        self.ub = np.clip(np.asarray(ub), 0, 255).astype(np.uint8)
+        self.preread = int(preread)
+        self.aln = int(aln)
+        self.aln_offset = int(aln_offset)
+        self.pointer_sz = int(pointer_sz)
+        self.stats = dict(stats)
+
+        if load_file:
+            self.deserialize(load_file)
+        self._build_tables()
+
+    """
+    Lookup tables of the accepted byte values at each window position, the order to test the positions in
+    (least likely to accept first, see BYTE_PRIOR), and the word prefilter: positions whose accepted values
+    form an aligned power-of-two block (an exact byte, a 0-3 tag, ...) are tested several at a time by
+    masking the window word where that rejects the most
+    """
+    def _build_tables(self):
+        self.postread = len(self.lb) - self.preread
+        self.tail = max(self.postread, self.pointer_sz) # bytes a match needs from the pointer on: its window, and the pointer itself
+        self.allowed = np.zeros([len(self.lb), 256], dtype=bool)
+        for col, (lo, hi) in enumerate(zip(self.lb, self.ub)):
+            self.allowed[col, lo:int(hi) + 1] = True
+
+        width = self.ub.astype(np.int64) - self.lb + 1
+        accept = (self.allowed * BYTE_PRIOR).sum(axis=1) # estimated fraction of windows each position lets through
+        bits = np.where((width & (width - 1) == 0) & (self.lb % width == 0), 0xFF ^ (width - 1), 0)
+        self.word_sz = 8
+        while self.word_sz > 1 and self.word_sz > len(self.lb):
+            self.word_sz //= 2
+        gain = np.where(bits > 0, -np.log(np.maximum(accept, 1e-12)), 0)
+        scores = [gain[c:c + self.word_sz].sum() for c in range(len(self.lb) - self.word_sz + 1)]
+        self.word_col = int(np.argmax(scores)) if len(scores) > 0 and max(scores) > 0 else None
+        covered = []
+        if self.word_col is not None:
+            cols = range(self.word_col, self.word_col + self.word_sz)
+            dtype = np.dtype("<u{}".format(self.word_sz))
+            self.word_mask = dtype.type(sum([int(bits[c]) << (8 * j) for j, c in enumerate(cols)]))
+            self.word_value = dtype.type(sum([int(self.lb[c] & bits[c]) << (8 * j) for j, c in enumerate(cols)]))
+            covered = [c for c in cols if bits[c] > 0]
+        self.order = np.array([c for c in np.argsort(accept, kind="stable") if c not in covered and width[c] < 256], dtype=np.int64)
+
+    """
+    Find the windows of a buffer that match the fingerprint
+    buf = 1D uint8 array
+    base = address (or stream offset) of buf[0], which decides which buffer offsets are aligned
+    lo, hi = only test pointers at buffer offsets in [lo, hi). Windows (or pointers) that don't fit in buf are never tested
+    returns the sorted buffer offsets of the pointers whose windows match
+    """
+    def match(self, buf, base=0, lo=0, hi=None):
+        buf = np.ascontiguousarray(buf)
+        hi = len(buf) - self.tail + 1 if hi is None else min(hi, len(buf) - self.tail + 1)
+        first = max(lo, self.preread)
+        first += (self.aln_offset - base - first) % self.aln
+        n = (hi - first + self.aln - 1) // self.aln
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # work through cache-sized blocks of positions, so the temporaries stay small
+        return np.concatenate([self._match_block(buf, first + start * self.aln, min(MATCH_CHUNK, n - start))
+            for start in range(0, n, MATCH_CHUNK)])
+
+    """
+    Test n aligned positions of buf, starting at buffer offset first
+    returns the buffer offsets of the matching pointers
+    """
+    def _match_block(self, buf, first, n):
+        # test the first positions on strided views of the whole block, then switch to the few survivors
+        if self.word_col is not None:
+            words = np.ndarray((n,), dtype=self.word_mask.dtype, buffer=buf, offset=first - self.preread + self.word_col, strides=(self.aln,))
+            keep = (words & self.word_mask) == self.word_value
+        else:
+            keep = np.ones(n, dtype=bool)
+        pos = first + np.flatnonzero(keep) * self.aln if np.count_nonzero(keep) * 8 < n else None
+        for i, col in enumerate(self.order):
+            if pos is None:
+                start = first - self.preread + col
+                keep &= self.allowed[col][buf[start:start + (n - 1) * self.aln + 1:self.aln]]
+                if np.count_nonzero(keep) * 8 < n:
+                    pos = first + np.flatnonzero(keep) * self.aln
+            elif len(pos) <= FEW_WINDOWS:
+                # few enough left to test all the remaining positions in one gather
+                cols = self.order[i:]
+                pos = pos[self.allowed[cols, buf[pos[:, None] + (cols - self.preread)]].all(axis=1)]
+                break
+            else:
+                pos = pos[self.allowed[col][buf[pos + (col - self.preread)]]]
+        if pos is None:
+            pos = first + np.flatnonzero(keep) * self.aln
+        return pos.astype(np.int64)
+
+    """
+    Read the (little-endian) pointers at the given buffer offsets
+    returns a uint64 array
+    """
+    def pointer_values(self, buf, positions):
+        raw = np.ascontiguousarray(buf[np.asarray(positions, dtype=np.int64)[:, None] + np.arange(self.pointer_sz)])
+        return raw.view("<u{}".format(self.pointer_sz)).ravel().astype(np.uint64)
+
+    """
+    Save the fingerprint into a .npz file
+    """
+    def serialize(self, filename):
+        with open(filename, "wb") as f:
+            np.savez(f,
+                region=np.array(self.region, dtype=str),
+                offset=np.array([self.offset], dtype=np.int64),
+                lb=self.lb,
+                ub=self.ub,
+                params=np.array([self.preread, self.aln, self.aln_offset, self.pointer_sz], dtype=np.int64),
+                stats=np.array(json.dumps(self.stats), dtype=str))
+
+    """
+    Load a fingerprint saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.region = str(data["region"])
+            self.offset = int(data["offset"][0])
+            self.lb = data["lb"]
+            self.ub = data["ub"]
+            self.preread, self.aln, self.aln_offset, self.pointer_sz = [int(v) for v in data["params"]]
+            self.stats = json.loads(str(data["stats"]))
+
+
+"""
+Applies fingerprints to memory that arrives in consecutive chunks (a file read piece by piece, or a stream).
+The bytes a window still needs are carried over to the next chunk, so windows straddling a chunk
+boundary are tested exactly once, and the results are the same as matching the whole input at once.
+"""
+class ChunkMatcher:
+
+    """
+    fingerprints = list of Fingerprint
+    base = address of the first byte of the input, for alignment and for reporting addresses
+    """
+    def __init__(self, fingerprints, base=0):
+        self.fingerprints = fingerprints
+        self.base = base
+        self.preread = max([fp.preread for fp in fingerprints])
+        self.postread = max([fp.tail for fp in fingerprints]) # bytes needed after a pointer position
+        self.carry = np.zeros(0, dtype=np.uint8)
+        self.buf = np.zeros(0, dtype=np.uint8)
+        self.start = 0 # input offset of carry[0]
+        self.next = 0 # input offset of the first pointer position not yet tested
+        self.nbytes = 0
+
+    """
+    Test the windows within buf, from the first untested position up to (not including) hi
+    returns a list of (fingerprint index, input offsets of the matching pointers, pointer values)
+    """
+    def _match(self, buf, hi):
+        results = []
+        for k, fp in enumerate(self.fingerprints):
+            pos = fp.match(buf, self.base + self.start, self.next - self.start, hi)
+            if len(pos) > 0:
+                results.append((k, pos + self.start, fp.pointer_values(buf, pos)))
+        return results
+
+    """
+    Scratch buffer holding the carried-over bytes followed by room for nbytes more. Reused across chunks,
+    so large inputs don't pay for a fresh allocation per chunk
+    """
+    def _reserve(self, nbytes):
+        need = len(self.carry) + nbytes
+        if len(self.buf) < need:
+            self.buf = np.empty(need, dtype=np.uint8)
+        self.buf[:len(self.carry)] = self.carry
+        return self.buf
+
+    """
+    Match the windows completed by a new chunk
+    buf = the carried-over bytes followed by the chunk
+    returns the matches, see `_match`
+    """
+    def _advance(self, buf):
+        self.nbytes += len(buf) - len(self.carry)
+        hi = len(buf) - self.postread + 1 # positions past this need bytes of the next chunk for some fingerprint
+        if hi <= self.next - self.start:
+            self.carry = np.array(buf) # too short to complete any window yet
+            return []
+
+        results = self._match(buf, hi)
+        keep = max(hi - self.preread, 0) # first byte a window after hi can need
+        self.next = self.start + hi
+        self.carry = np.array(buf[keep:]) # copy, the scratch buffer is overwritten by the next chunk
+        self.start += keep
+        return results
+
+    """
+    Add the next chunk of the input
+    data = bytes-like object or uint8 array
+    returns the matches completed by this chunk, see `_match`
+    """
+    def feed(self, data):
+        data = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        buf = self._reserve(len(data))
+        buf[len(self.carry):len(self.carry) + len(data)] = data
+        return self._advance(buf[:len(self.carry) + len(data)])
+
+    """
+    Read the next chunk of the input straight from a file, without an intermediate copy when the file supports readinto
+    f = binary file object (or dumpstore reader)
+    nbytes = maximum number of bytes to read
+    returns (number of bytes read, the matches completed by this chunk). 0 bytes read means the end of the file
+    """
+    def read_from(self, f, nbytes):
+        if not hasattr(f, "readinto"):
+            data = f.read(nbytes)
+            return len(data), self.feed(data) if len(data) > 0 else []
+        buf = self._reserve(nbytes)
+        got = f.readinto(memoryview(buf)[len(self.carry):len(self.carry) + nbytes])
+        return got, self._advance(buf[:len(self.carry) + got]) if got > 0 else []
+
+    """
+    Finish the input: test the remaining windows, which only fingerprints with short postreads can fit
+    returns the remaining matches, see `_match`
+    """
+    def flush(self):
+        results = self._match(self.carry, None)
+        self.next = self.start + len(self.carry)
+        return results
@@ -4,60 +4,107 @@ Graph algorithms for analyzing the memory map
 
 import data_structures
 import argparse
+import os
+import tempfile
+import zipfile
+import numpy as np
+
+"""
+Adjacency lists of a memory graph that only contain real edges
+graph is a double-dictionary, like the `adj_matrix` field of a data_structures.MemGraph
+object (dense or sparse). Destinations that are not themselves keys of the graph are ignored.
+returns (nodes, adj) where nodes is list(graph.keys()) and adj[i] lists the indices
+of the nodes that node i has at least one edge to
+"""
+def adjacency_lists(graph):
+    nodes = list(graph.keys())
+    index = {n : i for i,n in enumerate(nodes)}
+    adj = [[index[dst] for dst, elist in graph[src].items() if len(elist) > 0 and dst in index] for src in nodes]
+    return nodes, adj
+
+
+"""
+Compute the strongly connected components of a memory graph and its condensation
+with an iterative version of Tarjan's algorithm. Runs in O(V + E) over the non-empty
+edge lists and does not recurse, so deep graphs don't hit Python's recursion limit.
+graph = double-dictionary, like the `adj_matrix` field of a data_structures.MemGraph
+returns (sccs, membership, dag):
+    sccs = list of SCCs, each a list of region names. SCCs are numbered in reverse
+           topological order, so every condensation edge points to a lower-numbered SCC.
+    membership = int32 array giving the SCC number of each node, in graph.keys() order
+    dag = list of sets. dag[i] holds the SCCs that SCC i has edges to (no self loops).
+"""
+def condensation(graph):
+    nodes, adj = adjacency_lists(graph)
+    n = len(nodes)
+
+    order = [-1] * n # discovery index of each node
+    low = [0] * n
+    onstack = [False] * n
+    stack = []
+    membership = np.full(n, -1, dtype=np.int32)
+    sccs = []
+    counter = 0
+
+    for root in range(n):
+        if order[root] >= 0:
+            continue
+
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack[root] = True
+        work = [(root, 0)] # (node, index of the next neighbor to visit)
+
+        while work:
+            v, k = work[-1]
+            if k < len(adj[v]):
+                work[-1] = (v, k + 1)
+                w = adj[v][k]
+                if order[w] < 0:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    onstack[w] = True
+                    work.append((w, 0))
+                elif onstack[w] and order[w] < low[v]:
+                    low[v] = order[w]
+                continue
+
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+
+            if low[v] == order[v]: # v is the root of an SCC
+                comp = []
+                while True:
+                    w = stack.pop()
+                    onstack[w] = False
+                    membership[w] = len(sccs)
+                    comp.append(nodes[w])
+                    if w == v:
+                        break
+                sccs.append(comp)
+
+    dag = [set() for _ in sccs]
+    for v in range(n):
+        for w in adj[v]:
+            if membership[v] != membership[w]:
+                dag[membership[v]].add(int(membership[w]))
+
+    return sccs, membership, dag
+
 
 """
 Find strongly connected components in the memory graph
 graph is a double-dictionary, like the kind contained 
 in the `adj_matrix` field of a data_structures.MemGraph
 object. 
+returns (sccs, scc_edgelist) where scc_edgelist[i] is the set of SCCs reachable in one step from SCC i
 """
 def find_scc(graph):
-    grev = {} #reverse graph
-    for u in graph.keys():
-        for v in graph.keys():
-            if v not in grev:
-                grev[v] = {}
-            grev[v][u] = graph[u][v]
-
-    scc_memership = {} # To which number SCC does each node belong?
-    sccs = []
-    scc_edgelist = []
-
-    visited = set([])
-    preo = []
-    posto = [] 
-
-    def dfs(g, source):
-        visited.add(source)
-        preo.append(source)
-        for nxt in g.keys():
-            if len(g[source][nxt]) > 0 and nxt not in visited:
-                visited.add(nxt)
-                dfs(g, nxt)
-            if len(g[source][nxt]) > 0 and nxt in scc_memership: # for tracing scc edges during 2nd pass
-                scc_edgelist[-1].add(scc_memership[nxt]) 
-        posto.append(source)
-
-    for src in grev.keys():
-        if src not in visited:
-            dfs(grev, src)
-    
-    visited = set([])
-    sinks = [x for x in posto[::-1]]
-    preo = []
-    posto = []
-
-    # get the sccs
-    for src in sinks:
-        if src not in visited:
-            scc_edgelist.append(set([]))
-            dfs(graph, src)
-            for node in preo:
-                scc_memership[node] = len(sccs)
-            sccs.append(preo)
-            preo = [] #comandeer preo to keep track of new additions
-
-    return sccs, scc_edgelist
+    sccs, _, dag = condensation(graph)
+    return sccs, dag
 
 
 """
@@ -65,35 +112,202 @@ Simple DFS that runs on an edgelist and returns the list of nodes reachable from
 Edgelist is just a list of sets of ints, src is an int
 """
 def simple_dfs(edgelist, src):
-    visited = set([])
-    def search(g, source):
-            visited.add(source)
-            for nxt in edgelist[source]:
-                if  nxt not in visited:
-                    visited.add(nxt)
-                    search(g, nxt)
-    search(edgelist, src)
+    visited = set([src])
+    todo = [src]
+    while todo:
+        source = todo.pop()
+        for nxt in edgelist[source]:
+            if nxt not in visited:
+                visited.add(nxt)
+                todo.append(nxt)
     return visited
 
+"""
+Precomputed transitive closure of a memory graph's SCC condensation. Answers reachability
+questions for any number of regions without recomputing SCCs or running a DFS per query.
+The closure is stored as one packed bitset row per SCC (bit j of row i is set when SCC i can reach SCC j).
+"""
+class ReachabilityIndex:
+
+    """
+    graph = double-dictionary, like the `adj_matrix` field of a data_structures.MemGraph, to build the index from
+    load_file = .npz file written by `serialize` to load the index from instead
+    """
+    def __init__(self, graph=None, load_file=None):
+        self.nodes = []
+        self.membership = np.zeros(0, dtype=np.int32)
+        self.scc_sizes = np.zeros(0, dtype=np.int64)
+        self.closure = np.zeros([0, 0], dtype=np.uint8)
+        self.source_stat = None # (size, mtime_ns) of the graph file the index was built from
+        self._index = None # region name -> position in nodes
+
+        if load_file:
+            self.deserialize(load_file)
+        elif graph is not None:
+            self.build(graph)
+
+    """
+    Compute the closure. SCCs come out of `condensation` in reverse topological order, so every
+    successor of SCC i has a lower number and its row is final by the time row i is built.
+    """
+    def build(self, graph):
+        sccs, self.membership, dag = condensation(graph)
+        self.nodes = list(graph.keys())
+        self.scc_sizes = np.array([len(c) for c in sccs], dtype=np.int64)
+        self._index = None
+
+        k = len(sccs)
+        self.closure = np.zeros([k, (k + 7) // 8], dtype=np.uint8)
+        for i in range(k):
+            self.closure[i, i // 8] |= np.uint8(0x80 >> (i % 8))
+            for j in dag[i]:
+                self.closure[i] |= self.closure[j]
+
+    """
+    SCC number of each region name
+    """
+    def _scc_of(self, region):
+        if self._index is None:
+            self._index = {n : i for i,n in enumerate(self.nodes)}
+        return self.membership[self._index[region]]
+
+    """
+    Get the names of all regions reachable from a region (including the region's own SCC)
+    region = string name of the region of interest
+    """
+    def reachable_regions(self, region):
+        reach = np.unpackbits(self.closure[self._scc_of(region)], count=len(self.scc_sizes)).astype(bool)
+        return [n for n, m in zip(self.nodes, self.membership) if reach[m]]
+
+    """
+    Number of regions reachable from every SCC, computed in one batch
+    returns an int64 array indexed by SCC number
+    """
+    def scc_reach_counts(self):
+        k = len(self.scc_sizes)
+        counts = np.zeros(k, dtype=np.int64)
+        chunk = max(1, (1 << 24) // max(k, 1)) # bound the size of the unpacked block
+        for start in range(0, k, chunk):
+            bits = np.unpackbits(self.closure[start:start + chunk], axis=1, count=k)
+            counts[start:start + chunk] = bits.astype(np.int64) @ self.scc_sizes
+        return counts
+
+    """
+    Number of regions reachable from each region
+    regions = names of the regions of interest. If None, all regions in the graph.
+    returns a dictionary mapping region name to its reach count
+    """
+    def reach_counts(self, regions=None):
+        counts = self.scc_reach_counts()
+        if regions is None:
+            regions = self.nodes
+        return {r : int(counts[self._scc_of(r)]) for r in regions}
+
+    """
+    Size of the SCC containing a region
+    """
+    def scc_size(self, region):
+        return int(self.scc_sizes[self._scc_of(region)])
+
+    """
+    Save the index into a .npz file
+    """
+    def serialize(self, filename):
+        with open(filename, "wb") as f:
+            np.savez(f,
+                nodes=np.array(self.nodes, dtype=str),
+                membership=self.membership,
+                scc_sizes=self.scc_sizes,
+                closure=self.closure,
+                source_stat=np.array(self.source_stat if self.source_stat else [-1, -1], dtype=np.int64))
+
+    """
+    Load an index saved by `serialize`
+    """
+    def deserialize(self, filename):
+        with np.load(filename) as data:
+            self.nodes = data["nodes"].tolist()
+            self.membership = data["membership"]
+            self.scc_sizes = data["scc_sizes"]
+            self.closure = data["closure"]
+            self.source_stat = tuple(data["source_stat"].tolist())
+        self._index = None
+
+
+"""
+Path of the reachability index saved next to a memory graph file
+Ex: vim_map/memgraph_final.json -> vim_map/memgraph_final_reach.npz
+"""
+def reach_index_path(graph_file):
+    return os.path.splitext(graph_file)[0] + "_reach.npz"
+
+"""
+Load the reachability index saved next to graph_file, or build and save it if it is
+missing, unreadable or was built from a different version of the graph (by file size / mtime).
+If the index can't be saved, it is still returned
+rebuild = always recompute the index
+"""
+def load_reach_index(graph_file, rebuild=False):
+    st = os.stat(graph_file)
+    stat = (st.st_size, st.st_mtime_ns)
+    index_file = reach_index_path(graph_file)
+
+    if not rebuild and os.path.exists(index_file):
+        try:
+            index = ReachabilityIndex(load_file=index_file)
+            if index.source_stat == stat:
+                return index
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            pass # unreadable index, rebuild it
+
+    mg = data_structures.MemoryGraph(load_file=graph_file, sparse=True)
+    index = ReachabilityIndex(mg.adj_matrix)
+    index.source_stat = stat
+    try:
+        # write next to the index and rename, so concurrent readers never see a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(index_file) or ".", prefix="." + os.path.basename(index_file) + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            index.serialize(tmp)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, index_file)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError:
+        pass # e.g. a read-only dataset
+    return index
+
 """
 Example Usage: python graph_util.py vim_map/memgraph_final.json --region /usr/bin/vim.basic_4
+Example Usage: python graph_util.py vim_map/memgraph_final.json --all-regions
 """
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("graph", help="graph to be loaded and analyzed")
     parser.add_argument("--region", default=None, help="region of interest")
+    parser.add_argument("--all-regions", dest="all_regions", action='store_true', help="print every region ranked by the number of regions it can reach")
+    parser.add_argument("--rebuild", action='store_true', help="recompute the saved reachability index even if it is up to date")
     args = parser.parse_args()
 
-    mg = data_structures.MemoryGraph(load_file=args.graph)
-    scc, edges = find_scc(mg.adj_matrix)
-    if args.region is None:
+    if args.region is None and not args.all_regions:
+        mg = data_structures.MemoryGraph(load_file=args.graph, sparse=True)
+        scc, membership, edges = condensation(mg.adj_matrix)
         print(scc)
     else:
-        total = sum([len(x) for x in scc])
-        roi = [i for i,x in enumerate(scc) if args.region in x][0] # scc constatining region of interest
-        rlen = len(scc[roi])
-        reachable = simple_dfs(edges, roi)
-        n_reachable_reg = sum([len(scc[i]) for i in reachable])
+        index = load_reach_index(args.graph, args.rebuild)
+        total = len(index.nodes)
+
+    if args.region is not None:
+        rlen = index.scc_size(args.region)
+        n_reachable_reg = index.reach_counts([args.region])[args.region]
 
         print("SCC of interest contains {} of {} regions".format(rlen, total))
-        print("SCC of interest can reach {} of {} regions".format(n_reachable_reg, total))
\ No newline at end of file
+        print("SCC of interest can reach {} of {} regions".format(n_reachable_reg, total))
+
+    if args.all_regions:
+        counts = index.reach_counts()
+        ranked = sorted(counts.keys(), key = lambda r : counts[r], reverse=True)
+        print("{:>6} {:>8} {:>10}  {}".format("RANK", "SCC_SIZE", "REACHABLE", "REGION"))
+        for i, r in enumerate(ranked):
+            print("{:>6} {:>8} {:>10}  {}".format(i, index.scc_size(r), counts[r], r))
\ No newline at end of file
@@ -2,14 +2,20 @@
 Run the heap analysis code!
 Example: python harvest_heap_data.py 'gnome-terminal -- vim' --pgrepattach vim --num_repeats 10 --pgrepkill vim --outdir vim_heap_analysis
 Example: python harvest_heap_data.py 'firefox mozilla.org' --outdir ff_heap --attach_time 15 --num_repeats 10 --pgrepattach 'Web Content' --pgrepkill 'firefox' --heap_region '' --length_lb 1048576 --length_ub 1048576
+Example: python harvest_heap_data.py 'firefox --new-instance --profile ff_profiles/{run} mozilla.org' --outdir ff_heap --attach_time 15 --num_repeats 10 --parallel 5 --pgrepattach 'Web Content' --pgrepkill 'firefox' --heap_region '' --length_lb 1048576 --length_ub 1048576
 See parser for input arguments. Reuslt files will be saved to "outdir," and can then be analyzed using `analyze.py`
 """
 
 import argparse
+import concurrent.futures
 import os
 import datetime
 import subprocess
+import sys
 import time
+import process_util
+import dumpstore
+import metrics
 
 parser = argparse.ArgumentParser()
 parser.add_argument("cmd", type=str, help="the command to run and analyze as it would normally be typed into a shell")
@@ -30,15 +36,76 @@ parser.add_argument("--nograph", dest='nograph', action='store_true', help="Don'
 
 parser.add_argument("--coalesce", dest='coalesce', action='store_true', help="combine adjacent same-named memory regions")
 parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a pointer in memory being analyzed")
+parser.add_argument("--nodump", dest='nodump', action='store_true', help="Stream regions straight from the target into the pointer scanner without writing .dump files. Only the maplists and memgraphs are saved")
+parser.add_argument("--parallel", type=int, default=1, help="Number of target instances to run at once (requires --attach_time > 0). Target processes must stay descendants of the launched command. Any '{run}' in cmd is replaced by the run index, e.g. to give each instance its own profile directory")
+parser.add_argument("--allpids", action='store_true', help="Snapshot every process matching --pgrepattach at once instead of just the first one. Each process is saved as its own run (run{i}_p{pid}_*), which analyze.py treats as a separate sample")
+parser.add_argument("--lowpause", action='store_true', help="Keep the target stopped only while its memory is copied out: detach/resume before scanning for pointers. The measured pause is saved in each run's metrics.json")
+parser.add_argument("--pagestore", action='store_true', help="After each snapshot, move the run's dumps into the dataset's content-addressed page store (outdir/pages), so pages repeated across runs are stored once")
+parser.add_argument("--backend", choices=["gdb", "proc"], default="gdb", help="How to snapshot the target: attach with GDB, or read /proc/<pid>/mem directly (no GDB needed)")
 
 
 args = parser.parse_args()
 
-os.makedirs(args.outdir, exist_ok=True)
-for i in range(args.num_repeats):
-    
-    print("Launching...")
-    child = subprocess.Popen(args.cmd, shell=True)
+if args.nodump and args.nograph:
+    exit("--nodump streams memory into the graph builder, so it can't be combined with --nograph")
+if args.parallel > 1 and args.attach_time == 0:
+    exit("--parallel needs a non-interactive target (--attach_time > 0)")
+if args.allpids and len(args.pgrepattach) == 0:
+    exit("--allpids needs a --pgrepattach expression to find the processes")
+
+"""
+Snapshot one target process and save its maplist, dumps and memgraph
+pid = process to snapshot
+prefix = prefix of the saved files within outdir. Ex: "run0_"
+"""
+def snapshot(pid, prefix):
+    list_string = '["{}"]'.format(args.heap_region)
+
+    if args.backend == "proc":
+        # read the VMAs and memory straight from /proc and scan for pointers
+        os.system("sudo {}{} cartography_proc.py {} --sources '{}' --name '{}' --length_lb {} --length_ub {} --pointer_sz {}{}{}{}{}" \
+            .format(
+                metrics.sudo_env(),
+                sys.executable,
+                pid,
+                args.heap_region,
+                "{}/{}".format(args.outdir, prefix),
+                args.length_lb,
+                args.length_ub,
+                args.pointer_sz,
+                " --nograph" if args.nograph else "",
+                " --nodump" if args.nodump else "",
+                " --coalesce" if args.coalesce else "",
+                " --lowpause" if args.lowpause else ""))
+    else:
+        # call into the gdb script to map the VMAs and scann for pointers
+        os.system("sudo {}gdb -x cartography_gdb.py -ex 'py gdb_main({}, sources={}, name=\"{}\", llb={}, lub={}, graph={}, psize={}, coalesce={}, dump={}, lowpause={})'" \
+            .format(
+                metrics.sudo_env(),
+                pid, 
+                list_string, 
+                "{}/{}".format(args.outdir, prefix), 
+                args.length_lb,
+                args.length_ub,
+                not args.nograph,
+                args.pointer_sz,
+                args.coalesce,
+                not args.nodump,
+                args.lowpause))
+
+    if store is not None:
+        raw, added = dumpstore.store_run_dumps("{}/{}".format(args.outdir, prefix), store)
+        print("Moved {} bytes of dumps into the page store ({} new)".format(raw, added))
+
+"""
+Launch the target, snapshot it and kill it
+i = run index
+isolated = only look for and kill processes descended from this run's launch, so that other
+           instances running at the same time are left alone
+"""
+def harvest_run(i, isolated=False):
+    print("Launching run {}...".format(i))
+    child = subprocess.Popen(args.cmd.replace("{run}", str(i)), shell=True)
     if args.attach_time == 0:
         input("Press any key to pause and analyze memory...")
     else:
@@ -46,32 +113,51 @@ for i in range(args.num_repeats):
         time.sleep(args.attach_time)
 
     if len(args.pgrepattach) > 0:
-        if len(args.pgrepuser) > 0:
-            proc = subprocess.Popen(['pgrep', '-u', args.pgrepuser, args.pgrepattach], stdout=subprocess.PIPE)
-        else:
-            proc = subprocess.Popen(['pgrep', args.pgrepattach], stdout=subprocess.PIPE)
-        pid = int(proc.stdout.read().decode().split("\n")[0])
+        pids = process_util.find_pids(args.pgrepattach, args.pgrepuser, child.pid if isolated else None)
+        if len(pids) == 0:
+            print("run {}: no process matching '{}' found".format(i, args.pgrepattach))
+            process_util.kill_pids(process_util.descendants(child.pid)[::-1], args.killsig)
+            return
+        if not args.allpids:
+            pids = pids[:1]
     else:
-        pid = child.pid
-
+        pids = [child.pid]
 
-    list_string = '["{}"]'.format(args.heap_region)
+    if args.allpids:
+        # every matching process is an extra sample from this launch. Snapshot them all at once
+        # so that they are captured in (nearly) the same state.
+        print("run {}: snapshotting {} processes: {}".format(i, len(pids), pids))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pids)) as pool:
+            for _ in pool.map(lambda pid : snapshot(pid, "run{}_p{}_".format(i, pid)), pids):
+                pass
+    else:
+        snapshot(pids[0], "run{}_".format(i))
 
-    # call into the gdb script to map the VMAs and scann for pointers
-    os.system("sudo gdb -x cartography_gdb.py -ex 'py gdb_main({}, sources={}, name=\"{}\", llb={}, lub={}, graph={}, psize={}, coalesce={})'" \
-        .format(
-            pid, 
-            list_string, 
-            "{}/run{}_".format(args.outdir, i), 
-            args.length_lb,
-            args.length_ub,
-            not args.nograph,
-            args.pointer_sz,
-            args.coalesce))
-    
     # determine who to kill
-    if len(args.pgrepkill) > 0:
+    if isolated:
+        if len(args.pgrepkill) > 0:
+            victims = process_util.find_pids(args.pgrepkill, root=child.pid)
+        else:
+            victims = pids
+        process_util.kill_pids(victims, args.killsig)
+    elif len(args.pgrepkill) > 0:
         os.system("pkill -{} '{}'".format(args.killsig, args.pgrepkill))    
     else:
-        os.system("kill -{} {}".format(args.killsig, pid))  
-    time.sleep(3)  
\ No newline at end of file
+        process_util.kill_pids(pids, args.killsig)
+    time.sleep(3)
+
+
+os.makedirs(args.outdir, exist_ok=True)
+store = dumpstore.PageStore(args.outdir) if args.pagestore else None
+if args.parallel > 1:
+    # independent instances, each with its own run index and output prefix. While one
+    # instance is being snapshotted the others keep warming up.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        for _ in pool.map(lambda i : harvest_run(i, isolated=True), range(args.num_repeats)):
+            pass
+else:
+    for i in range(args.num_repeats):
+        harvest_run(i)
+
+if store is not None:
+    store.close()
@@ -0,0 +1,105 @@
+"""
+Local stand-in for a leaking target: replays existing dumps as a stream of leaked buffers, for testing and
+benchmarking leak_scanner.py without a vulnerable server.
+  stream: send the dumps' bytes in order, in pieces of random size up to --max_leak
+  leaks: send --count buffers copied from random offsets of the dumps, each with a random size up to --max_leak
+         and prefixed with its 4-byte little-endian length, like the heartbeat responses of a Heartbleed-style bug
+Output goes to stdout, or to a local socket leak_scanner.py is listening on.
+Example: python leak_replay.py ff_heap/run0_[heap]_1.dump --mode leaks --count 10000 | python leak_scanner.py ff_heap/fingerprint_rank0.npz - --framed --unaligned
+Example: python leak_replay.py apache_heap/run*_[heap]_1.dump --target unix:/tmp/leaks.sock --rate 50
+"""
+
+import argparse
+import socket
+import sys
+import time
+import numpy as np
+import dumpstore
+from leak_scanner import LEAK_MAX, HEADER_SZ
+
+
+"""
+Connect to the destination of the replay
+target = "-" for stdout, "unix:PATH" or "tcp:HOST:PORT"
+returns a function that sends bytes, and a function that closes the destination
+"""
+def open_target(target):
+    if target == "-":
+        return sys.stdout.buffer.write, sys.stdout.buffer.flush
+    if target.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target[5:])
+    else:
+        host, port = target[4:].rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)))
+    return sock.sendall, sock.close
+
+"""
+The buffers to replay
+dumps = list of uint8 arrays
+mode = "stream" or "leaks" (see above)
+count = number of leaks, in "leaks" mode
+max_leak = largest buffer
+seed = seed of the random sizes and offsets
+returns (generator) the bytes to send for each buffer, including the length prefix in "leaks" mode
+"""
+def replay_buffers(dumps, mode="stream", count=1000, max_leak=LEAK_MAX, seed=0):
+    rng = np.random.default_rng(seed)
+    if mode == "stream":
+        for dump in dumps:
+            pos = 0
+            while pos < len(dump):
+                n = int(rng.integers(1, max_leak + 1))
+                yield dump[pos:pos + n].tobytes()
+                pos += n
+        return
+
+    sizes = np.array([len(d) for d in dumps], dtype=np.float64)
+    for _ in range(count):
+        dump = dumps[rng.choice(len(dumps), p=sizes / sizes.sum())]
+        n = min(int(rng.integers(1, max_leak + 1)), len(dump))
+        start = int(rng.integers(0, len(dump) - n + 1))
+        yield n.to_bytes(HEADER_SZ, "little") + dump[start:start + n].tobytes()
+
+"""
+Send the buffers to a target
+rate = limit in MB/s (0 = as fast as possible)
+returns (bytes sent, seconds)
+"""
+def replay(target, buffers, rate=0):
+    send, close = open_target(target)
+    t0 = time.perf_counter()
+    sent = 0
+    for data in buffers:
+        send(data)
+        sent += len(data)
+        if rate > 0:
+            time.sleep(max(0, t0 + sent / (rate * 1e6) - time.perf_counter()))
+    close()
+    return sent, time.perf_counter() - t0
+
+"""
+Load dumps of any stored format
+returns a list of uint8 arrays
+"""
+def load_dumps(filenames):
+    dumps = []
+    for f in filenames:
+        with dumpstore.open_stored(f) as handle:
+            dumps.append(np.frombuffer(handle.read(), dtype=np.uint8))
+    return dumps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dumps", nargs="+", help="dump files to replay (.dump, .cdump or .pages)")
+    parser.add_argument("--target", type=str, default="-", help="'-' for stdout, or unix:PATH / tcp:HOST:PORT of a listening leak_scanner.py")
+    parser.add_argument("--mode", choices=["stream", "leaks"], default="stream", help="replay the dumps in order, or as length-prefixed leaks from random offsets")
+    parser.add_argument("--count", type=int, default=1000, help="number of leaks to send in 'leaks' mode")
+    parser.add_argument("--max_leak", type=int, default=LEAK_MAX, help="largest buffer sent at a time")
+    parser.add_argument("--rate", type=float, default=0, help="limit the replay to this many MB/s. If 0, send as fast as possible")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the buffer sizes and offsets")
+    args = parser.parse_args()
+
+    sent, elapsed = replay(args.target, replay_buffers(load_dumps(args.dumps), args.mode, args.count, args.max_leak, args.seed), args.rate)
+    print("Sent {} bytes in {:.2f}s ({:.1f} MB/s)".format(sent, elapsed, sent / max(elapsed, 1e-9) / 1e6), file=sys.stderr)
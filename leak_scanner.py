@@ -0,0 +1,281 @@
+"""
+Apply fingerprints saved by analyze.py --save to leaked memory as it arrives, e.g. the stream of small buffers
+(up to 64 KiB each) a Heartbleed-style bug returns, instead of to a complete dump. Input is read from stdin,
+from a file that keeps growing (like tail -f), or from a local unix/TCP socket, with asyncio.
+Two input layouts are supported:
+  stream: one contiguous piece of memory, split at arbitrary points (e.g. a dump being replayed)
+  leaks: independent leaked buffers, each sent as a 4-byte little-endian length followed by the bytes (--framed)
+Windows that straddle read boundaries are carried over, so each window is tested exactly once (within a leak, for
+framed input). Every match is reported as it arrives, with the pointer value and the region base it implies;
+a base is reported as confirmed once --confirm matches agree on it.
+Example: python leak_replay.py ff_heap/run0_[heap]_1.dump --mode leaks | python leak_scanner.py ff_heap/fingerprint_rank0.npz - --framed --unaligned
+Example: python leak_scanner.py apache_heap/fingerprint_rank*.npz unix:/tmp/leaks.sock --framed --unaligned --confirm 3
+Example: python leak_scanner.py vim_heap/fingerprint_rank0.npz leaked.bin --idle 30
+"""
+
+import argparse
+import asyncio
+import fcntl
+import os
+import stat
+import sys
+import time
+import numpy as np
+from fingerprint import Fingerprint, ChunkMatcher
+
+LEAK_MAX = 1 << 16 # largest buffer a single heartbeat response can leak
+READ_SZ = 1 << 20 # bytes requested per read from the source
+HEADER_SZ = 4 # length prefix of each leak in framed input
+
+
+"""
+Reader of a file that may still be growing, with the read/readexactly calls of asyncio.StreamReader.
+At the end of the file it polls for new data, and reports the end of the input once nothing
+has been appended for `idle` seconds (never, if idle is 0).
+"""
+class TailReader:
+
+    """
+    filename = file to read
+    idle = seconds without new data after which the input is considered finished
+    poll = seconds between checks for new data
+    """
+    def __init__(self, filename, idle=0, poll=0.05):
+        self.f = open(filename, "rb")
+        self.idle = idle
+        self.poll = poll
+
+    """
+    Read up to n bytes, waiting for the file to grow if needed
+    returns b"" at the end of the input
+    """
+    async def read(self, n):
+        waited = 0
+        while True:
+            data = self.f.read(n)
+            if len(data) > 0:
+                return data
+            if self.idle > 0 and waited >= self.idle:
+                return b""
+            await asyncio.sleep(self.poll)
+            waited += self.poll
+
+    """
+    Read exactly n bytes
+    raises asyncio.IncompleteReadError if the input ends first
+    """
+    async def readexactly(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = await self.read(n - len(data))
+            if len(chunk) == 0:
+                raise asyncio.IncompleteReadError(data, n)
+            data += chunk
+        return data
+
+    """
+    Close the file
+    """
+    def close(self):
+        self.f.close()
+
+
+"""
+Running tally of the region bases implied by the matches of each fingerprint
+"""
+class BaseTally:
+
+    """
+    fingerprints = list of Fingerprint
+    confirm = number of matches that must agree on a base before it is reported as confirmed
+    """
+    def __init__(self, fingerprints, confirm=2):
+        self.fingerprints = fingerprints
+        self.confirm = confirm
+        self.votes = [{} for _ in fingerprints] # fingerprint index -> {base : number of matches}
+        self.confirmed = [None for _ in fingerprints]
+        self.matches = [0 for _ in fingerprints]
+
+    """
+    Count the matches of one fingerprint
+    k = index of the fingerprint
+    values = pointer values of the matches
+    returns the base that this call confirmed, or None
+    """
+    def add(self, k, values):
+        self.matches[k] += len(values)
+        newly = None
+        bases, counts = np.unique(np.asarray(values, dtype=np.uint64) - np.uint64(self.fingerprints[k].offset), return_counts=True)
+        for base, count in zip(bases.tolist(), counts.tolist()):
+            self.votes[k][base] = self.votes[k].get(base, 0) + count
+            if self.confirmed[k] is None and self.votes[k][base] >= self.confirm:
+                self.confirmed[k] = newly = base
+        return newly
+
+    """
+    Most common bases of a fingerprint
+    returns a list of (base, number of matches), most common first
+    """
+    def best(self, k, n=3):
+        return sorted(self.votes[k].items(), key=lambda kv : -kv[1])[:n]
+
+
+"""
+Pieces of the input, read as they arrive
+reader = asyncio.StreamReader or TailReader
+framed = the input is a sequence of length-prefixed leaks rather than one contiguous stream
+returns (async generator) (piece, whether the piece ends a leak). Unframed input is a single leak,
+ended by an empty piece at the end of the input
+"""
+async def read_pieces(reader, framed=False, read_sz=READ_SZ):
+    if not framed:
+        while True:
+            data = await reader.read(read_sz)
+            yield data, len(data) == 0
+            if len(data) == 0:
+                return
+
+    while True:
+        try:
+            header = await reader.readexactly(HEADER_SZ)
+        except asyncio.IncompleteReadError:
+            return
+        remaining = int.from_bytes(header, "little")
+        if remaining == 0:
+            continue
+        while remaining > 0:
+            data = await reader.read(min(remaining, read_sz))
+            if len(data) == 0:
+                yield b"", True # truncated leak
+                return
+            remaining -= len(data)
+            yield data, remaining == 0
+
+
+"""
+Match one input against the fingerprints as it arrives
+reader = asyncio.StreamReader or TailReader
+fingerprints = list of Fingerprint
+tally = BaseTally that collects the matches
+framed = see `read_pieces`
+base = address of the first byte of the input (of each leak, for framed input)
+report = called as report(leak number, fingerprint index, offsets within the leak, pointer values, newly confirmed base or None)
+         for the matches of each fingerprint, as soon as the bytes after them have arrived
+returns a dictionary with the number of bytes and leaks read and the time spent
+"""
+async def scan_stream(reader, fingerprints, tally, framed=False, base=0, report=None, read_sz=READ_SZ):
+    t0 = time.perf_counter()
+    nbytes = 0
+    leak = 0
+    matcher = ChunkMatcher(fingerprints, base)
+    async for data, last in read_pieces(reader, framed, read_sz):
+        nbytes += len(data)
+        results = matcher.feed(data) if len(data) > 0 else []
+        if last:
+            results += matcher.flush()
+        for k, offsets, values in results:
+            confirmed = tally.add(k, values)
+            if report is not None:
+                report(leak, k, offsets, values, confirmed)
+        if last:
+            leak += 1
+            matcher = ChunkMatcher(fingerprints, base)
+    return {"bytes" : nbytes, "leaks" : leak, "seconds" : time.perf_counter() - t0}
+
+
+"""
+Fingerprints that ignore alignment, for leaks whose address modulo the alignment is unknown
+"""
+def unaligned(fingerprints):
+    return [Fingerprint(fp.region, fp.offset, fp.lb, fp.ub, fp.preread, 1, 0, fp.pointer_sz, fp.stats) for fp in fingerprints]
+
+
+"""
+Read a source until it ends (or, for a listening socket, until `connections` connections have ended)
+source = "-" for stdin, "unix:PATH" or "tcp:HOST:PORT" to listen on a local socket, or the path of a file to follow
+idle = for files, seconds without new data after which the input ends (0 = follow forever)
+ready = optional asyncio.Event, set once the source is listening (or open)
+returns the list of `scan_stream` statistics, one per input
+"""
+async def scan_source(source, fingerprints, tally, framed=False, base=0, report=None, idle=0, connections=0, ready=None, read_sz=READ_SZ):
+    if source.startswith("unix:") or source.startswith("tcp:"):
+        stats = []
+        done = asyncio.Event()
+
+        async def handle(reader, writer):
+            stats.append(await scan_stream(reader, fingerprints, tally, framed, base, report, read_sz))
+            writer.close()
+            if connections > 0 and len(stats) >= connections:
+                done.set()
+
+        if source.startswith("unix:"):
+            if os.path.exists(source[5:]):
+                os.remove(source[5:])
+            server = await asyncio.start_unix_server(handle, path=source[5:], limit=2 * read_sz)
+        else:
+            host, port = source[4:].rsplit(":", 1)
+            server = await asyncio.start_server(handle, host, int(port), limit=2 * read_sz)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await done.wait()
+        return stats
+
+    if source == "-":
+        if hasattr(fcntl, "F_SETPIPE_SZ") and stat.S_ISFIFO(os.fstat(sys.stdin.fileno()).st_mode):
+            try:
+                fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETPIPE_SZ, read_sz) # fewer, larger reads than the default 64 KiB pipe
+            except OSError:
+                pass
+        reader = asyncio.StreamReader(limit=2 * read_sz)
+        await asyncio.get_running_loop().connect_read_pipe(lambda : asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    else:
+        reader = TailReader(source, idle)
+    if ready is not None:
+        ready.set()
+    stats = [await scan_stream(reader, fingerprints, tally, framed, base, report, read_sz)]
+    if isinstance(reader, TailReader):
+        reader.close()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fingerprints", nargs="+", help="fingerprint files written by analyze.py --save")
+    parser.add_argument("source", help="'-' for stdin, unix:PATH or tcp:HOST:PORT to listen on a local socket, or a file to follow as it grows")
+    parser.add_argument("--framed", action='store_true', help="The input is a sequence of independent leaks, each prefixed with its 4-byte little-endian length")
+    parser.add_argument("--unaligned", action='store_true', help="Test windows at every byte offset, for leaks that don't start at a known alignment")
+    parser.add_argument("--base", type=lambda x: int(x, 0), default=0, help="address of the first byte of the input (of every leak, with --framed), for alignment and reported addresses")
+    parser.add_argument("--confirm", type=int, default=2, help="report a region base as confirmed once this many matches agree on it")
+    parser.add_argument("--idle", type=float, default=0, help="when following a file, stop after this many seconds without new data. If 0, follow forever")
+    parser.add_argument("--connections", type=int, default=0, help="when listening on a socket, stop after this many connections have closed. If 0, keep listening")
+    parser.add_argument("--quiet", action='store_true', help="Only report confirmed bases and the final summary, not every match")
+    args = parser.parse_args()
+
+    fingerprints = [Fingerprint(load_file=f) for f in args.fingerprints]
+    if args.unaligned:
+        fingerprints = unaligned(fingerprints)
+    tally = BaseTally(fingerprints, args.confirm)
+
+    def report(leak, k, offsets, values, confirmed):
+        fp = fingerprints[k]
+        if not args.quiet:
+            for offset, value in zip(offsets.tolist(), values.tolist()):
+                print("leak {} +{}: pointer to {}+{} ({}), base {}".format(leak, hex(args.base + offset), fp.region, hex(fp.offset),
+                    hex(value), hex(value - fp.offset)))
+            sys.stdout.flush()
+        if confirmed is not None:
+            print("CONFIRMED: {} is at {}".format(fp.region, hex(confirmed)), flush=True)
+
+    try:
+        stats = asyncio.run(scan_source(args.source, fingerprints, tally, args.framed, args.base, report, args.idle, args.connections))
+    except KeyboardInterrupt:
+        stats = []
+
+    # time from the start to the end of each input, excluding waits for connections
+    nbytes = sum([s["bytes"] for s in stats])
+    elapsed = max(sum([s["seconds"] for s in stats]), 1e-9)
+    print("Read {} bytes in {} leaks over {:.2f}s ({:.1f} MB/s)".format(nbytes, sum([s["leaks"] for s in stats]), elapsed, nbytes / elapsed / 1e6))
+    for k, fp in enumerate(fingerprints):
+        print("    {}: {} matches. Most common base of {}: {}".format(args.fingerprints[k], tally.matches[k], fp.region,
+            ", ".join(["{} ({}x)".format(hex(b), c) for b, c in tally.best(k)]) or "-"))
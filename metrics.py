@@ -0,0 +1,159 @@
+"""
+Per-run measurements (e.g. how long the target was paused), saved next to the run's
+other files as <prefix>metrics.json
+
+Pipeline stages (attaching, dumping, scanning, (de)serializing, ranking, ...) are timed with `stage`
+and saved under the "stages" key of the metrics file. Setting the environment variable
+CARTOGRAPHY_PROFILE to "cprofile", "tracemalloc" or "cprofile,tracemalloc" additionally profiles
+the outermost stages (saved as <prefix><stage>.prof) and/or records their peak traced allocations.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+
+PROFILE_ENV = "CARTOGRAPHY_PROFILE"
+PROFILE = set(filter(None, os.environ.get(PROFILE_ENV, "").split(",")))
+
+
+"""
+Path of the metrics file for a run
+prefix = path prefix of the run's files. Ex: "vim_map/run0_"
+"""
+def metrics_path(prefix):
+    return prefix + "metrics.json"
+
+"""
+Load the metrics recorded for a run
+returns a dictionary, empty if nothing was recorded
+"""
+def load_metrics(prefix):
+    if not os.path.exists(metrics_path(prefix)):
+        return {}
+    with open(metrics_path(prefix), "r") as f:
+        return json.load(f)
+
+"""
+Add measurements to a run's metrics file, keeping any that were recorded earlier.
+The file is replaced atomically, so concurrent readers never see it half-written.
+prefix = path prefix of the run's files
+values = measurements to save, by name
+"""
+def record_metrics(prefix, **values):
+    metrics = load_metrics(prefix)
+    metrics.update(values)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(metrics_path(prefix)) or ".", prefix=".metrics.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(metrics, f, indent=2)
+        os.chmod(tmp, 0o644) # mkstemp creates the file private to its owner
+        os.replace(tmp, metrics_path(prefix))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+"""
+Variable assignment to put after `sudo` in a shell command so that the snapshot it runs is profiled
+like this process ("" when profiling is off). sudo drops the environment otherwise.
+"""
+def sudo_env():
+    if len(PROFILE) == 0:
+        return ""
+    return "{}={} ".format(PROFILE_ENV, ",".join(sorted(PROFILE)))
+
+_local = threading.local() # stack of the stages open in each thread
+_totals = {} # (prefix, stage name) -> record accumulated by this process
+
+"""
+Add counters to the innermost open stage of this thread. Does nothing outside of a stage.
+counters = amounts to add, by name. Ex: bytes_read=4096, edges=12
+"""
+def count(**counters):
+    active = getattr(_local, "active", None)
+    if active:
+        rec = active[-1][1]
+        for k, v in counters.items():
+            rec[k] = rec.get(k, 0) + v
+
+"""
+Time a pipeline stage and save it to a run's metrics file.
+The record holds the wall time, the process' peak RSS so far, and any counters added with `count`
+(bytes_read, bytes_written, words, edges, ...). Scanning rates are derived from the "words" counter.
+If the same stage runs several times in a process, the calls are added up. Each new process
+replaces the record it finds in the metrics file.
+name = name of the stage
+prefix = path prefix of the run's files. If None, the prefix of the enclosing stage is used, and if
+         there is none, the stage is timed but not saved
+yields the record, a dictionary
+"""
+@contextlib.contextmanager
+def stage(name, prefix=None):
+    active = getattr(_local, "active", None)
+    if active is None:
+        active = _local.active = []
+    if prefix is None and len(active) > 0:
+        prefix = active[-1][0]
+
+    rec = {}
+    profiler = None
+    if "cprofile" in PROFILE and len(active) == 0:
+        profiler = cProfile.Profile()
+    if "tracemalloc" in PROFILE:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif len(active) > 0:
+            # keep the enclosing stage's peak before restarting the measurement for this one
+            active[-1][1]["_child_peak"] = max(active[-1][1].get("_child_peak", 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    active.append((prefix, rec))
+    t0 = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield rec
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        rec["wall_s"] = time.perf_counter() - t0
+        rec["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        active.pop()
+
+        if "tracemalloc" in PROFILE:
+            peak = max(tracemalloc.get_traced_memory()[1], rec.pop("_child_peak", 0))
+            rec["traced_peak_bytes"] = peak
+            if len(active) > 0:
+                active[-1][1]["_child_peak"] = max(active[-1][1].get("_child_peak", 0), peak)
+        if profiler is not None and prefix is not None:
+            profiler.dump_stats("{}{}.prof".format(prefix, name))
+
+        if prefix is not None:
+            _save_stage(prefix, name, rec)
+
+"""
+Add a finished stage to this process' totals and write them to the run's metrics file
+"""
+def _save_stage(prefix, name, rec):
+    total = _totals.setdefault((prefix, name), {"calls" : 0})
+    total["calls"] += 1
+    for k, v in rec.items():
+        if k in ["peak_rss_kb", "traced_peak_bytes"]:
+            total[k] = max(total.get(k, 0), v)
+        else:
+            total[k] = total.get(k, 0) + v
+    if total.get("words", 0) > 0 and total["wall_s"] > 0:
+        total["words_per_s"] = total["words"] / total["wall_s"]
+
+    try:
+        stages = load_metrics(prefix).get("stages", {})
+        stages[name] = total
+        record_metrics(prefix, stages=stages)
+    except (OSError, ValueError):
+        pass # e.g. a read-only dataset, or a file another process is rewriting; the measurements are only informational
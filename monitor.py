@@ -0,0 +1,99 @@
+"""
+Snapshot a long-running process (e.g. an Apache worker under load) every few seconds and watch how its pointers change.
+Snapshots stream the target's memory into the pointer scanner without writing dumps, and only pages whose contents
+changed since the previous snapshot are rescanned; the edges of the other pages are patched in from the previous
+snapshot (see build_graph.scan_changed_pages). Each snapshot is saved as a run (run{i}_maplist.json, run{i}_memgraph.json),
+and the number of pointers to every (destination region, offset) is appended to outdir/pointer_series.npz
+(see data_structures.PointerSeries). Re-running with the same outdir continues the series.
+Example: python monitor.py $(pgrep -o apache2) --outdir apache_mon --interval 10 --count 360 --backend proc
+Example: python monitor.py 1234 --outdir vim_mon --sources '[heap]' --interval 5 --keep 10
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import data_structures
+import metrics
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pid", type=int, help="process to monitor")
+parser.add_argument("--outdir", type=str, default="monitor", help="directory to save the snapshots and the pointer time series to")
+parser.add_argument("--interval", type=float, default=10, help="seconds between the starts of consecutive snapshots")
+parser.add_argument("--count", type=int, default=0, help="number of snapshots to take. If 0, keep going until the process exits")
+parser.add_argument("--sources", nargs="+", default=None, help="names of regions to scan (e.g. [heap]). If not provided, all regions are scanned")
+parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a pointer in memory being analyzed")
+parser.add_argument("--coalesce", action='store_true', help="combine adjacent same-named memory regions")
+parser.add_argument("--lowpause", action='store_true', help="Copy the target's memory out and resume it before scanning, instead of scanning while it is stopped")
+parser.add_argument("--min_count", type=int, default=5, help="only start tracking a (destination, offset) once a snapshot holds at least this many pointers to it")
+parser.add_argument("--keep", type=int, default=0, help="only keep the files of the last KEEP snapshots (the time series keeps everything). If 0, keep all of them")
+parser.add_argument("--backend", choices=["gdb", "proc"], default="gdb", help="How to snapshot the target: attach with GDB, or read /proc/<pid>/mem directly (no GDB needed)")
+args = parser.parse_args()
+
+"""
+Take one incremental snapshot of the target
+prefix = path prefix of the snapshot's files. Ex: "apache_mon/run3_"
+"""
+def snapshot(prefix):
+    if args.backend == "proc":
+        os.system("sudo {}{} cartography_proc.py {} --name '{}' --pointer_sz {} --sparse --nodump --incremental '{}'{}{}{}" \
+            .format(
+                metrics.sudo_env(),
+                sys.executable,
+                args.pid,
+                prefix,
+                args.pointer_sz,
+                state_file,
+                " --sources " + " ".join(["'{}'".format(s) for s in args.sources]) if args.sources else "",
+                " --coalesce" if args.coalesce else "",
+                " --lowpause" if args.lowpause else ""))
+    else:
+        os.system("sudo {}gdb -x cartography_gdb.py -ex 'py gdb_main({}, sources={}, name=\"{}\", psize={}, coalesce={}, sparse=True, dump=False, lowpause={}, incremental=\"{}\")'" \
+            .format(
+                metrics.sudo_env(),
+                args.pid,
+                json.dumps(args.sources),
+                prefix,
+                args.pointer_sz,
+                args.coalesce,
+                args.lowpause,
+                state_file))
+
+
+os.makedirs(args.outdir, exist_ok=True)
+state_file = args.outdir + "/monitor_state.npz"
+series_file = args.outdir + "/pointer_series.npz"
+series = data_structures.PointerSeries(load_file=series_file) if os.path.exists(series_file) else data_structures.PointerSeries()
+
+i = len(series.runnames)
+taken = 0
+while args.count == 0 or taken < args.count:
+    if not os.path.exists("/proc/{}".format(args.pid)):
+        print("Process {} exited".format(args.pid))
+        break
+
+    t0 = time.time()
+    prefix = "{}/run{}_".format(args.outdir, i)
+    snapshot(prefix)
+    if not os.path.exists(data_structures.memgraph_path(prefix)):
+        exit("Snapshot {} failed".format(i))
+
+    mg = data_structures.MemoryGraph(load_file=data_structures.memgraph_path(prefix), sparse=True)
+    series.append("run{}".format(i), t0, mg, args.min_count)
+    series.serialize(series_file)
+
+    stats = metrics.load_metrics(prefix)
+    scan = stats.get("stages", {}).get("build_graph", {})
+    print("Snapshot {}: {}/{} pages changed, {} edges, {} tracked pointers, paused {:.3f}s".format(
+        i, scan.get("changed_pages", "?"), scan.get("pages", "?"), scan.get("edges", "?"), len(series.offsets), stats.get("pause_s", 0)))
+
+    if args.keep > 0 and i >= args.keep:
+        for f in glob.glob(glob.escape("{}/run{}_".format(args.outdir, i - args.keep)) + "*"):
+            os.remove(f)
+
+    i += 1
+    taken += 1
+    if args.count == 0 or taken < args.count:
+        time.sleep(max(0, t0 + args.interval - time.time()))
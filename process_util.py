@@ -0,0 +1,67 @@
+"""
+Helpers for finding and killing the processes of a launched target
+Used by harvest_heap_data.py and refine_memory_map.py
+"""
+
+import os
+import subprocess
+
+
+"""
+Map every running pid to the list of its child pids, read from /proc/<pid>/stat
+"""
+def children_map():
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry), "r") as f:
+                stat = f.read()
+        except OSError:
+            continue # process exited while we were looking
+        # the command name may contain spaces, so parse the fields after its closing paren
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+"""
+List a process and all of its descendants
+pid = root of the process tree
+"""
+def descendants(pid):
+    children = children_map()
+    tree = [pid]
+    i = 0
+    while i < len(tree):
+        tree += children.get(tree[i], [])
+        i += 1
+    return tree
+
+"""
+Find processes with pgrep
+pattern = expression passed to pgrep
+user = only match processes owned by this user (pgrep -u), if not empty
+root = only match root and its descendants, if provided. Lets several instances of
+       the same target be told apart.
+returns a list of matching pids in ascending order
+"""
+def find_pids(pattern, user="", root=None):
+    if len(user) > 0:
+        proc = subprocess.Popen(['pgrep', '-u', user, pattern], stdout=subprocess.PIPE)
+    else:
+        proc = subprocess.Popen(['pgrep', pattern], stdout=subprocess.PIPE)
+    pids = [int(p) for p in proc.stdout.read().decode().split("\n") if len(p) > 0]
+    proc.wait()
+
+    if root is not None:
+        tree = set(descendants(root))
+        pids = [p for p in pids if p in tree]
+    return sorted(pids)
+
+"""
+Send a signal to a list of pids (and nothing else)
+"""
+def kill_pids(pids, sig):
+    if len(pids) > 0:
+        os.system("kill -{} {}".format(sig, " ".join([str(p) for p in pids])))
@@ -6,10 +6,15 @@ Example Usage: python refine_memory_map.py 'firefox mozilla.org' --outdir ff_map
 
 import data_structures
 import argparse
+import concurrent.futures
 import os
 import datetime
 import subprocess
+import sys
 import time
+import process_util
+import dumpstore
+import metrics
 
 parser = argparse.ArgumentParser()
 parser.add_argument("cmd", type=str, help="the command to run and analyze as it would normally be typed into a shell")
@@ -24,10 +29,56 @@ parser.add_argument("--pointer_sz", type=int, default=8, help="Length of a point
 parser.add_argument("--nograph", dest='nograph', action='store_true', help="Don't build out the graph. Just save the maplists and dumps and build the graph later")
 parser.add_argument("--killsig",type=int, default=9, help="Signal number to send for killing processes. Defaults to KILL")
 parser.add_argument("--coalesce", dest='coalesce', action='store_true', help="combine adjacent same-named memory regions")
+parser.add_argument("--nodump", dest='nodump', action='store_true', help="Stream regions straight from the target into the pointer scanner without writing .dump files. Only the maplists and memgraphs are saved")
+parser.add_argument("--allpids", action='store_true', help="Snapshot every process matching --pgrepattach at once instead of just the first one. Each process is saved as its own run (run{i}_p{pid}_*) and must agree with the others during refinement")
+parser.add_argument("--lowpause", action='store_true', help="Keep the target stopped only while its memory is copied out: detach/resume before scanning for pointers. The measured pause is saved in each run's metrics.json")
+parser.add_argument("--quorum", type=int, default=None, help="Keep edges present in at least this many of the runs. Defaults to all of them (strict intersection)")
+parser.add_argument("--pagestore", action='store_true', help="After each snapshot, move the run's dumps into the dataset's content-addressed page store (outdir/pages), so pages repeated across runs are stored once")
+parser.add_argument("--backend", choices=["gdb", "proc"], default="gdb", help="How to snapshot the target: attach with GDB, or read /proc/<pid>/mem directly (no GDB needed)")
 
 args = parser.parse_args()
 
+if args.nodump and args.nograph:
+    exit("--nodump streams memory into the graph builder, so it can't be combined with --nograph")
+if args.allpids and len(args.pgrepattach) == 0:
+    exit("--allpids needs a --pgrepattach expression to find the processes")
+
+"""
+Snapshot one target process and save its maplist, dumps and sparse memgraph
+pid = process to snapshot
+prefix = prefix of the saved files within outdir. Ex: "run0_"
+"""
+def snapshot(pid, prefix):
+    if args.backend == "proc":
+        os.system("sudo {}{} cartography_proc.py {} --name '{}' --pointer_sz {} --sparse{}{}{}{}" \
+            .format(
+                metrics.sudo_env(),
+                sys.executable,
+                pid,
+                "{}/{}".format(args.outdir, prefix),
+                args.pointer_sz,
+                " --nograph" if args.nograph else "",
+                " --nodump" if args.nodump else "",
+                " --coalesce" if args.coalesce else "",
+                " --lowpause" if args.lowpause else ""))
+    else:
+        os.system("sudo {}gdb -x cartography_gdb.py -ex 'py gdb_main({}, name=\"{}\", psize={}, graph={}, coalesce={}, sparse=True, dump={}, lowpause={})'" \
+            .format(
+                metrics.sudo_env(),
+                pid, 
+                "{}/{}".format(args.outdir, prefix), 
+                args.pointer_sz,
+                not args.nograph,
+                args.coalesce,
+                not args.nodump,
+                args.lowpause))
+
+    if store is not None:
+        raw, added = dumpstore.store_run_dumps("{}/{}".format(args.outdir, prefix), store)
+        print("Moved {} bytes of dumps into the page store ({} new)".format(raw, added))
+
 os.makedirs(args.outdir, exist_ok=True)
+store = dumpstore.PageStore(args.outdir) if args.pagestore else None
 if args.dump:
     for i in range(args.num_repeats):
         print("Launching...")
@@ -39,79 +90,67 @@ if args.dump:
             time.sleep(args.attach_time)
 
         if len(args.pgrepattach) > 0:
-            if len(args.pgrepuser) > 0:
-                proc = subprocess.Popen(['pgrep', '-u', args.pgrepuser, args.pgrepattach], stdout=subprocess.PIPE)
-            else:
-                proc = subprocess.Popen(['pgrep', args.pgrepattach], stdout=subprocess.PIPE)
-            pid = int(proc.stdout.read().decode().split("\n")[0])
+            pids = process_util.find_pids(args.pgrepattach, args.pgrepuser)
+            if not args.allpids:
+                pids = pids[:1]
         else:
-            pid = child.pid
+            pids = [child.pid]
 
         # dump the memory
-        os.system("sudo gdb -x cartography_gdb.py -ex 'py gdb_main({}, name=\"{}\", psize={}, graph={}, coalesce={})'" \
-            .format(
-                pid, 
-                "{}/run{}_".format(args.outdir, i), 
-                args.pointer_sz,
-                not args.nograph,
-                args.coalesce))
+        if args.allpids:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(pids), 1)) as pool:
+                for _ in pool.map(lambda pid : snapshot(pid, "run{}_p{}_".format(i, pid)), pids):
+                    pass
+        else:
+            snapshot(pids[0], "run{}_".format(i))
         
 
         # determine who to kill
         if len(args.pgrepkill) > 0:
             os.system("pkill -{} '{}'".format(args.killsig, args.pgrepkill))    
         else:
-            os.system("kill -{} {}".format(args.killsig, pid))  
+            process_util.kill_pids(pids, args.killsig)
 
+    if store is not None:
+        store.close()
     print("Finished dumping memory! Refining graph...")
 
 if not args.nograph:
 
-    #refine the memory graph
-    mg = None
-    for i in range(args.num_repeats):
-        newmg = data_structures.MemoryGraph(load_file=args.outdir + "/run{}_".format(i) + "memgraph.json")
-        if mg:
-            for src in mg.adj_matrix.keys():
-                for dst in mg.adj_matrix[src].keys():
-                    if (src not in newmg.adj_matrix) or (dst not in newmg.adj_matrix[src]):
-                        mg.adj_matrix[src][dst] = [] # remove inconcsistent edges
-                        continue
-
-                    edgelist = mg.adj_matrix[src][dst]
-                    newmg_eset = set(newmg.adj_matrix[src][dst])
-                    newlist = []
-                    for e in edgelist:
-                        if e in newmg_eset:
-                            newlist.append(e)
-                    mg.adj_matrix[src][dst] = newlist
-        else:
-            mg = newmg
-
-
-
-    # Increase map connectivity by adding links between regions 
-    # with the same name that are always direclty adjascent.
+    # every saved process of the first num_repeats launches is a sample
+    runnames = data_structures.list_runs(args.outdir, range(args.num_repeats))
+    prefixes = [args.outdir + "/" + rn + "_" for rn in runnames]
+    stamps = [data_structures.file_stamp(data_structures.memgraph_path(prefix)) for prefix in prefixes]
+
+    quorum = args.quorum if args.quorum is not None else len(runnames)
+    if quorum < 1 or quorum > len(runnames):
+        exit("--quorum must be between 1 and the number of runs ({})".format(len(runnames)))
+
+    # reuse the per-edge run counts from earlier refinements, and only fold in runs that are new
+    state_file = args.outdir + "/refine_state.npz"
+    state = None
+    if os.path.exists(state_file):
+        state = data_structures.RefinementState(load_file=state_file)
+        if not state.consistent_with(runnames, stamps):
+            state = None
+    if state is None:
+        state = data_structures.RefinementState()
+
+    for rn, prefix, stamp in zip(runnames, prefixes, stamps):
+        if rn in state.runnames:
+            continue
+        print("Folding in {}...".format(rn))
+        with metrics.stage("fold", args.outdir + "/"):
+            newmg = data_structures.MemoryGraph(load_file=data_structures.memgraph_path(prefix), sparse=True)
+            state.fold(rn, newmg, data_structures.MapList(load_file=prefix + "maplist.json"), stamp)
+    state.serialize(state_file)
+
+    # keep edges seen in at least `quorum` runs. Increase map connectivity by adding links between
+    # regions with the same name that are direclty adjascent in those runs.
     # Unnecessary if the maplists were already coalesced
+    with metrics.stage("refine", args.outdir + "/"):
+        mg = state.graph(quorum, link=not args.coalesce)
+        metrics.count(edges=int((state.edge_counts >= quorum).sum()))
 
-    if not args.coalesce:
-        mlists = [data_structures.MapList(load_file=args.outdir + "/run{}_".format(i) + "maplist.json")
-                for i in range(args.num_repeats)]
-        
-        for src in mg.adj_matrix.keys():
-            if any([src not in ml.regions_dict for ml in mlists]):
-                continue
-
-            for dst in mg.adj_matrix[src].keys():
-                if ("_".join(src.split("_")[:-1]) != "_".join(dst.split("_")[:-1]) 
-                    or len(mg.adj_matrix[src][dst]) > 0 or any([dst not in ml.regions_dict for ml in mlists])): 
-                    continue
-
-                src_bounds = [x.regions_dict[src] for x in mlists]
-                dst_bounds = [x.regions_dict[dst] for x in mlists]
-                if (all([s.end == d.start for (s,d) in zip(src_bounds, dst_bounds)]) or 
-                    all([s.start == d.end for (s,d) in zip(src_bounds, dst_bounds)])):
-
-                    mg.adj_matrix[src][dst].append((-1,-1)) #placeholder edge
-
-    mg.serialize(args.outdir + "/memgraph_final.json")
\ No newline at end of file
+    with metrics.stage("serialize_memgraph", args.outdir + "/"):
+        mg.serialize(args.outdir + "/memgraph_final.json")
@@ -0,0 +1,62 @@
+"""
+Apply fingerprints saved by analyze.py --save to raw memory files (dumps of any format, or any other file of memory bytes)
+and report every pointer whose surrounding window matches, with the region base the pointer implies.
+Files are read in large chunks and each chunk is matched with the lookup-table matcher of fingerprint.Fingerprint,
+so the scan runs at close to disk speed.
+Example: python scan_fingerprints.py vim_heap/fingerprint_rank0.npz --inputs vim_heap/run0_[heap]_0.dump
+Example: python scan_fingerprints.py ff_heap/fingerprint_rank*.npz --inputs core.dump --base 0x7f3a40000000 --print 0
+"""
+
+import argparse
+import time
+import numpy as np
+import dumpstore
+from fingerprint import Fingerprint, ChunkMatcher
+
+parser = argparse.ArgumentParser()
+parser.add_argument("fingerprints", nargs="+", help="fingerprint files written by analyze.py --save")
+parser.add_argument("--inputs", nargs="+", required=True, help="memory files to scan (.dump, .cdump, .pages or raw bytes)")
+parser.add_argument("--base", type=lambda x: int(x, 0), default=0, help="address of the first byte of each input, for alignment and reported addresses. Alignment only depends on it modulo the fingerprints' alignments, so 0 works for page-aligned dumps")
+parser.add_argument("--chunk_mb", type=int, default=64, help="MiB of input read and matched at a time")
+parser.add_argument("--print", dest="nprint", type=int, default=20, help="print at most this many matches per input and fingerprint. All matches are counted")
+args = parser.parse_args()
+
+fingerprints = [Fingerprint(load_file=f) for f in args.fingerprints]
+for name, fp in zip(args.fingerprints, fingerprints):
+    print("{}: DESTINATION={}, OFFSET={}, ALIGNMENT={}, WINDOW={}+{}, PRECISION={}".format(
+        name, fp.region, hex(fp.offset), fp.aln, fp.preread, fp.postread, fp.stats.get("precision", "?")))
+
+total_bytes = 0
+t0 = time.time()
+for infile in args.inputs:
+    matcher = ChunkMatcher(fingerprints, args.base)
+    counts = [0 for _ in fingerprints]
+    bases = [[] for _ in fingerprints] # region bases implied by the matches
+
+    t1 = time.time()
+    with dumpstore.open_stored(infile) as f:
+        while True:
+            nread, results = matcher.read_from(f, args.chunk_mb << 20)
+            if nread == 0:
+                results = matcher.flush()
+            for k, offsets, values in results:
+                fp = fingerprints[k]
+                for off, val in zip(offsets[:max(args.nprint - counts[k], 0)], values):
+                    print("{} {}: pointer to {}+{} ({}) at {}".format(infile, args.fingerprints[k], fp.region,
+                        hex(fp.offset), hex(int(val)), hex(args.base + int(off))))
+                counts[k] += len(offsets)
+                bases[k].append(values - np.uint64(fp.offset))
+            if nread == 0:
+                break
+
+    elapsed = max(time.time() - t1, 1e-9)
+    total_bytes += matcher.nbytes
+    print("{}: {} bytes in {:.2f}s ({:.1f} MB/s)".format(infile, matcher.nbytes, elapsed, matcher.nbytes / elapsed / 1e6))
+    for k, fp in enumerate(fingerprints):
+        uniq, freq = np.unique(np.concatenate(bases[k]), return_counts=True) if bases[k] else ([], [])
+        likely = sorted(zip(uniq, freq), key=lambda bc : -bc[1])[:3]
+        print("    {}: {} matches. Most common base of {}: {}".format(args.fingerprints[k], counts[k], fp.region,
+            ", ".join(["{} ({}x)".format(hex(int(b)), c) for b, c in likely]) if likely else "-"))
+
+elapsed = max(time.time() - t0, 1e-9)
+print("Scanned {} bytes in {:.2f}s ({:.1f} MB/s)".format(total_bytes, elapsed, total_bytes / elapsed / 1e6))
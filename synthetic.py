@@ -0,0 +1,242 @@
+"""
+Deterministic synthetic datasets for exercising the analysis pipeline without a live target or GDB.
+A dataset has the same layout as the output of harvest_heap_data.py / refine_memory_map.py --dump: per run
+a maplist, dumps of the heap regions (optionally of every region) and the run's memory graph.
+Every run shares one address-space layout (same regions, sizes and names) but gets its own ASLR slide and
+heap contents, and the heaps contain "objects" whose pointer and surrounding bytes follow a fixed pattern,
+so analyze.py has real fingerprints to find. The same arguments always produce byte-identical files.
+Example: python synthetic.py synth_small --runs 3 --regions 64 --heaps 2 --heap_kb 1024
+Example: python synthetic.py synth_map --runs 5 --regions 256 --dump_all --format npz
+"""
+
+import argparse
+import json
+import os
+import zlib
+import numpy as np
+import data_structures
+import build_graph
+
+PAGE_SZ = 4096
+BINARY = "/usr/bin/synthetic"
+LIB_SEGMENTS = 4 # r--, r-x, r--, rw- like a typical ld.so mapping
+PTR_FRAC = 0.2 # fraction of ordinary heap words that are pointers
+RANDOM_FRAC = 0.2 # fraction of ordinary heap words that are random 64-bit values (hashes, floats, ...)
+HOT_FRAC = 0.7 # fraction of pointers that go to the first 64 words of a region (vtables, globals, chunk headers)
+PLANTED_FRAC = 0.01 # fraction of 32-byte heap slots holding an object of each planted type
+
+
+"""
+Describe the address space shared by every run of a dataset
+regions = approximate number of regions in the maplist (at least 8 + heaps + 4)
+heaps = number of "[heap]" regions
+heap_kb = size of each heap region in KiB
+seed = seed of the layout
+returns a list of (name, size in bytes, kind) in address order. kind is one of "text", "data",
+"heap", "anon" and "special". Regions with the same name are numbered by MapList as usual.
+"""
+def synthetic_layout(regions, heaps, heap_kb, seed=0):
+    rng = np.random.default_rng([seed, 0])
+    libs = max(1, (regions - 8 - heaps) // 6)
+    anons = max(0, regions - 8 - heaps - LIB_SEGMENTS * libs)
+
+    layout = []
+    for kind in ["text", "text", "text", "data", "data"]:
+        layout.append((BINARY, int(rng.integers(4, 64)) * PAGE_SZ, kind))
+    for _ in range(heaps):
+        layout.append(("[heap]", heap_kb * 1024, "heap"))
+
+    # anonymous mappings sit between the libraries, as they do below mmap_base
+    gaps = np.sort(rng.integers(0, libs, anons))
+    for i in range(libs):
+        name = "/usr/lib/x86_64-linux-gnu/libsynth{}.so".format(i)
+        for kind in ["text", "text", "text", "data"]:
+            layout.append((name, int(rng.integers(1, 32)) * PAGE_SZ, kind))
+        for _ in range(np.count_nonzero(gaps == i)):
+            layout.append(("", int(rng.integers(1, 64)) * PAGE_SZ, "anon"))
+
+    layout.append(("[vvar]", 4 * PAGE_SZ, "special"))
+    layout.append(("[vdso]", 2 * PAGE_SZ, "special"))
+    layout.append(("[stack]", 33 * PAGE_SZ, "data"))
+    return layout
+
+"""
+Place a layout in the address space of one run
+layout = list returned by `synthetic_layout`
+rng = numpy Generator of the run, used for the ASLR slides
+returns a data_structures.MapList
+"""
+def synthetic_maplist(layout, rng):
+    maplist = data_structures.MapList()
+    bases = {
+        "binary" : 0x555555554000 + int(rng.integers(0, 1 << 20)) * PAGE_SZ,
+        "mmap" : 0x7f0000000000 + int(rng.integers(0, 1 << 24)) * PAGE_SZ,
+        "stack" : 0x7ffc00000000 + int(rng.integers(0, 1 << 20)) * PAGE_SZ,
+    }
+    for name, size, kind in layout:
+        if name == BINARY:
+            area = "binary"
+        elif name == "[heap]":
+            area = "binary"
+            if maplist.name_counter.get("[heap]") is None:
+                bases["binary"] += int(rng.integers(1, 1 << 12)) * PAGE_SZ # brk randomization
+        elif name == "[stack]":
+            area = "stack"
+        else:
+            area = "mmap"
+        maplist.add_region(data_structures.Region(bases[area], bases[area] + size, name))
+        bases[area] += size
+    return maplist
+
+"""
+Destinations of the planted object types. Each type points to its own fixed offset in a
+data segment, so the destination is the same (region, offset) in every run.
+returns a list of (region name, offset)
+"""
+def planted_targets(maplist, ntypes):
+    datasegs = [BINARY + "_3"] + [r.name for r in maplist.regions_list if r.name.startswith("/usr/lib/") and r.name.endswith("_3")]
+    targets = []
+    for k in range(ntypes):
+        name = datasegs[k % len(datasegs)]
+        reg = maplist.find_region(name)
+        targets.append((name, min(0x400 + 0x48 * k, reg.end - reg.start - 8)))
+    return targets
+
+"""
+Fill a region with 64-bit words: small integers, random values, pointers into the maplist and,
+optionally, planted objects
+rng = numpy Generator of the run
+nwords = number of words
+maplist = data_structures.MapList of the run
+ptr_frac = fraction of words that are pointers
+planted = list of (region name, offset) destinations. Each type gets PLANTED_FRAC of the 32-byte
+          slots, laid out as [tag + jitter, pointer, small count, 0]
+returns a uint64 array
+"""
+def synthetic_words(rng, nwords, maplist, ptr_frac=PTR_FRAC, planted=[]):
+    x = rng.random(nwords)
+    words = rng.integers(0, 256, nwords, dtype=np.uint64)
+
+    rand = (x >= ptr_frac) & (x < ptr_frac + RANDOM_FRAC)
+    words[rand] = rng.integers(0, np.iinfo(np.uint64).max, np.count_nonzero(rand), dtype=np.uint64, endpoint=True)
+
+    ptrs = np.flatnonzero(x < ptr_frac)
+    starts = np.array([r.start for r in maplist.regions_list], dtype=np.uint64)
+    nslots = np.array([(r.end - r.start) // 8 for r in maplist.regions_list], dtype=np.int64)
+    dst = rng.choice(len(starts), len(ptrs), p=nslots / nslots.sum())
+    hot = rng.random(len(ptrs)) < HOT_FRAC
+    slot = np.where(hot, rng.integers(0, 64, len(ptrs)) % nslots[dst], rng.integers(0, nslots[dst]))
+    words[ptrs] = starts[dst] + slot.astype(np.uint64) * np.uint64(8)
+
+    nobj = int(PLANTED_FRAC * (nwords // 4))
+    if len(planted) > 0 and nobj > 0:
+        slots = rng.choice(nwords // 4, min(nobj * len(planted), nwords // 4), replace=False) * 4
+        for k, (name, offset) in enumerate(planted):
+            pos = slots[k * nobj : (k + 1) * nobj]
+            words[pos] = np.uint64(0x1111 * (k + 1)) + rng.integers(0, 4, len(pos), dtype=np.uint64)
+            words[pos + 1] = np.uint64(maplist.find_region(name).start + offset)
+            words[pos + 2] = rng.integers(0, 64, len(pos), dtype=np.uint64)
+            words[pos + 3] = 0
+    return words
+
+"""
+Contents of a region that is identical in every run (code and read-only data), derived from its name
+returns bytes
+"""
+def static_bytes(name, size, seed=0):
+    rng = np.random.default_rng([seed, zlib.crc32(name.encode())])
+    return rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+
+"""
+Path of the file describing a synthetic dataset
+"""
+def description_path(outdir):
+    return os.path.join(outdir, "synthetic.json")
+
+"""
+Load the description of a synthetic dataset written by `generate_dataset`
+returns a dictionary, or None if outdir doesn't hold a synthetic dataset
+"""
+def load_description(outdir):
+    if not os.path.exists(description_path(outdir)):
+        return None
+    with open(description_path(outdir), "r") as f:
+        return json.load(f)
+
+"""
+Write a synthetic dataset
+outdir = directory to write to. Files are named like the harvest/refine outputs (run0_maplist.json, ...)
+runs = number of runs
+regions, heaps, heap_kb, seed = see `synthetic_layout`
+planted = number of planted object types
+dump_all = also dump every non-heap region (as refine_memory_map.py --dump does), not just the heaps
+graph = build each run's memory graph from its dumps
+fmt = file format of the memory graphs ("json" or "npz")
+returns the description saved as synthetic.json: the arguments, the heap region names and the planted destinations
+"""
+def generate_dataset(outdir, runs=3, regions=64, heaps=2, heap_kb=1024, seed=0, planted=2, dump_all=False, graph=True, fmt="json"):
+    os.makedirs(outdir, exist_ok=True)
+    layout = synthetic_layout(regions, heaps, heap_kb, seed)
+
+    for r in range(runs):
+        rng = np.random.default_rng([seed, 1, r])
+        prefix = os.path.join(outdir, "run{}_".format(r))
+        maplist = synthetic_maplist(layout, rng)
+        maplist.serialize(prefix + "maplist.json")
+        targets = planted_targets(maplist, planted)
+
+        kinds = {}
+        for (_, _, kind), reg in zip(layout, sorted(maplist.regions_list, key=lambda reg : reg.start)):
+            kinds[reg.name] = kind
+
+        for reg in maplist.regions_list:
+            kind = kinds[reg.name]
+            size = reg.end - reg.start
+            if kind == "heap":
+                data = synthetic_words(rng, size // 8, maplist, PTR_FRAC, targets).tobytes()
+            elif not dump_all or kind == "special":
+                continue
+            elif kind == "text":
+                data = static_bytes(reg.name, size, seed)
+            elif kind == "data":
+                data = synthetic_words(rng, size // 8, maplist, PTR_FRAC / 2).tobytes()
+            else:
+                # anonymous mappings are mostly untouched zero pages
+                words = synthetic_words(rng, size // 8, maplist, PTR_FRAC / 4)
+                words.reshape(-1, PAGE_SZ // 8)[rng.random(size // PAGE_SZ) < 0.5] = 0
+                data = words.tobytes()
+            with open(build_graph.dump_filename(prefix, reg.name), "wb") as f:
+                f.write(data)
+
+        if graph:
+            mg = build_graph.build_graph_from_dumps(maplist, dumpname=prefix)
+            mg.serialize(prefix + "memgraph." + fmt)
+
+    heapnames = [reg.name for reg in maplist.regions_list if reg.name.startswith("[heap]")]
+    description = {
+        "runs" : runs, "regions" : regions, "heaps" : heaps, "heap_kb" : heap_kb, "seed" : seed,
+        "planted" : planted, "dump_all" : dump_all, "format" : fmt,
+        "heapnames" : heapnames,
+        "targets" : [list(t) for t in planted_targets(maplist, planted)],
+    }
+    with open(description_path(outdir), "w") as f:
+        json.dump(description, f, indent=2)
+    return description
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outdir", help="directory to write the dataset to")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs")
+    parser.add_argument("--regions", type=int, default=64, help="approximate number of regions per maplist")
+    parser.add_argument("--heaps", type=int, default=2, help="number of [heap] regions")
+    parser.add_argument("--heap_kb", type=int, default=1024, help="size of each heap region in KiB")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator. The same arguments always produce the same dataset")
+    parser.add_argument("--planted", type=int, default=2, help="number of planted object types (each is a pointer fingerprint analyze.py should find)")
+    parser.add_argument("--dump_all", action='store_true', help="Dump every region, not just the heaps")
+    parser.add_argument("--nograph", action='store_true', help="Only write the maplists and dumps")
+    parser.add_argument("--format", choices=["json", "npz"], default="json", help="File format of the memory graphs")
+    args = parser.parse_args()
+
+    desc = generate_dataset(args.outdir, args.runs, args.regions, args.heaps, args.heap_kb, args.seed, args.planted, args.dump_all, not args.nograph, args.format)
+    print("Wrote {} runs to {}. Heaps: {}. Planted destinations: {}".format(args.runs, args.outdir, " ".join(desc["heapnames"]), desc["targets"]))